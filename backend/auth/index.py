@@ -6,230 +6,808 @@ Returns: JSON с токеном сессии или ошибкой
 
 import json
 import os
+import base64
+import hmac
+import struct
+import uuid
+import threading
+import weakref
+import time
 import hashlib
 import secrets
 import re
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+import sqlite3
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = 't_p5815085_family_assistant_pro'
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
 
-def generate_token() -> str:
-    return secrets.token_urlsafe(32)
+# Пул соединений живёт между тёплыми вызовами функции
+_pool_lock = threading.Lock()
+_idle_connections: List[Tuple[Any, float]] = []
 
-def validate_phone(phone: str) -> bool:
-    cleaned = re.sub(r'[^\d+]', '', phone)
-    return len(cleaned) >= 10 and len(cleaned) <= 15
+def _discard_connection(conn) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
 
-def escape_string(value: Any) -> str:
-    if value is None:
-        return 'NULL'
-    if isinstance(value, (int, float)):
-        return str(value)
-    if isinstance(value, bool):
-        return 'TRUE' if value else 'FALSE'
-    return "'" + str(value).replace("'", "''") + "'"
+def _is_connection_alive(conn, idle_for: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 def get_db_connection():
+    now = time.monotonic()
+    with _pool_lock:
+        stale = [c for c, released_at in _idle_connections if now - released_at >= DB_POOL_IDLE_TIMEOUT]
+        _idle_connections[:] = [item for item in _idle_connections if item[0] not in stale]
+    for conn in stale:
+        _discard_connection(conn)
+    
+    while True:
+        with _pool_lock:
+            if not _idle_connections:
+                break
+            conn, released_at = _idle_connections.pop()
+        if _is_connection_alive(conn, now - released_at):
+            return conn
+        _discard_connection(conn)
+    
     conn = psycopg2.connect(DATABASE_URL)
     conn.autocommit = True
     return conn
 
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard_connection(conn)
+        return
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_MAX_SIZE:
+            _idle_connections.append((conn, time.monotonic()))
+            return
+    _discard_connection(conn)
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+
+# Имена подготовленных на каждом соединении запросов; запись пропадает вместе с соединением
+_prepared_on_connection = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name: str, params: Tuple = ()) -> None:
+    """Выполняет запрос из PREPARED_STATEMENTS по имени; PREPARE делается один раз на соединение."""
+    sql = PREPARED_STATEMENTS[name]
+    if not PREPARED_STATEMENTS_ENABLED:
+        # Для пулеров в режиме транзакций: тот же текст, но обычным параметризованным запросом
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = _prepared_on_connection.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {sql}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+LOGIN_LOOKUP_SQL = f"""
+    SELECT u.id, u.email, u.phone, u.password_hash,
+           fm.family_id, f.name AS family_name, fm.id AS member_id
+    FROM {SCHEMA}.users u
+    LEFT JOIN {SCHEMA}.family_members fm ON fm.user_id = u.id AND fm.family_id IS NOT NULL
+    LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+    WHERE {{condition}}
+    ORDER BY u.phone_e164 IS NULL
+    LIMIT 1
+"""
+
+LAST_LOGIN_COALESCE_MINUTES = int(os.environ.get('LAST_LOGIN_COALESCE_MINUTES', '10'))
+# 0 — без ограничения числа живых сессий пользователя
+SESSION_MAX_PER_USER = int(os.environ.get('SESSION_MAX_PER_USER', '10'))
+
+def build_session_insert_ctes(source: str, token: str, expires_at: str, kept: str) -> str:
+    """CTE новой сессии с вытеснением самых старых сверх SESSION_MAX_PER_USER — общие для входа и регистрации.
+    
+    source — CTE с id пользователя; token, expires_at и kept (сколько прежних сессий оставить) — плейсхолдеры параметров.
+    Вытесненные токены возвращает CTE evicted.
+    """
+    return f"""
+        new_session AS (
+            INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at)
+            SELECT id, {token}::varchar, {expires_at}::timestamp FROM {source}
+        ), evicted AS (
+            DELETE FROM {SCHEMA}.sessions
+            WHERE (id, expires_at) IN (
+                SELECT id, expires_at FROM {SCHEMA}.sessions
+                WHERE user_id IN (SELECT id FROM {source}) AND expires_at > CURRENT_TIMESTAMP
+                ORDER BY created_at DESC
+                OFFSET {kept}
+            )
+            RETURNING token
+        )"""
+
+# Сколько прежних сессий оставить при выдаче новой
+SESSION_KEPT_ON_INSERT = SESSION_MAX_PER_USER - 1 if SESSION_MAX_PER_USER > 0 else 2 ** 31 - 1
+
+# Горячие запросы модуля: имя -> SQL с позиционными параметрами $1, $2...
+PREPARED_STATEMENTS = {
+    # Проверка сессии с профилем пользователя и семьёй
+    'session_lookup': f"""
+        SELECT s.user_id, s.expires_at, u.email, u.phone,
+               fm.family_id, f.name as family_name, fm.id as member_id
+        FROM {SCHEMA}.sessions s
+        JOIN {SCHEMA}.users u ON s.user_id = u.id
+        LEFT JOIN {SCHEMA}.family_members fm ON fm.user_id = u.id
+        LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+        WHERE s.token = $1 AND s.expires_at > CURRENT_TIMESTAMP
+        LIMIT 1
+    """,
+    # Вход: пользователь, его семья и членство одним запросом
+    # Нечёткие дубли, оставшиеся без phone_e164 после V0016, находятся по исходной строке номера
+    'login_by_phone': LOGIN_LOOKUP_SQL.format(condition='u.phone_e164 = $1 OR (u.phone_e164 IS NULL AND u.phone = $2)'),
+    'login_by_email': LOGIN_LOOKUP_SQL.format(condition='u.email = $1'),
+    # Новая сессия, вытеснение самых старых сверх лимита ($5 — сколько прежних оставить)
+    # и отметка входа одной командой; last_login_at пишется не чаще раза в $4 минут
+    'login_session': f"""
+        WITH session_owner AS (
+            SELECT $1::uuid AS id
+        ),{build_session_insert_ctes('session_owner', '$2', '$3', '$5')}, stamped AS (
+            UPDATE {SCHEMA}.users SET last_login_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+            AND (last_login_at IS NULL OR last_login_at < CURRENT_TIMESTAMP - make_interval(mins => $4))
+        )
+        SELECT token FROM evicted
+    """,
+}
+
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', '5'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '1024'))
+
+# Кэш сессий: token -> (истекает, данные); None кэшируется для неизвестных токенов
+_token_cache: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+def _token_cache_get(token: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    now = time.monotonic()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _token_cache[token]
+            _token_cache_stats['misses'] += 1
+            return False, None
+        _token_cache.move_to_end(token)
+        _token_cache_stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+        return True, entry[1]
+
+def _token_cache_put(token: str, value: Optional[Dict[str, Any]]) -> None:
+    ttl = TOKEN_CACHE_TTL if value is not None else TOKEN_CACHE_NEGATIVE_TTL
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + ttl, value)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
+def invalidate_token_cache(token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    with _token_cache_lock:
+        if token is not None:
+            _token_cache.pop(token, None)
+        if user_id is not None:
+            stale = [key for key, (_, value) in _token_cache.items() if value and value.get('id') == user_id]
+            for key in stale:
+                del _token_cache[key]
+
+def get_token_cache_stats() -> Dict[str, int]:
+    with _token_cache_lock:
+        return dict(_token_cache_stats, size=len(_token_cache))
+
+# Ограничение частоты: бакеты по телефону, IP и семье, "ёмкость/секунды" через env
+def _parse_rate(value: str) -> Tuple[float, float]:
+    capacity, _, period = value.partition('/')
+    return float(capacity), float(capacity) / float(period or '60')
+
+RATE_LIMITS = {
+    'phone': _parse_rate(os.environ.get('RATE_LIMIT_PHONE', '5/300')),
+    'ip': _parse_rate(os.environ.get('RATE_LIMIT_IP', '30/60')),
+    'family': _parse_rate(os.environ.get('RATE_LIMIT_FAMILY', '20/60')),
+}
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+# Файл SQLite, общий для процессов на одной машине; без него бакеты живут в памяти процесса
+RATE_LIMIT_STORE_PATH = os.environ.get('RATE_LIMIT_STORE_PATH', '')
+
+_rate_buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+_rate_lock = threading.Lock()
+_rate_store = None
+
+def _refill(tokens: float, updated: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+def _settle_buckets(buckets: List[Tuple[str, float, float]], levels: List[float]) -> Tuple[float, List[float]]:
+    # Токены списываются только когда пропускают все бакеты: отклонённый запрос не продлевает блокировку
+    wait = max(((1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, buckets) if tokens < 1), default=0.0)
+    return wait, [tokens if wait else tokens - 1 for tokens in levels]
+
+def _take_tokens_memory(buckets: List[Tuple[str, float, float]], now: float) -> float:
+    with _rate_lock:
+        levels = []
+        for key, capacity, rate in buckets:
+            tokens, updated = _rate_buckets.get(key, (capacity, now))
+            levels.append(_refill(tokens, updated, capacity, rate, now))
+        wait, levels = _settle_buckets(buckets, levels)
+        for (key, _, _), tokens in zip(buckets, levels):
+            _rate_buckets[key] = (tokens, now)
+            _rate_buckets.move_to_end(key)
+        while len(_rate_buckets) > RATE_LIMIT_MAX_KEYS:
+            _rate_buckets.popitem(last=False)
+        return wait
+
+def _get_rate_store():
+    global _rate_store
+    if _rate_store is None:
+        _rate_store = sqlite3.connect(RATE_LIMIT_STORE_PATH, timeout=0.2, isolation_level=None, check_same_thread=False)
+        _rate_store.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+    return _rate_store
+
+def _take_tokens_shared(buckets: List[Tuple[str, float, float]], now: float) -> float:
+    with _rate_lock:
+        store = _get_rate_store()
+        store.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = store.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                levels.append(_refill(row[0], row[1], capacity, rate, now) if row else capacity)
+            wait, levels = _settle_buckets(buckets, levels)
+            store.executemany(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                [(key, tokens, now) for (key, _, _), tokens in zip(buckets, levels)]
+            )
+            store.execute('COMMIT')
+        except Exception:
+            store.execute('ROLLBACK')
+            raise
+        return wait
+
+def check_rate_limit(keys: List[Tuple[str, Optional[str]]]) -> int:
+    """Списывает по токену из каждого бакета, если пропускают все; возвращает секунды до повтора (0 — можно)."""
+    if not RATE_LIMIT_ENABLED:
+        return 0
+    now = time.time()
+    buckets = [(f'{scope}:{value}', *RATE_LIMITS[scope]) for scope, value in keys if value]
+    if not buckets:
+        return 0
+    wait = None
+    if RATE_LIMIT_STORE_PATH:
+        try:
+            wait = _take_tokens_shared(buckets, now)
+        except sqlite3.Error:
+            pass
+    if wait is None:
+        wait = _take_tokens_memory(buckets, now)
+    return int(wait) + 1 if wait > 0 else 0
+
+def client_ip(event: Dict[str, Any]) -> Optional[str]:
+    # X-Forwarded-For задаёт клиент; доверять можно только адресу, который дописал последний прокси
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    all_headers = event.get('headers') or {}
+    forwarded = all_headers.get('X-Forwarded-For', '') or all_headers.get('x-forwarded-for', '')
+    return forwarded.split(',')[-1].strip() or None
+
+def rate_limit_key(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    value = value.strip().lower()
+    return value if '@' in value else normalize_phone(value)
+
+# Хранилище короткоживущих кодов: SMS/email-подтверждения, коды и токены сброса пароля.
+# CODE_STORE_BACKEND=memory держит коды в памяти процесса — для тестов и замеров без БД
+CODE_STORE_BACKEND = os.environ.get('CODE_STORE_BACKEND', 'postgres')
+# Каждая N-я запись заодно удаляет порцию истёкших кодов
+CODE_SWEEP_EVERY = int(os.environ.get('CODE_SWEEP_EVERY', '100'))
+CODE_SWEEP_BATCH = int(os.environ.get('CODE_SWEEP_BATCH', '1000'))
+
+# (тип, адресат, код) -> (истекает, user_id)
+_memory_codes: Dict[Tuple[str, str, str], Tuple[float, Optional[str]]] = {}
+_code_store_lock = threading.Lock()
+_code_store_writes = {'count': 0}
+
+def code_store_put(cur, code_type: str, subject: str, code: str, ttl_seconds: int, user_id: Any = None) -> None:
+    # Для токенов-носителей адресат пустой: токен уникален сам по себе
+    subject = subject.lower()
+    if CODE_STORE_BACKEND == 'memory':
+        with _code_store_lock:
+            _memory_codes[(code_type, subject, code)] = (time.time() + ttl_seconds, str(user_id) if user_id else None)
+    else:
+        cur.execute(
+            f"""
+            INSERT INTO {SCHEMA}.auth_codes (code_type, subject, code, user_id, expires_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            """,
+            (code_type, subject, code, user_id, ttl_seconds)
+        )
+    
+    with _code_store_lock:
+        _code_store_writes['count'] += 1
+        due = _code_store_writes['count'] % CODE_SWEEP_EVERY == 0
+    if due:
+        code_store_sweep(cur)
+
+def code_store_consume(cur, code_type: str, subject: str, code: str) -> Optional[Dict[str, Any]]:
+    """Гасит живой код одной операцией: повторно тот же код не пройдёт."""
+    subject = subject.lower()
+    if CODE_STORE_BACKEND == 'memory':
+        with _code_store_lock:
+            entry = _memory_codes.pop((code_type, subject, code), None)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return {'user_id': entry[1]}
+    
+    cur.execute(
+        f"""
+        DELETE FROM {SCHEMA}.auth_codes
+        WHERE id = (
+            SELECT id FROM {SCHEMA}.auth_codes
+            WHERE subject = %s AND code_type = %s AND code = %s
+            AND expires_at > CURRENT_TIMESTAMP
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING user_id
+        """,
+        (subject, code_type, code)
+    )
+    return cur.fetchone()
+
+def code_store_revoke(cur, code_type: Optional[str] = None, subject: Optional[str] = None, user_id: Any = None) -> None:
+    subject = subject.lower() if subject is not None else None
+    if CODE_STORE_BACKEND == 'memory':
+        with _code_store_lock:
+            for key, (_, owner) in list(_memory_codes.items()):
+                if (code_type is None or key[0] == code_type) and (subject is None or key[1] == subject) \
+                        and (user_id is None or owner == str(user_id)):
+                    del _memory_codes[key]
+        return
+    
+    cur.execute(
+        f"""
+        DELETE FROM {SCHEMA}.auth_codes
+        WHERE (%(code_type)s::text IS NULL OR code_type = %(code_type)s)
+        AND (%(subject)s::text IS NULL OR subject = %(subject)s)
+        AND (%(user_id)s::uuid IS NULL OR user_id = %(user_id)s::uuid)
+        """,
+        {'code_type': code_type, 'subject': subject, 'user_id': str(user_id) if user_id else None}
+    )
+
+def code_store_sweep(cur, limit: int = CODE_SWEEP_BATCH) -> int:
+    if CODE_STORE_BACKEND == 'memory':
+        now = time.time()
+        with _code_store_lock:
+            expired = [key for key, (expires, _) in _memory_codes.items() if expires <= now][:limit]
+            for key in expired:
+                del _memory_codes[key]
+        return len(expired)
+    
+    cur.execute(
+        f"""
+        DELETE FROM {SCHEMA}.auth_codes
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.auth_codes
+            WHERE expires_at <= CURRENT_TIMESTAMP
+            LIMIT %s
+        )
+        """,
+        (limit,)
+    )
+    return cur.rowcount
+
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def generate_token() -> str:
+    return secrets.token_urlsafe(32)
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+SIGNED_TOKEN_PREFIX = 's1.'
+# user_id, family_id, member_id, выдан (мс), истекает (с), nonce
+_SIGNED_PAYLOAD = struct.Struct('>16s16s16sQI8s')
+
+def _b64encode(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).rstrip(b'=').decode('ascii')
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def generate_session_token(user_id: Any, family_id: Any, member_id: Any, expires_at: datetime) -> str:
+    if not SESSION_SIGNING_KEY:
+        return generate_token()
+    
+    payload = _SIGNED_PAYLOAD.pack(
+        uuid.UUID(str(user_id)).bytes,
+        uuid.UUID(str(family_id)).bytes if family_id else bytes(16),
+        uuid.UUID(str(member_id)).bytes if member_id else bytes(16),
+        int(time.time() * 1000),
+        int(expires_at.timestamp()),
+        secrets.token_bytes(8)
+    )
+    signature = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    return f"{SIGNED_TOKEN_PREFIX}{_b64encode(payload)}.{_b64encode(signature)}"
+
+def decode_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload_b64, signature_b64 = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    
+    expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature) or len(payload) != _SIGNED_PAYLOAD.size:
+        return None
+    
+    user_id, family_id, member_id, issued_at, expires_at, nonce = _SIGNED_PAYLOAD.unpack(payload)
+    return {
+        'user_id': str(uuid.UUID(bytes=user_id)),
+        'expires_at': expires_at,
+        'nonce': nonce.hex()
+    }
+
+def revoke_signed_tokens(cur, token: Optional[str] = None, user_id: Optional[str] = None, revoked_at: Optional[float] = None) -> None:
+    # Остальные функции подтягивают отзывы периодически, см. REVOCATION_REFRESH_INTERVAL
+    if not SESSION_SIGNING_KEY:
+        return
+    
+    if token:
+        claims = decode_signed_token(token)
+        if claims:
+            cur.execute(
+                f"""
+                INSERT INTO {SCHEMA}.revoked_tokens (token_nonce, expires_at)
+                VALUES (%s, to_timestamp(%s))
+                """,
+                (claims['nonce'], claims['expires_at'])
+            )
+    
+    if user_id:
+        cur.execute(
+            f"""
+            INSERT INTO {SCHEMA}.revoked_tokens (user_id, revoked_at, expires_at)
+            VALUES (%s, COALESCE(to_timestamp(%s), now()), CURRENT_TIMESTAMP + INTERVAL '30 days')
+            """,
+            (user_id, revoked_at)
+        )
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Приводит номер к E.164, как normalize_phone_e164 в БД; 8XXXXXXXXXX и 9XXXXXXXXX считаются российскими."""
+    if not phone:
+        return None
+    digits = re.sub(r'\D', '', phone)
+    if not phone.strip().startswith('+'):
+        if len(digits) == 11 and digits[0] == '8':
+            digits = '7' + digits[1:]
+        elif len(digits) == 10 and digits[0] == '9':
+            digits = '7' + digits
+    if not 10 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+# Построитель параметризованных запросов: текст SQL зависит только от таблицы и набора колонок,
+# поэтому запросы одной формы дают одинаковый текст и переиспользуют план
+@lru_cache(maxsize=256)
+def sql_insert(table: str, columns: Tuple[str, ...], returning: str = '') -> str:
+    sql = f"INSERT INTO {SCHEMA}.{table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    return f"{sql} RETURNING {returning}" if returning else sql
+
+@lru_cache(maxsize=256)
+def sql_update(table: str, columns: Tuple[str, ...], where: Tuple[str, ...], returning: str = '', touch: bool = False) -> str:
+    assignments = [f"{column} = %s" for column in columns]
+    if touch:
+        assignments.append("updated_at = CURRENT_TIMESTAMP")
+    sql = f"UPDATE {SCHEMA}.{table} SET {', '.join(assignments)} WHERE {' AND '.join(f'{column} = %s' for column in where)}"
+    return f"{sql} RETURNING {returning}" if returning else sql
+
+def sql_params(*values: Any) -> Tuple[Any, ...]:
+    # Словари и списки уходят в jsonb
+    return tuple(Json(value) if isinstance(value, (dict, list)) else value for value in values)
+
+# Таблицы данных семьи без каскада от families: дочищаются порциями, затем удаляется сама семья.
+# Таблицы из V0006 хранят family_id как INTEGER, поэтому сравниваются через ::text, как в sync_tombstones:
+# при несовпадении типов строки просто не находятся, а не роняют транзакцию
+FAMILY_PURGE_TABLES = {
+    'tasks': 'family_id = %s',
+    # Результаты тестов привязаны к ребёнку, поэтому чистятся до профилей детей
+    'test_results': f'child_member_id IN (SELECT child_member_id FROM {SCHEMA}.children_profiles WHERE family_id::text = %s::text)',
+    'children_profiles': 'family_id::text = %s::text',
+    'calendar_events': 'family_id::text = %s::text',
+    'family_values': 'family_id::text = %s::text',
+    'traditions': 'family_id::text = %s::text',
+    'blog_posts': 'family_id::text = %s::text',
+    'family_album': 'family_id::text = %s::text',
+    'family_tree': 'family_id::text = %s::text',
+    'chat_messages': 'family_id::text = %s::text',
+}
+FAMILY_PURGE_BATCH = int(os.environ.get('FAMILY_PURGE_BATCH', '1000'))
+# Сколько полных порций дочищается прямо в запросе; крупные семьи дочищает фоновая очистка
+FAMILY_PURGE_INLINE_BATCHES = int(os.environ.get('FAMILY_PURGE_INLINE_BATCHES', '1'))
+FAMILY_PURGE_MAX_BATCHES = int(os.environ.get('FAMILY_PURGE_MAX_BATCHES', '50'))
+
+# Уход из семьи одной командой: последний участник уносит с собой приглашения,
+# а семья помечается удалённой; data_version растёт в обоих случаях
+LEAVE_FAMILY_SQL = f"""
+    WITH me AS (
+        SELECT id, family_id FROM {SCHEMA}.family_members WHERE user_id = %(user_id)s
+    ), last_member AS (
+        SELECT me.family_id FROM me
+        JOIN {SCHEMA}.family_members fm ON fm.family_id = me.family_id
+        GROUP BY me.family_id
+        HAVING COUNT(*) <= 1
+    ), left_family AS (
+        DELETE FROM {SCHEMA}.family_members WHERE id IN (SELECT id FROM me)
+    ), dropped_invites AS (
+        DELETE FROM {SCHEMA}.family_invites WHERE family_id IN (SELECT family_id FROM last_member)
+    )
+    UPDATE {SCHEMA}.families f
+    SET data_version = f.data_version + 1,
+        deleted_at = CASE WHEN f.id IN (SELECT family_id FROM last_member) THEN CURRENT_TIMESTAMP ELSE f.deleted_at END
+    WHERE f.id IN (SELECT family_id FROM me)
+    RETURNING f.id, f.deleted_at IS NOT NULL AS orphaned
+"""
+
+def purge_family(cur, family_id: Any, max_batches: int) -> Tuple[bool, int]:
+    """Удаляет данные помеченной семьи, тратя не более max_batches полных порций; возвращает (удалена целиком, потрачено порций)."""
+    used = 0
+    for table, family_filter in FAMILY_PURGE_TABLES.items():
+        while True:
+            if used >= max_batches:
+                return False, used
+            cur.execute(
+                f"""
+                DELETE FROM {SCHEMA}.{table}
+                WHERE id IN (SELECT id FROM {SCHEMA}.{table} WHERE {family_filter} LIMIT %s)
+                """,
+                (str(family_id), FAMILY_PURGE_BATCH)
+            )
+            if cur.rowcount < FAMILY_PURGE_BATCH:
+                break
+            used += 1
+    
+    # Подписки, платежи, выгрузки и оставшиеся приглашения уходят каскадом
+    cur.execute(f"DELETE FROM {SCHEMA}.families WHERE id = %s AND deleted_at IS NOT NULL", (family_id,))
+    cur.execute(f"DELETE FROM {SCHEMA}.sync_tombstones WHERE family_id = %s", (str(family_id),))
+    return True, used
+
+def leave_current_family(cur, user_id: Any) -> None:
+    # Пользователь уходит из прежней семьи; последняя семья удаляется целиком
+    cur.execute(LEAVE_FAMILY_SQL, {'user_id': user_id})
+    row = cur.fetchone()
+    if row and row['orphaned']:
+        purge_family(cur, row['id'], FAMILY_PURGE_INLINE_BATCHES)
+
+def purge_deleted_families() -> Dict[str, Any]:
+    """Фоновая дочистка семей, помеченных удалёнными."""
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cur.execute(
+            f"SELECT id FROM {SCHEMA}.families WHERE deleted_at IS NOT NULL ORDER BY deleted_at LIMIT 100"
+        )
+        budget = FAMILY_PURGE_MAX_BATCHES
+        purged = 0
+        for row in cur.fetchall():
+            if budget <= 0:
+                break
+            # Порции идемпотентны, поэтому каждая фиксируется сразу (autocommit)
+            done, used = purge_family(cur, row['id'], budget)
+            purged += done
+            budget -= used
+        return {'success': True, 'purged_families': purged}
+    except Exception as e:
+        return {'error': str(e)}
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def build_registration_query(existing_user: bool, join_mode: Optional[str]) -> str:
+    """Цепочка CTE: пользователь -> семья -> член семьи -> сессия одним запросом.
+    
+    join_mode: 'invite' — вступление в семью по приглашению, 'create' — новая семья, None — без семьи.
+    """
+    if existing_user:
+        user_cte = f"""
+            reg_user AS (
+                UPDATE {SCHEMA}.users SET password_hash = %(password_hash)s
+                WHERE id = %(user_id)s
+                RETURNING id, email, phone
+            )"""
+    else:
+        # Пустой результат означает, что телефон уже занят
+        user_cte = f"""
+            reg_user AS (
+                INSERT INTO {SCHEMA}.users (id, email, phone, phone_e164, password_hash, is_verified)
+                SELECT %(user_id)s::uuid, NULL, %(phone)s, %(phone)s, %(password_hash)s, TRUE
+                WHERE NOT EXISTS (SELECT 1 FROM {SCHEMA}.users WHERE phone_e164 = %(phone)s)
+                RETURNING id, email, phone
+            )"""
+    ctes = [user_cte]
+    
+    if join_mode == 'invite':
+        # Состав семьи меняется: поднимаем версию данных (ETag) и сразу берём имя
+        ctes.append(f"""
+            reg_family AS (
+                UPDATE {SCHEMA}.families SET data_version = data_version + 1
+                WHERE id = %(family_id)s AND EXISTS (SELECT 1 FROM reg_user)
+                RETURNING id, name
+            )""")
+        ctes.append(f"""
+            used_invite AS (
+                UPDATE {SCHEMA}.family_invites SET uses_count = uses_count + 1
+                WHERE id = %(invite_id)s AND EXISTS (SELECT 1 FROM reg_user)
+            )""")
+    elif join_mode == 'create':
+        ctes.append(f"""
+            reg_family AS (
+                INSERT INTO {SCHEMA}.families (id, name)
+                SELECT %(family_id)s::uuid, %(family_name)s FROM reg_user
+                RETURNING id, name
+            )""")
+    
+    if join_mode:
+        ctes.append(f"""
+            reg_member AS (
+                INSERT INTO {SCHEMA}.family_members
+                (id, family_id, user_id, name, relationship, role, points, level, workload, avatar, avatar_type)
+                SELECT %(member_id)s::uuid, f.id, u.id, %(member_name)s, %(relationship)s, %(role)s, 0, 1, 0, '👤', 'emoji'
+                FROM reg_user u, reg_family f
+                RETURNING id
+            )""")
+    
+    # Сессия выдаётся с тем же лимитом, что и при входе
+    ctes.append(build_session_insert_ctes('reg_user', '%(token)s', '%(expires_at)s', '%(kept_sessions)s'))
+    
+    evicted = "(SELECT array_agg(token) FROM evicted) AS evicted_tokens"
+    if join_mode:
+        select = f"""
+            SELECT u.id, u.email, u.phone, f.id AS family_id, f.name AS family_name, m.id AS member_id, {evicted}
+            FROM reg_user u, reg_family f, reg_member m"""
+    else:
+        select = f"""
+            SELECT u.id, u.email, u.phone, {evicted} FROM reg_user u"""
+    
+    return 'WITH' + ','.join(ctes) + select
+
 def register_user(phone: str, password: str, family_name: Optional[str] = None, skip_family_creation: bool = False, invite_code: Optional[str] = None, member_name: Optional[str] = None, relationship: Optional[str] = None) -> Dict[str, Any]:
     if not phone:
         return {'error': 'Телефон обязателен'}
     
-    if not validate_phone(phone):
+    phone = normalize_phone(phone)
+    if not phone:
         return {'error': 'Некорректный номер телефона'}
     
     if len(password) < 6:
         return {'error': 'Пароль должен быть минимум 6 символов'}
     
     conn = get_db_connection()
+    # Вся регистрация — одна транзакция: при ошибке не остаётся полусозданных пользователей и семей
+    conn.autocommit = False
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        password_hash = hash_password(password)
-        
-        check_query = f"SELECT id FROM {SCHEMA}.users WHERE phone = {escape_string(phone)}"
-        cur.execute(check_query)
-        existing_user = cur.fetchone()
-        
-        if existing_user and not invite_code:
-            cur.close()
-            conn.close()
-            return {'error': 'Телефон уже зарегистрирован'}
-        
-        if existing_user and invite_code:
-            user_id = existing_user['id']
-            
-            cur.execute(
-                f"SELECT family_id FROM {SCHEMA}.family_members WHERE user_id = {escape_string(user_id)}"
-            )
-            old_member = cur.fetchone()
-            
-            if old_member:
-                old_family_id = old_member['family_id']
-                
-                cur.execute(
-                    f"SELECT COUNT(*) as count FROM {SCHEMA}.family_members WHERE family_id = {escape_string(old_family_id)}"
-                )
-                members_count = cur.fetchone()['count']
-                
-                if members_count <= 1:
-                    cur.execute(f"DELETE FROM {SCHEMA}.tasks WHERE family_id = {escape_string(old_family_id)}")
-                    cur.execute(f"DELETE FROM {SCHEMA}.family_invites WHERE family_id = {escape_string(old_family_id)}")
-                    cur.execute(f"DELETE FROM {SCHEMA}.family_members WHERE family_id = {escape_string(old_family_id)}")
-                    cur.execute(f"DELETE FROM {SCHEMA}.families WHERE id = {escape_string(old_family_id)}")
-                else:
-                    cur.execute(f"DELETE FROM {SCHEMA}.family_members WHERE user_id = {escape_string(user_id)}")
-            
-            update_password = f"""
-                UPDATE {SCHEMA}.users 
-                SET password_hash = {escape_string(password_hash)}
-                WHERE id = {escape_string(user_id)}
-            """
-            cur.execute(update_password)
-            
-            user = {'id': user_id, 'email': None, 'phone': phone, 'created_at': None}
-        else:
-            existing_user = None
-        
-        if not existing_user:
-            insert_user = f"""
-                INSERT INTO {SCHEMA}.users (email, phone, password_hash, is_verified) 
-                VALUES (NULL, {escape_string(phone)}, {escape_string(password_hash)}, TRUE) 
-                RETURNING id, email, phone, created_at
-            """
-            cur.execute(insert_user)
-            user = cur.fetchone()
-        
-        token = generate_token()
-        expires_at = datetime.now() + timedelta(days=30)
-        
-        insert_session = f"""
-            INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at) 
-            VALUES (
-                {escape_string(user['id'])}, 
-                {escape_string(token)}, 
-                {escape_string(expires_at.isoformat())}
-            )
-        """
-        cur.execute(insert_session)
-        
-        user_data = {
-            'id': str(user['id']),
-            'email': user['email'],
-            'phone': user['phone']
-        }
+        existing_user = None
+        invite = None
         
         if invite_code:
+            # Блокируем приглашение, чтобы параллельные регистрации не превысили max_uses
             cur.execute(
                 f"""
-                SELECT id, family_id, max_uses, uses_count, expires_at, is_active
-                FROM {SCHEMA}.family_invites
-                WHERE invite_code = {escape_string(invite_code)}
-                """
+                SELECT i.id, i.family_id, i.max_uses, i.uses_count, i.expires_at, i.is_active,
+                       (SELECT id FROM {SCHEMA}.users WHERE phone_e164 = %s) AS existing_user_id
+                FROM {SCHEMA}.family_invites i
+                WHERE i.invite_code = %s
+                FOR UPDATE OF i
+                """,
+                (phone, invite_code)
             )
             invite = cur.fetchone()
             
             if not invite:
-                cur.close()
-                conn.close()
                 return {'error': 'Неверный код приглашения'}
-            
             if not invite['is_active']:
-                cur.close()
-                conn.close()
                 return {'error': 'Приглашение деактивировано'}
-            
             if invite['expires_at'] and invite['expires_at'] < datetime.now():
-                cur.close()
-                conn.close()
                 return {'error': 'Срок действия приглашения истёк'}
-            
             if invite['uses_count'] >= invite['max_uses']:
-                cur.close()
-                conn.close()
                 return {'error': 'Приглашение исчерпано'}
             
-            final_member_name = member_name or phone[-4:]
-            final_relationship = relationship or 'Член семьи'
-            
-            insert_member = f"""
-                INSERT INTO {SCHEMA}.family_members 
-                (family_id, user_id, name, relationship, role, points, level, workload, avatar, avatar_type) 
-                VALUES (
-                    {escape_string(invite['family_id'])}, 
-                    {escape_string(user['id'])}, 
-                    {escape_string(final_member_name)}, 
-                    {escape_string(final_relationship)}, 
-                    'Член семьи', 
-                    0, 1, 0, 
-                    {escape_string('👤')}, 
-                    {escape_string('emoji')}
-                )
-                RETURNING id
-            """
-            cur.execute(insert_member)
-            member = cur.fetchone()
-            
-            update_invite = f"""
-                UPDATE {SCHEMA}.family_invites
-                SET uses_count = uses_count + 1
-                WHERE id = {escape_string(invite['id'])}
-            """
-            cur.execute(update_invite)
-            
-            select_family = f"""
-                SELECT name FROM {SCHEMA}.families WHERE id = {escape_string(invite['family_id'])}
-            """
-            cur.execute(select_family)
-            family = cur.fetchone()
-            
-            user_data['family_id'] = str(invite['family_id'])
-            user_data['family_name'] = family['name']
-            user_data['member_id'] = str(member['id'])
-        elif not skip_family_creation:
-            default_family_name = family_name or f"Семья {phone}"
-            insert_family = f"""
-                INSERT INTO {SCHEMA}.families (name) 
-                VALUES ({escape_string(default_family_name)}) 
-                RETURNING id, name
-            """
-            cur.execute(insert_family)
-            family = cur.fetchone()
-            
-            final_member_name = member_name or phone[-4:]
-            insert_member = f"""
-                INSERT INTO {SCHEMA}.family_members 
-                (family_id, user_id, name, role, points, level, workload, avatar, avatar_type) 
-                VALUES (
-                    {escape_string(family['id'])}, 
-                    {escape_string(user['id'])}, 
-                    {escape_string(final_member_name)}, 
-                    {escape_string('Владелец')}, 
-                    0, 1, 0, 
-                    {escape_string('👤')}, 
-                    {escape_string('emoji')}
-                )
-                RETURNING id
-            """
-            cur.execute(insert_member)
-            member = cur.fetchone()
-            
-            user_data['family_id'] = str(family['id'])
-            user_data['family_name'] = family['name']
-            user_data['member_id'] = str(member['id'])
+            existing_user = invite['existing_user_id']
+            if existing_user:
+                leave_current_family(cur, existing_user)
+                # Старые токены несут family_id прежней семьи; отзываем всё, выданное до нового токена
+                revoke_signed_tokens(cur, user_id=str(existing_user), revoked_at=int(time.time() * 1000) / 1000)
         
-        cur.close()
-        conn.close()
+        join_mode = 'invite' if invite else (None if skip_family_creation else 'create')
+        user_id = str(existing_user) if existing_user else str(uuid.uuid4())
+        family_id = None
+        if join_mode == 'invite':
+            family_id = str(invite['family_id'])
+        elif join_mode == 'create':
+            family_id = str(uuid.uuid4())
+        member_id = str(uuid.uuid4()) if join_mode else None
+        
+        expires_at = datetime.now() + timedelta(days=30)
+        token = generate_session_token(user_id, family_id, member_id, expires_at)
+        
+        cur.execute(
+            build_registration_query(bool(existing_user), join_mode),
+            {
+                'user_id': user_id,
+                'phone': phone,
+                'password_hash': hash_password(password),
+                'family_id': family_id,
+                'family_name': family_name or f"Семья {phone}",
+                'invite_id': invite['id'] if invite else None,
+                'member_id': member_id,
+                'member_name': member_name or phone[-4:],
+                'relationship': (relationship or 'Член семьи') if invite else None,
+                'role': 'Член семьи' if invite else 'Владелец',
+                'token': token,
+                'expires_at': expires_at,
+                'kept_sessions': SESSION_KEPT_ON_INSERT
+            }
+        )
+        row = cur.fetchone()
+        
+        if not row:
+            return {'error': 'Телефон уже зарегистрирован'}
+        
+        evicted_tokens = row['evicted_tokens'] or []
+        for evicted in evicted_tokens:
+            revoke_signed_tokens(cur, token=evicted)
+        conn.commit()
+        for evicted in evicted_tokens:
+            invalidate_token_cache(token=evicted)
+        if existing_user:
+            invalidate_token_cache(user_id=str(existing_user))
+        
+        user_data = {
+            'id': str(row['id']),
+            'email': row['email'],
+            'phone': row['phone']
+        }
+        if join_mode:
+            user_data['family_id'] = str(row['family_id'])
+            user_data['family_name'] = row['family_name']
+            user_data['member_id'] = str(row['member_id'])
         
         return {
             'success': True,
@@ -237,9 +815,16 @@ def register_user(phone: str, password: str, family_name: Optional[str] = None,
             'user': user_data
         }
     except Exception as e:
-        cur.close()
-        conn.close()
         return {'error': f'Ошибка регистрации: {str(e)}'}
+    finally:
+        # Ранний выход или ошибка откатывают транзакцию; соединение возвращается в пул в режиме autocommit
+        cur.close()
+        try:
+            conn.rollback()
+            conn.autocommit = True
+        except psycopg2.Error:
+            pass
+        release_db_connection(conn)
 
 def login_user(login: str, password: str) -> Dict[str, Any]:
     if not login or not password:
@@ -251,61 +836,26 @@ def login_user(login: str, password: str) -> Dict[str, Any]:
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        is_email = '@' in login
-        field = 'email' if is_email else 'phone'
         
-        select_user = f"""
-            SELECT id, email, phone, password_hash 
-            FROM {SCHEMA}.users 
-            WHERE {field} = {escape_string(login)}
-        """
-        cur.execute(select_user)
+        if '@' in login:
+            execute_prepared(cur, 'login_by_email', (login,))
+        else:
+            execute_prepared(cur, 'login_by_phone', (normalize_phone(login), login))
         user = cur.fetchone()
         
         if not user:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
             return {'error': 'Пользователь не найден'}
         
-        password_hash = hash_password(password)
-        if user['password_hash'] != password_hash:
-            if cur:
-                cur.close()
-            if conn:
-                conn.close()
+        if user['password_hash'] != hash_password(password):
             return {'error': 'Неверный пароль'}
         
-        select_family = f"""
-            SELECT fm.family_id, f.name as family_name, fm.id as member_id
-            FROM {SCHEMA}.family_members fm
-            JOIN {SCHEMA}.families f ON fm.family_id = f.id
-            WHERE fm.user_id = {escape_string(user['id'])}
-            LIMIT 1
-        """
-        cur.execute(select_family)
-        family_info = cur.fetchone()
-        
-        token = generate_token()
         expires_at = datetime.now() + timedelta(days=30)
+        token = generate_session_token(user['id'], user['family_id'], user['member_id'], expires_at)
         
-        insert_session = f"""
-            INSERT INTO {SCHEMA}.sessions (user_id, token, expires_at) 
-            VALUES (
-                {escape_string(user['id'])}, 
-                {escape_string(token)}, 
-                {escape_string(expires_at.isoformat())}
-            )
-        """
-        cur.execute(insert_session)
-        
-        update_login = f"""
-            UPDATE {SCHEMA}.users 
-            SET last_login_at = CURRENT_TIMESTAMP 
-            WHERE id = {escape_string(user['id'])}
-        """
-        cur.execute(update_login)
+        execute_prepared(cur, 'login_session', (user['id'], token, expires_at, LAST_LOGIN_COALESCE_MINUTES, SESSION_KEPT_ON_INSERT))
+        for evicted in cur.fetchall():
+            revoke_signed_tokens(cur, token=evicted['token'])
+            invalidate_token_cache(token=evicted['token'])
         
         user_data = {
             'id': str(user['id']),
@@ -313,15 +863,10 @@ def login_user(login: str, password: str) -> Dict[str, Any]:
             'phone': user['phone']
         }
         
-        if family_info:
-            user_data['family_id'] = str(family_info['family_id'])
-            user_data['family_name'] = family_info['family_name']
-            user_data['member_id'] = str(family_info['member_id'])
-        
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        if user['family_id']:
+            user_data['family_id'] = str(user['family_id'])
+            user_data['family_name'] = user['family_name']
+            user_data['member_id'] = str(user['member_id'])
         
         return {
             'success': True,
@@ -329,16 +874,21 @@ def login_user(login: str, password: str) -> Dict[str, Any]:
             'user': user_data
         }
     except Exception as e:
+        return {'error': f'Ошибка входа: {str(e)}'}
+    finally:
         if cur:
             cur.close()
         if conn:
-            conn.close()
-        return {'error': f'Ошибка входа: {str(e)}'}
+            release_db_connection(conn)
 
 def verify_token(token: str) -> Optional[Dict[str, Any]]:
     if not token:
         return None
     
+    found, cached = _token_cache_get(token)
+    if found:
+        return cached
+    
     conn = None
     cur = None
     
@@ -346,21 +896,11 @@ def verify_token(token: str) -> Optional[Dict[str, Any]]:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
-        select_session = f"""
-            SELECT s.user_id, s.expires_at, u.email, u.phone,
-                   fm.family_id, f.name as family_name, fm.id as member_id
-            FROM {SCHEMA}.sessions s
-            JOIN {SCHEMA}.users u ON s.user_id = u.id
-            LEFT JOIN {SCHEMA}.family_members fm ON fm.user_id = u.id
-            LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
-            WHERE s.token = {escape_string(token)} AND s.expires_at > CURRENT_TIMESTAMP
-            LIMIT 1
-        """
-        
-        cur.execute(select_session)
+        execute_prepared(cur, 'session_lookup', (token,))
         session = cur.fetchone()
         
         if not session:
+            _token_cache_put(token, None)
             return None
         
         user_data = {
@@ -374,6 +914,7 @@ def verify_token(token: str) -> Optional[Dict[str, Any]]:
             user_data['family_name'] = session['family_name']
             user_data['member_id'] = str(session['member_id'])
         
+        _token_cache_put(token, user_data)
         return user_data
     except Exception as e:
         return None
@@ -381,69 +922,56 @@ def verify_token(token: str) -> Optional[Dict[str, Any]]:
         if cur:
             cur.close()
         if conn:
-            conn.close()
+            release_db_connection(conn)
 
 def logout_user(token: str) -> Dict[str, Any]:
     conn = get_db_connection()
     cur = conn.cursor()
     
     try:
-        update_session = f"""
-            UPDATE {SCHEMA}.sessions 
-            SET expires_at = CURRENT_TIMESTAMP 
-            WHERE token = {escape_string(token)}
-        """
-        cur.execute(update_session)
+        cur.execute(f"UPDATE {SCHEMA}.sessions SET expires_at = CURRENT_TIMESTAMP WHERE token = %s", (token,))
+        revoke_signed_tokens(cur, token=token)
+        invalidate_token_cache(token=token)
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         return {'success': True}
     except Exception as e:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         return {'error': str(e)}
 
+RESET_CODE_TTL = 15 * 60
+RESET_TOKEN_TTL = 15 * 60
+
 def forgot_password(phone: str) -> Dict[str, Any]:
-    if not phone or not validate_phone(phone):
+    raw_phone = phone
+    phone = normalize_phone(phone)
+    if not phone:
         return {'error': 'Некорректный номер телефона'}
     
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        # Проверяем существует ли пользователь
-        check_user = f"SELECT id FROM {SCHEMA}.users WHERE phone = {escape_string(phone)}"
-        cur.execute(check_user)
+        # Проверяем существует ли пользователь; дубли без phone_e164 — по исходной строке
+        cur.execute(
+            f"""
+            SELECT id FROM {SCHEMA}.users
+            WHERE phone_e164 = %s OR (phone_e164 IS NULL AND phone = %s)
+            ORDER BY phone_e164 IS NULL
+            LIMIT 1
+            """,
+            (phone, raw_phone)
+        )
         user = cur.fetchone()
         
         if not user:
-            cur.close()
-            conn.close()
             return {'error': 'Пользователь с таким номером не найден'}
         
-        # Генерируем 6-значный код
+        # Генерируем 6-значный код; прежние коды этого номера больше не действуют
         reset_code = ''.join([str(secrets.randbelow(10)) for _ in range(6)])
-        reset_token = generate_token()
-        expires_at = datetime.now() + timedelta(minutes=15)
-        
-        # Удаляем старые токены
-        delete_old = f"DELETE FROM {SCHEMA}.password_reset_tokens WHERE user_id = {escape_string(user['id'])}"
-        cur.execute(delete_old)
-        
-        # Сохраняем новый токен
-        insert_token = f"""
-            INSERT INTO {SCHEMA}.password_reset_tokens 
-            (user_id, token, code, expires_at) 
-            VALUES (
-                {escape_string(user['id'])}, 
-                {escape_string(reset_token)}, 
-                {escape_string(reset_code)}, 
-                {escape_string(expires_at.isoformat())}
-            )
-        """
-        cur.execute(insert_token)
-        
-        cur.close()
-        conn.close()
+        code_store_revoke(cur, 'reset_code', subject=phone)
+        code_store_put(cur, 'reset_code', phone, reset_code, RESET_CODE_TTL, user['id'])
         
         # TODO: Отправить SMS с кодом reset_code
         # Пока просто возвращаем код (для тестирования)
@@ -453,13 +981,13 @@ def forgot_password(phone: str) -> Dict[str, Any]:
             'code': reset_code  # Уберите это в продакшене!
         }
     except Exception as e:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
         return {'error': f'Ошибка: {str(e)}'}
+    finally:
+        cur.close()
+        release_db_connection(conn)
 
 def verify_reset_code(phone: str, code: str) -> Dict[str, Any]:
+    phone = normalize_phone(phone)
     if not phone or not code:
         return {'error': 'Телефон и код обязательны'}
     
@@ -467,36 +995,23 @@ def verify_reset_code(phone: str, code: str) -> Dict[str, Any]:
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        check_query = f"""
-            SELECT prt.token, prt.expires_at
-            FROM {SCHEMA}.password_reset_tokens prt
-            JOIN {SCHEMA}.users u ON prt.user_id = u.id
-            WHERE u.phone = {escape_string(phone)} 
-            AND prt.code = {escape_string(code)}
-            AND prt.expires_at > CURRENT_TIMESTAMP
-            AND prt.used_at IS NULL
-            ORDER BY prt.created_at DESC
-            LIMIT 1
-        """
-        cur.execute(check_query)
-        token_data = cur.fetchone()
-        
-        cur.close()
-        conn.close()
-        
-        if not token_data:
+        # Код одноразовый: взамен выдаётся токен сброса
+        found = code_store_consume(cur, 'reset_code', phone, code)
+        if not found:
             return {'error': 'Неверный код или код устарел'}
         
+        reset_token = generate_token()
+        code_store_put(cur, 'reset_token', '', reset_token, RESET_TOKEN_TTL, found['user_id'])
+        
         return {
             'success': True,
-            'reset_token': token_data['token']
+            'reset_token': reset_token
         }
     except Exception as e:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-        return {'error': f'Ошибка: {str(e)}'}
+        return {'error': str(e)}
+    finally:
+        cur.close()
+        release_db_connection(conn)
 
 def reset_password(reset_token: str, new_password: str) -> Dict[str, Any]:
     if not reset_token or not new_password:
@@ -509,103 +1024,203 @@ def reset_password(reset_token: str, new_password: str) -> Dict[str, Any]:
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        # Проверяем токен
-        check_token = f"""
-            SELECT user_id 
-            FROM {SCHEMA}.password_reset_tokens 
-            WHERE token = {escape_string(reset_token)} 
-            AND expires_at > CURRENT_TIMESTAMP
-            AND used_at IS NULL
-        """
-        cur.execute(check_token)
-        token_data = cur.fetchone()
+        # Токен гасится сразу при проверке
+        token_data = code_store_consume(cur, 'reset_token', '', reset_token)
         
         if not token_data:
             cur.close()
-            conn.close()
+            release_db_connection(conn)
             return {'error': 'Неверный или просроченный токен'}
         
         user_id = token_data['user_id']
         new_password_hash = hash_password(new_password)
         
         # Обновляем пароль
-        update_password = f"""
-            UPDATE {SCHEMA}.users 
-            SET password_hash = {escape_string(new_password_hash)} 
-            WHERE id = {escape_string(user_id)}
-        """
-        cur.execute(update_password)
-        
-        # Помечаем токен как использованный
-        mark_used = f"""
-            UPDATE {SCHEMA}.password_reset_tokens 
-            SET used_at = CURRENT_TIMESTAMP 
-            WHERE token = {escape_string(reset_token)}
-        """
-        cur.execute(mark_used)
+        cur.execute(sql_update('users', ('password_hash',), ('id',)), (new_password_hash, user_id))
         
         # Удаляем все сессии пользователя (принудительный выход)
-        delete_sessions = f"""
-            UPDATE {SCHEMA}.sessions 
-            SET expires_at = CURRENT_TIMESTAMP 
-            WHERE user_id = {escape_string(user_id)}
-        """
-        cur.execute(delete_sessions)
+        cur.execute(f"UPDATE {SCHEMA}.sessions SET expires_at = CURRENT_TIMESTAMP WHERE user_id = %s", (user_id,))
+        revoke_signed_tokens(cur, user_id=str(user_id))
+        invalidate_token_cache(user_id=str(user_id))
         
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         
         return {'success': True, 'message': 'Пароль успешно изменён'}
     except Exception as e:
         if cur:
             cur.close()
         if conn:
-            conn.close()
+            release_db_connection(conn)
         return {'error': f'Ошибка: {str(e)}'}
 
+# Строки, которые ссылаются на пользователя и переживают его уход из семьи
+ACCOUNT_CLEANUP_SQL = (
+    f"UPDATE {SCHEMA}.payments SET user_id = NULL WHERE user_id = %s",
+    f"UPDATE {SCHEMA}.export_jobs SET requested_by = NULL WHERE requested_by = %s",
+    f"DELETE FROM {SCHEMA}.family_invites WHERE created_by = %s",
+    f"DELETE FROM {SCHEMA}.password_reset_tokens WHERE user_id = %s",
+    f"DELETE FROM {SCHEMA}.verification_codes WHERE user_id = %s",
+)
+
 def delete_account(token: str) -> Dict[str, Any]:
     user = verify_token(token)
     if not user:
         return {'error': 'Неверный токен'}
     
     user_id = user['id']
-    conn = None
-    cur = None
+    conn = get_db_connection()
+    conn.autocommit = False
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(f"DELETE FROM {SCHEMA}.sessions WHERE user_id = %s", (user_id,))
+        revoke_signed_tokens(cur, user_id=user_id)
+        code_store_revoke(cur, user_id=user_id)
+        leave_current_family(cur, user_id)
+        # Семья может остаться недочищенной, поэтому ссылки на пользователя снимаются явно, а не её каскадом
+        for statement in ACCOUNT_CLEANUP_SQL:
+            cur.execute(statement, (user_id,))
+        cur.execute(f"DELETE FROM {SCHEMA}.users WHERE id = %s", (user_id,))
+        conn.commit()
+        invalidate_token_cache(user_id=user_id)
+        
+        return {'success': True, 'message': 'Аккаунт успешно удалён'}
+    except Exception as e:
+        return {'error': f'Ошибка удаления: {str(e)}'}
+    finally:
+        cur.close()
+        conn.rollback()
+        conn.autocommit = True
+        release_db_connection(conn)
+
+AUTH_CRON_SECRET = os.environ.get('AUTH_CRON_SECRET', '')
+SESSION_SWEEP_BATCH = int(os.environ.get('SESSION_SWEEP_BATCH', '5000'))
+SESSION_SWEEP_MAX_BATCHES = int(os.environ.get('SESSION_SWEEP_MAX_BATCHES', '20'))
+SESSION_PARTITIONS_AHEAD = int(os.environ.get('SESSION_PARTITIONS_AHEAD', '3'))
+
+def _month_start(year: int, month: int) -> date:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+def ensure_session_partitions(cur) -> None:
+    conn = cur.connection
+    today = date.today()
+    for offset in range(SESSION_PARTITIONS_AHEAD + 1):
+        start = _month_start(today.year, today.month + offset)
+        end = _month_start(start.year, start.month + 1)
+        name = f"sessions_p{start.strftime('%Y%m')}"
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", (f'{SCHEMA}.{name}',))
+        if cur.fetchone()['present']:
+            continue
         
-        cur.execute(f"DELETE FROM {SCHEMA}.sessions WHERE user_id = {escape_string(user_id)}")
-        cur.execute(f"DELETE FROM {SCHEMA}.password_reset_tokens WHERE user_id = {escape_string(user_id)}")
+        # Если расписание пропустило месяц, его сессии уже лежат в DEFAULT, и CREATE ... PARTITION OF упадёт.
+        # Поэтому секция создаётся отдельно, строки диапазона переносятся из DEFAULT и она подключается в одной транзакции
+        conn.autocommit = False
+        try:
+            cur.execute(f"LOCK TABLE {SCHEMA}.sessions_default IN ACCESS EXCLUSIVE MODE")
+            cur.execute(f"CREATE TABLE {SCHEMA}.{name} (LIKE {SCHEMA}.sessions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+            cur.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {SCHEMA}.sessions_default
+                    WHERE expires_at >= %(start)s AND expires_at < %(end)s
+                    RETURNING *
+                )
+                INSERT INTO {SCHEMA}.{name} SELECT * FROM moved
+                """,
+                {'start': start, 'end': end}
+            )
+            cur.execute(
+                f"ALTER TABLE {SCHEMA}.sessions ATTACH PARTITION {SCHEMA}.{name} FOR VALUES FROM (%s) TO (%s)",
+                (start, end)
+            )
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+
+def drop_expired_session_partitions(cur) -> List[str]:
+    # Секция прошедшего месяца целиком состоит из истёкших сессий
+    cur.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = %s AND p.relname = 'sessions'
+        """,
+        (SCHEMA,)
+    )
+    current = date.today().strftime('%Y%m')
+    dropped = []
+    for row in cur.fetchall():
+        match = re.fullmatch(r'sessions_p(\d{6})', row['relname'])
+        if match and match.group(1) < current:
+            cur.execute(f"DROP TABLE {SCHEMA}.{row['relname']}")
+            dropped.append(row['relname'])
+    return dropped
+
+def sweep_sessions() -> Dict[str, Any]:
+    """Обслуживание сессий: новые месячные секции, удаление прошедших и очистка истёкших сессий, отзывов и кодов порциями."""
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        ensure_session_partitions(cur)
+        dropped = drop_expired_session_partitions(cur)
         
-        cur.execute(f"SELECT family_id FROM {SCHEMA}.family_members WHERE user_id = {escape_string(user_id)}")
-        member_data = cur.fetchone()
+        deleted = 0
+        for _ in range(SESSION_SWEEP_MAX_BATCHES):
+            cur.execute(
+                f"""
+                DELETE FROM {SCHEMA}.sessions
+                WHERE (id, expires_at) IN (
+                    SELECT id, expires_at FROM {SCHEMA}.sessions
+                    WHERE expires_at < CURRENT_TIMESTAMP
+                    LIMIT %s
+                )
+                """,
+                (SESSION_SWEEP_BATCH,)
+            )
+            deleted += cur.rowcount
+            if cur.rowcount < SESSION_SWEEP_BATCH:
+                break
         
-        if member_data:
-            family_id = member_data['family_id']
-            
-            cur.execute(f"SELECT COUNT(*) as count FROM {SCHEMA}.family_members WHERE family_id = {escape_string(family_id)}")
-            members_count = cur.fetchone()['count']
-            
-            if members_count <= 1:
-                cur.execute(f"DELETE FROM {SCHEMA}.tasks WHERE family_id = {escape_string(family_id)}")
-                cur.execute(f"DELETE FROM {SCHEMA}.family_invites WHERE family_id = {escape_string(family_id)}")
-                cur.execute(f"DELETE FROM {SCHEMA}.family_members WHERE family_id = {escape_string(family_id)}")
-                cur.execute(f"DELETE FROM {SCHEMA}.families WHERE id = {escape_string(family_id)}")
-            else:
-                cur.execute(f"DELETE FROM {SCHEMA}.family_members WHERE user_id = {escape_string(user_id)}")
+        cur.execute(
+            f"""
+            DELETE FROM {SCHEMA}.revoked_tokens
+            WHERE id IN (
+                SELECT id FROM {SCHEMA}.revoked_tokens
+                WHERE expires_at < now()
+                LIMIT %s
+            )
+            """,
+            (SESSION_SWEEP_BATCH,)
+        )
         
-        cur.execute(f"DELETE FROM {SCHEMA}.users WHERE id = {escape_string(user_id)}")
+        deleted_revocations = cur.rowcount
         
-        return {'success': True, 'message': 'Аккаунт успешно удалён'}
+        return {
+            'success': True,
+            'deleted_sessions': deleted,
+            'deleted_revocations': deleted_revocations,
+            'deleted_codes': code_store_sweep(cur),
+            'dropped_partitions': dropped
+        }
     except Exception as e:
-        return {'error': f'Ошибка удаления: {str(e)}'}
+        return {'error': str(e)}
     finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
+        cur.close()
+        release_db_connection(conn)
+
+RATE_LIMITED_ACTIONS = {'login', 'register', 'forgot_password', 'verify_reset_code'}
+
+# Обслуживание по расписанию, под заголовком X-Cron-Secret
+CRON_ACTIONS = {
+    'sweep_sessions': sweep_sessions,
+    'purge_families': purge_deleted_families,
+}
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
@@ -616,7 +1231,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Cron-Secret',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -634,6 +1249,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         query_params = event.get('queryStringParameters') or {}
         path = query_params.get('action', 'login')
         
+        # Отсекаем шквал повторов до любого обращения к БД
+        if method == 'POST' and path in RATE_LIMITED_ACTIONS:
+            retry_after = check_rate_limit([
+                ('ip', client_ip(event)),
+                ('phone', rate_limit_key(body.get('login') or body.get('phone'))),
+                ('family', (body.get('invite_code') or '').strip().upper() or None)
+            ])
+            if retry_after:
+                return {
+                    'statusCode': 429,
+                    'headers': dict(headers, **{'Retry-After': str(retry_after)}),
+                    'body': json.dumps({'error': 'Слишком много попыток, повторите позже', 'retry_after': retry_after}),
+                    'isBase64Encoded': False
+                }
+        
+        if method == 'POST' and path in CRON_ACTIONS:
+            all_headers = event.get('headers') or {}
+            cron_secret = all_headers.get('X-Cron-Secret', '') or all_headers.get('x-cron-secret', '')
+            if not AUTH_CRON_SECRET or not hmac.compare_digest(cron_secret, AUTH_CRON_SECRET):
+                return {
+                    'statusCode': 403,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Доступ запрещён'}),
+                    'isBase64Encoded': False
+                }
+            result = CRON_ACTIONS[path]()
+            return {
+                'statusCode': 200 if 'success' in result else 500,
+                'headers': headers,
+                'body': json.dumps(result),
+                'isBase64Encoded': False
+            }
+        
         if method == 'POST':
             if path == 'register':
                 invite_code = body.get('invite_code', '')
@@ -811,4 +1459,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': headers,
             'body': json.dumps({'error': f'Server error: {str(e)}', 'type': type(e).__name__}),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+if __name__ == '__main__':
+    # Локальный запуск обслуживания: python index.py
+    print(json.dumps(sweep_sessions()))
+    print(json.dumps(purge_deleted_families()))
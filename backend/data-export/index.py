@@ -1,221 +1,850 @@
 """
 Business: Экспорт данных семьи в PDF или Excel для резервных копий
-Args: event с httpMethod, queryStringParameters (format: pdf/excel), headers с X-Auth-Token
-Returns: файл PDF или Excel со всеми данными семьи
+Args: event с httpMethod, queryStringParameters (format: pdf/excel/archive), headers с X-Auth-Token
+Returns: файл PDF или Excel со всеми данными семьи либо статус фонового экспорта (POST, job_id)
 """
 
 import json
 import os
+import base64
+import hashlib
+import hmac
+import struct
+import uuid
+import threading
+import weakref
+import time
+import re
 import csv
-import io
+import html
+import tempfile
+import zipfile
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = 't_p5815085_family_assistant_pro'
 
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+# Пул соединений живёт между тёплыми вызовами функции
+_pool_lock = threading.Lock()
+_idle_connections: List[Tuple[Any, float]] = []
+
+def _discard_connection(conn) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_connection_alive(conn, idle_for: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
+    now = time.monotonic()
+    with _pool_lock:
+        stale = [c for c, released_at in _idle_connections if now - released_at >= DB_POOL_IDLE_TIMEOUT]
+        _idle_connections[:] = [item for item in _idle_connections if item[0] not in stale]
+    for conn in stale:
+        _discard_connection(conn)
+    
+    while True:
+        with _pool_lock:
+            if not _idle_connections:
+                break
+            conn, released_at = _idle_connections.pop()
+        if _is_connection_alive(conn, now - released_at):
+            return conn
+        _discard_connection(conn)
+    
     return psycopg2.connect(DATABASE_URL)
 
-def verify_token(token: str) -> Optional[str]:
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard_connection(conn)
+        return
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_MAX_SIZE:
+            _idle_connections.append((conn, time.monotonic()))
+            return
+    _discard_connection(conn)
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+
+# Имена подготовленных на каждом соединении запросов; запись пропадает вместе с соединением
+_prepared_on_connection = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name: str, params: Tuple = ()) -> None:
+    """Выполняет запрос из PREPARED_STATEMENTS по имени; PREPARE делается один раз на соединение."""
+    sql = PREPARED_STATEMENTS[name]
+    if not PREPARED_STATEMENTS_ENABLED:
+        # Для пулеров в режиме транзакций: тот же текст, но обычным параметризованным запросом
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = _prepared_on_connection.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {sql}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+# Горячие запросы модуля: имя -> SQL с позиционными параметрами $1, $2...
+PREPARED_STATEMENTS = {
+    # Сессия, семья, член семьи и его права одним запросом
+    'auth_context': f"""
+        SELECT s.user_id, fm.family_id, fm.id AS member_id, fm.permissions,
+               f.name AS family_name
+        FROM {SCHEMA}.sessions s
+        LEFT JOIN {SCHEMA}.family_members fm
+            ON fm.user_id = s.user_id AND fm.family_id IS NOT NULL
+        LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+        WHERE s.token = $1 AND s.expires_at > CURRENT_TIMESTAMP
+        LIMIT 1
+    """,
+}
+
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', '5'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '1024'))
+
+# Кэш сессий: token -> (истекает, данные); None кэшируется для неизвестных токенов
+_token_cache: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+def _token_cache_get(token: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    now = time.monotonic()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _token_cache[token]
+            _token_cache_stats['misses'] += 1
+            return False, None
+        _token_cache.move_to_end(token)
+        _token_cache_stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+        return True, entry[1]
+
+def _token_cache_put(token: str, value: Optional[Dict[str, Any]]) -> None:
+    ttl = TOKEN_CACHE_TTL if value is not None else TOKEN_CACHE_NEGATIVE_TTL
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + ttl, value)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
+def invalidate_token_cache(token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    with _token_cache_lock:
+        if token is not None:
+            _token_cache.pop(token, None)
+        if user_id is not None:
+            stale = [key for key, (_, value) in _token_cache.items() if value and value.get('user_id') == user_id]
+            for key in stale:
+                del _token_cache[key]
+
+def get_token_cache_stats() -> Dict[str, int]:
+    with _token_cache_lock:
+        return dict(_token_cache_stats, size=len(_token_cache))
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', '60'))
+# Запас на транзакции, которые закоммитили отзыв позже, чем поставили revoked_at
+REVOCATION_SYNC_OVERLAP = float(os.environ.get('REVOCATION_SYNC_OVERLAP', '300'))
+SIGNED_TOKEN_PREFIX = 's1.'
+# user_id, family_id, member_id, выдан (мс), истекает (с), nonce
+_SIGNED_PAYLOAD = struct.Struct('>16s16s16sQI8s')
+
+_revocation_lock = threading.Lock()
+_revocation_state = {'revoked_since': 0.0, 'synced_at': 0.0}
+_revoked_nonces: Dict[str, float] = {}
+_revoked_users: Dict[str, float] = {}
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def decode_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload_b64, signature_b64 = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    
+    expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature) or len(payload) != _SIGNED_PAYLOAD.size:
+        return None
+    
+    user_id, family_id, member_id, issued_at, expires_at, nonce = _SIGNED_PAYLOAD.unpack(payload)
+    if expires_at <= time.time():
+        return None
+    
+    return {
+        'user_id': str(uuid.UUID(bytes=user_id)),
+        'family_id': str(uuid.UUID(bytes=family_id)) if any(family_id) else None,
+        'member_id': str(uuid.UUID(bytes=member_id)) if any(member_id) else None,
+        'issued_at': issued_at / 1000,
+        'expires_at': expires_at,
+        'nonce': nonce.hex()
+    }
+
+def _refresh_revocations() -> None:
+    now = time.time()
+    with _revocation_lock:
+        if now - _revocation_state['synced_at'] < REVOCATION_REFRESH_INTERVAL:
+            return
+        _revocation_state['synced_at'] = now
+        since = _revocation_state['revoked_since']
+    
+    # id из последовательности выдаётся до коммита, поэтому новые отзывы ищутся по времени
+    # с перекрытием: запись, закоммиченная позже чужой, всё равно попадёт в следующую выборку
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp()) AS synced_at")
+        synced_at = float(cur.fetchone()['synced_at'])
+        cur.execute(
+            f"""
+            SELECT user_id, token_nonce,
+                   EXTRACT(EPOCH FROM revoked_at) AS revoked_at,
+                   EXTRACT(EPOCH FROM expires_at) AS expires_at
+            FROM {SCHEMA}.revoked_tokens
+            WHERE revoked_at > to_timestamp(%s) - make_interval(secs => %s)
+            AND expires_at > CURRENT_TIMESTAMP
+            """,
+            (since, REVOCATION_SYNC_OVERLAP)
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    cur.execute(
-        f"""
-        SELECT user_id FROM {SCHEMA}.sessions 
-        WHERE token = %s AND expires_at > CURRENT_TIMESTAMP
-        """,
-        (token,)
-    )
-    session = cur.fetchone()
-    cur.close()
-    conn.close()
+    # Повторно прочитанные записи безвредны: nonce — ключ словаря, для пользователя берётся максимум
+    with _revocation_lock:
+        for row in rows:
+            if row['token_nonce']:
+                _revoked_nonces[row['token_nonce']] = float(row['expires_at'])
+            else:
+                user_id = str(row['user_id'])
+                _revoked_users[user_id] = max(_revoked_users.get(user_id, 0.0), float(row['revoked_at']))
+        _revocation_state['revoked_since'] = max(_revocation_state['revoked_since'], synced_at)
+        for nonce in [n for n, expires_at in _revoked_nonces.items() if expires_at <= now]:
+            del _revoked_nonces[nonce]
+
+def is_signed_token_revoked(claims: Dict[str, Any]) -> bool:
+    _refresh_revocations()
+    with _revocation_lock:
+        if claims['nonce'] in _revoked_nonces:
+            return True
+        return claims['issued_at'] < _revoked_users.get(claims['user_id'], 0.0)
+
+def get_auth_context(token: str) -> Optional[Dict[str, Any]]:
+    if not token:
+        return None
     
-    return str(session['user_id']) if session else None
+    # Подписанный токен проверяется без обращения к sessions
+    claims = decode_signed_token(token)
+    if claims and claims['family_id'] and not is_signed_token_revoked(claims):
+        return {
+            'user_id': claims['user_id'],
+            'family_id': claims['family_id'],
+            'member_id': claims['member_id'],
+            'family_name': None,
+            'permissions': None
+        }
+    
+    found, cached = _token_cache_get(token)
+    if found:
+        return cached
+    
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        execute_prepared(cur, 'auth_context', (token,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    auth = None
+    if row:
+        auth = {
+            'user_id': str(row['user_id']),
+            'family_id': str(row['family_id']) if row['family_id'] else None,
+            'member_id': str(row['member_id']) if row['member_id'] else None,
+            'family_name': row['family_name'],
+            'permissions': row['permissions'] or {}
+        }
+    
+    _token_cache_put(token, auth)
+    return auth
 
-def get_family_data(user_id: str) -> Dict[str, Any]:
+def get_family_data(auth: Dict[str, Any]) -> Dict[str, Any]:
+    family_id = auth['family_id']
+    if not family_id:
+        return {'error': 'Семья не найдена'}
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(
-        f"""
-        SELECT fm.family_id, f.name as family_name
-        FROM {SCHEMA}.family_members fm
-        JOIN {SCHEMA}.families f ON fm.family_id = f.id
-        WHERE fm.user_id = %s LIMIT 1
-        """,
-        (user_id,)
-    )
-    family_info = cur.fetchone()
+    try:
+        family_name = auth['family_name']
+        if family_name is None:
+            cur.execute(f"SELECT name FROM {SCHEMA}.families WHERE id = %s", (family_id,))
+            family_name = cur.fetchone()['name']
+        
+        cur.execute(
+            f"""
+            SELECT id, name, role, relationship, points, level, workload, created_at
+            FROM {SCHEMA}.family_members
+            WHERE family_id = %s
+            ORDER BY created_at
+            """,
+            (family_id,)
+        )
+        members = cur.fetchall()
+        
+        cur.execute(
+            f"""
+            SELECT t.id, t.title, t.description, t.completed, t.points, t.priority, 
+                   t.category, t.created_at, fm.name as assignee_name
+            FROM {SCHEMA}.tasks t
+            LEFT JOIN {SCHEMA}.family_members fm ON t.assignee_id = fm.id
+            WHERE t.family_id = %s
+            ORDER BY t.created_at DESC
+            """,
+            (family_id,)
+        )
+        tasks = cur.fetchall()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    if not family_info:
+    return {
+        'family_name': family_name,
+        'members': [dict(m) for m in members],
+        'tasks': [dict(t) for t in tasks],
+        'export_date': datetime.now().isoformat()
+    }
+
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '2000'))
+EXPORT_SPOOL_MAX_SIZE = int(os.environ.get('EXPORT_SPOOL_MAX_SIZE', str(1024 * 1024)))
+
+def resolve_family_name(cur, auth: Dict[str, Any]) -> str:
+    if auth['family_name'] is not None:
+        return auth['family_name']
+    cur.execute(f"SELECT name FROM {SCHEMA}.families WHERE id = %s", (auth['family_id'],))
+    return cur.fetchone()[0]
+
+def stream_rows(conn, query: str, params: Tuple):
+    # Именованный курсор читает строки на стороне сервера порциями по EXPORT_FETCH_SIZE
+    cur = conn.cursor(name=f'export_{uuid.uuid4().hex}')
+    cur.itersize = EXPORT_FETCH_SIZE
+    try:
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Семья не найдена'}
+
+def write_csv_export(conn, auth: Dict[str, Any], output) -> None:
+    family_id = auth['family_id']
+    cur = conn.cursor()
+    family_name = resolve_family_name(cur, auth)
+    cur.close()
     
-    family_id = family_info['family_id']
+    writer = csv.writer(output)
+    writer.writerow(['Семейный Органайзер - Экспорт данных'])
+    writer.writerow([f'Семья: {family_name}'])
+    writer.writerow([f"Дата экспорта: {datetime.now().strftime('%d.%m.%Y %H:%M')}"])
+    writer.writerow([])
     
-    cur.execute(
+    writer.writerow(['=== ЧЛЕНЫ СЕМЬИ ==='])
+    writer.writerow(['Имя', 'Роль', 'Родство', 'Баллы', 'Уровень', 'Загрузка %', 'Дата добавления'])
+    members_count = 0
+    total_points = 0
+    for row in stream_rows(
+        conn,
         f"""
-        SELECT id, name, role, relationship, points, level, workload, created_at
+        SELECT name, role, COALESCE(relationship, ''), points, level, workload, created_at
         FROM {SCHEMA}.family_members
         WHERE family_id = %s
         ORDER BY created_at
         """,
         (family_id,)
-    )
-    members = cur.fetchall()
+    ):
+        writer.writerow(row)
+        members_count += 1
+        total_points += row[3] or 0
     
-    cur.execute(
+    writer.writerow([])
+    writer.writerow(['=== ЗАДАЧИ ==='])
+    writer.writerow(['Название', 'Описание', 'Исполнитель', 'Выполнена', 'Баллы', 'Приоритет', 'Категория', 'Дата создания'])
+    tasks_count = 0
+    completed_count = 0
+    for title, description, assignee, completed, points, priority, category, created_at in stream_rows(
+        conn,
         f"""
-        SELECT t.id, t.title, t.description, t.completed, t.points, t.priority, 
-               t.category, t.created_at, fm.name as assignee_name
+        SELECT t.title, t.description, COALESCE(fm.name, ''), t.completed, t.points,
+               t.priority, COALESCE(t.category, ''), t.created_at
         FROM {SCHEMA}.tasks t
         LEFT JOIN {SCHEMA}.family_members fm ON t.assignee_id = fm.id
         WHERE t.family_id = %s
         ORDER BY t.created_at DESC
         """,
         (family_id,)
-    )
-    tasks = cur.fetchall()
+    ):
+        writer.writerow([
+            title, description or '', assignee, 'Да' if completed else 'Нет',
+            points, priority, category, created_at
+        ])
+        tasks_count += 1
+        completed_count += 1 if completed else 0
     
-    cur.close()
-    conn.close()
-    
-    return {
-        'family_name': family_info['family_name'],
-        'members': [dict(m) for m in members],
-        'tasks': [dict(t) for t in tasks],
-        'export_date': datetime.now().isoformat()
+    writer.writerow([])
+    writer.writerow(['=== СТАТИСТИКА ==='])
+    writer.writerow(['Всего членов семьи', members_count])
+    writer.writerow(['Всего задач', tasks_count])
+    writer.writerow(['Выполнено задач', completed_count])
+    writer.writerow(['Общие баллы семьи', total_points])
+
+def generate_csv_export(auth: Dict[str, Any]) -> str:
+    # Строки пишутся во временный файл по мере чтения курсора: в памяти нет ни списков строк, ни StringIO целиком
+    conn = get_db_connection()
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE, mode='w+', encoding='utf-8', newline='') as output:
+            write_csv_export(conn, auth, output)
+            conn.commit()
+            output.seek(0)
+            return output.read()
+    finally:
+        release_db_connection(conn)
+
+# Все таблицы, относящиеся к семье, для полного архива.
+# Таблицы из V0006 хранят family_id и ссылки на членов семьи как INTEGER при UUID у семей,
+# поэтому сравнение идёт через ::text: при несовпадении типов файл таблицы пустой, а не ошибка COPY
+FULL_EXPORT_TABLES = {
+    'families': f"SELECT * FROM {SCHEMA}.families WHERE id = %(family_id)s",
+    'family_members': f"SELECT * FROM {SCHEMA}.family_members WHERE family_id = %(family_id)s ORDER BY created_at",
+    'tasks': f"SELECT * FROM {SCHEMA}.tasks WHERE family_id = %(family_id)s ORDER BY created_at",
+    'reminders': f"""
+        SELECT r.* FROM {SCHEMA}.reminders r
+        JOIN {SCHEMA}.tasks t ON r.task_id = t.id
+        WHERE t.family_id = %(family_id)s
+    """,
+    'children_profiles': f"SELECT * FROM {SCHEMA}.children_profiles WHERE family_id::text = %(family_id)s::text",
+    'test_results': f"""
+        SELECT tr.* FROM {SCHEMA}.test_results tr
+        JOIN {SCHEMA}.family_members fm ON tr.child_member_id::text = fm.id::text
+        WHERE fm.family_id = %(family_id)s
+    """,
+    'calendar_events': f"SELECT * FROM {SCHEMA}.calendar_events WHERE family_id::text = %(family_id)s::text",
+    'family_values': f"SELECT * FROM {SCHEMA}.family_values WHERE family_id::text = %(family_id)s::text",
+    'traditions': f"SELECT * FROM {SCHEMA}.traditions WHERE family_id::text = %(family_id)s::text",
+    'blog_posts': f"SELECT * FROM {SCHEMA}.blog_posts WHERE family_id::text = %(family_id)s::text",
+    'family_album': f"SELECT * FROM {SCHEMA}.family_album WHERE family_id::text = %(family_id)s::text",
+    'family_tree': f"SELECT * FROM {SCHEMA}.family_tree WHERE family_id::text = %(family_id)s::text",
+    'chat_messages': f"SELECT * FROM {SCHEMA}.chat_messages WHERE family_id::text = %(family_id)s::text ORDER BY created_at",
+    'family_invites': f"SELECT * FROM {SCHEMA}.family_invites WHERE family_id = %(family_id)s",
+    'subscriptions': f"SELECT * FROM {SCHEMA}.subscriptions WHERE family_id = %(family_id)s",
+    'payments': f"SELECT * FROM {SCHEMA}.payments WHERE family_id = %(family_id)s",
+}
+
+def write_full_archive(conn, auth: Dict[str, Any], output) -> Dict[str, Any]:
+    # Каждая таблица выгружается сервером через COPY ... TO STDOUT прямо в сжатый файл архива
+    cur = conn.cursor()
+    manifest = {
+        'family_id': auth['family_id'],
+        'family_name': resolve_family_name(cur, auth),
+        'export_date': datetime.now().isoformat(),
+        'tables': list(FULL_EXPORT_TABLES)
     }
+    
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for table, query in FULL_EXPORT_TABLES.items():
+            # COPY не принимает параметры, поэтому запрос подставляется через mogrify
+            sql = cur.mogrify(query, {'family_id': auth['family_id']}).decode('utf-8')
+            with archive.open(f'{table}.csv', 'w') as entry:
+                cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", entry)
+        archive.writestr('manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2))
+    
+    cur.close()
+    return manifest
 
-def generate_csv_export(data: Dict[str, Any]) -> str:
-    output = io.StringIO()
+def generate_full_archive(auth: Dict[str, Any]) -> bytes:
+    conn = get_db_connection()
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE) as output:
+            write_full_archive(conn, auth, output)
+            conn.commit()
+            output.seek(0)
+            return output.read()
+    finally:
+        release_db_connection(conn)
+
+REPORT_TASKS_PER_SECTION = int(os.environ.get('REPORT_TASKS_PER_SECTION', '500'))
+
+# Шаблоны отчёта собираются один раз при загрузке модуля, при рендеринге только подставляются значения
+REPORT_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {{ font-family: Arial, sans-serif; margin: 40px; }}
+        h1 {{ color: #2563eb; }}
+        h2 {{ color: #4b5563; border-bottom: 2px solid #e5e7eb; padding-bottom: 10px; }}
+        table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
+        th {{ background: #3b82f6; color: white; padding: 12px; text-align: left; }}
+        td {{ padding: 10px; border-bottom: 1px solid #e5e7eb; }}
+        .completed {{ color: #10b981; font-weight: bold; }}
+        .pending {{ color: #ef4444; }}
+        .stats {{ background: #f3f4f6; padding: 20px; border-radius: 8px; margin: 20px 0; }}
+        .page {{ page-break-before: always; }}
+    </style>
+</head>
+<body>
+    <h1>🏠 Семейный Органайзер</h1>
+    <p><strong>Семья:</strong> {family_name}</p>
+    <p><strong>Дата экспорта:</strong> {export_date}</p>
+"""
+
+REPORT_MEMBERS_HEAD = """
+    <h2>👨‍👩‍👧‍👦 Члены семьи</h2>
+    <table>
+        <tr><th>Имя</th><th>Роль</th><th>Родство</th><th>Баллы</th><th>Уровень</th><th>Загрузка</th></tr>
+"""
+REPORT_MEMBER_ROW = "        <tr><td>{name}</td><td>{role}</td><td>{relationship}</td><td>{points}</td><td>{level}</td><td>{workload}%</td></tr>\n"
+
+REPORT_TASKS_HEAD = """
+    <h2{page_class}>✅ Задачи{section_title}</h2>
+    <table>
+        <tr><th>Название</th><th>Исполнитель</th><th>Статус</th><th>Баллы</th><th>Приоритет</th></tr>
+"""
+REPORT_TASK_ROW = "        <tr><td>{title}</td><td>{assignee}</td><td>{status}</td><td>{points}</td><td>{priority}</td></tr>\n"
+REPORT_TABLE_END = "    </table>\n"
+
+REPORT_STATUS_DONE = '<span class="completed">✓ Выполнена</span>'
+REPORT_STATUS_PENDING = '<span class="pending">⏳ В работе</span>'
+
+REPORT_FOOT = """
+    <div class="stats">
+        <h2>📊 Статистика</h2>
+        <p><strong>Всего членов семьи:</strong> {members_count}</p>
+        <p><strong>Всего задач:</strong> {tasks_count}</p>
+        <p><strong>Выполнено задач:</strong> {completed_count} ({completed_percent}%)</p>
+        <p><strong>Общие баллы семьи:</strong> {total_points}</p>
+    </div>
     
-    output.write(f"Семейный Органайзер - Экспорт данных\n")
-    output.write(f"Семья: {data['family_name']}\n")
-    output.write(f"Дата экспорта: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
-    output.write("\n")
+    <p style="color: #6b7280; font-size: 12px; margin-top: 40px;">
+        Экспортировано из Семейного Органайзера • poehali.dev
+    </p>
+</body>
+</html>
+"""
+
+def _cell(value: Any, default: str = '-') -> str:
+    return html.escape(str(value)) if value not in (None, '') else default
+
+def generate_html_for_pdf(data: Dict[str, Any]) -> str:
+    # Части копятся в списке и склеиваются один раз: время линейно по числу строк
+    parts = [REPORT_HEAD.format(
+        family_name=_cell(data['family_name']),
+        export_date=datetime.now().strftime('%d.%m.%Y %H:%M')
+    )]
     
-    output.write("=== ЧЛЕНЫ СЕМЬИ ===\n")
-    output.write("Имя,Роль,Родство,Баллы,Уровень,Загрузка %,Дата добавления\n")
+    parts.append(REPORT_MEMBERS_HEAD)
+    member_row = REPORT_MEMBER_ROW.format
     for member in data['members']:
-        output.write(f"{member['name']},{member['role']},{member.get('relationship', '')},{member['points']},{member['level']},{member['workload']},{member['created_at']}\n")
+        parts.append(member_row(
+            name=_cell(member['name']),
+            role=_cell(member['role']),
+            relationship=_cell(member.get('relationship')),
+            points=_cell(member['points'], '0'),
+            level=_cell(member['level'], '0'),
+            workload=_cell(member['workload'], '0')
+        ))
+    parts.append(REPORT_TABLE_END)
     
-    output.write("\n=== ЗАДАЧИ ===\n")
-    output.write("Название,Описание,Исполнитель,Выполнена,Баллы,Приоритет,Категория,Дата создания\n")
-    for task in data['tasks']:
-        completed = 'Да' if task['completed'] else 'Нет'
-        desc = (task['description'] or '').replace('\n', ' ').replace(',', ';')
-        output.write(f"{task['title']},{desc},{task.get('assignee_name', '')},{completed},{task['points']},{task['priority']},{task.get('category', '')},{task['created_at']}\n")
+    tasks = data['tasks']
+    sections = max((len(tasks) + REPORT_TASKS_PER_SECTION - 1) // REPORT_TASKS_PER_SECTION, 1)
+    task_row = REPORT_TASK_ROW.format
+    completed_count = 0
+    for section in range(sections):
+        parts.append(REPORT_TASKS_HEAD.format(
+            page_class=' class="page"' if section else '',
+            section_title=f' ({section + 1} из {sections})' if sections > 1 else ''
+        ))
+        for task in tasks[section * REPORT_TASKS_PER_SECTION:(section + 1) * REPORT_TASKS_PER_SECTION]:
+            completed_count += 1 if task['completed'] else 0
+            parts.append(task_row(
+                title=_cell(task['title']),
+                assignee=_cell(task.get('assignee_name')),
+                status=REPORT_STATUS_DONE if task['completed'] else REPORT_STATUS_PENDING,
+                points=_cell(task['points'], '0'),
+                priority=_cell(task['priority'])
+            ))
+        parts.append(REPORT_TABLE_END)
     
-    output.write(f"\n=== СТАТИСТИКА ===\n")
-    output.write(f"Всего членов семьи,{len(data['members'])}\n")
-    output.write(f"Всего задач,{len(data['tasks'])}\n")
-    output.write(f"Выполнено задач,{sum(1 for t in data['tasks'] if t['completed'])}\n")
-    output.write(f"Общие баллы семьи,{sum(m['points'] for m in data['members'])}\n")
+    total_tasks = len(tasks)
+    parts.append(REPORT_FOOT.format(
+        members_count=len(data['members']),
+        tasks_count=total_tasks,
+        completed_count=completed_count,
+        completed_percent=round(completed_count / total_tasks * 100 if total_tasks > 0 else 0),
+        total_points=sum(m['points'] or 0 for m in data['members'])
+    ))
     
-    return output.getvalue()
+    return ''.join(parts)
 
-def generate_html_for_pdf(data: Dict[str, Any]) -> str:
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 40px; }}
-            h1 {{ color: #2563eb; }}
-            h2 {{ color: #4b5563; border-bottom: 2px solid #e5e7eb; padding-bottom: 10px; }}
-            table {{ width: 100%; border-collapse: collapse; margin: 20px 0; }}
-            th {{ background: #3b82f6; color: white; padding: 12px; text-align: left; }}
-            td {{ padding: 10px; border-bottom: 1px solid #e5e7eb; }}
-            .completed {{ color: #10b981; font-weight: bold; }}
-            .pending {{ color: #ef4444; }}
-            .stats {{ background: #f3f4f6; padding: 20px; border-radius: 8px; margin: 20px 0; }}
-        </style>
-    </head>
-    <body>
-        <h1>🏠 Семейный Органайзер</h1>
-        <p><strong>Семья:</strong> {data['family_name']}</p>
-        <p><strong>Дата экспорта:</strong> {datetime.now().strftime('%d.%m.%Y %H:%M')}</p>
-        
-        <h2>👨‍👩‍👧‍👦 Члены семьи</h2>
-        <table>
-            <tr>
-                <th>Имя</th>
-                <th>Роль</th>
-                <th>Родство</th>
-                <th>Баллы</th>
-                <th>Уровень</th>
-                <th>Загрузка</th>
-            </tr>
-    """
+def benchmark_html_report(sizes: Tuple[int, ...] = (1000, 10000, 50000)) -> List[Dict[str, Any]]:
+    """Замеряет рендеринг отчёта на синтетических данных; время на задачу должно оставаться постоянным."""
+    members = [
+        {'name': f'Член <{i}>', 'role': 'parent', 'relationship': None, 'points': i, 'level': 1, 'workload': 50}
+        for i in range(6)
+    ]
+    results = []
+    for size in sizes:
+        tasks = [
+            {'title': f'Задача & {i}', 'assignee_name': 'Мама', 'completed': i % 3 == 0, 'points': 10, 'priority': 'medium'}
+            for i in range(size)
+        ]
+        started = time.perf_counter()
+        report = generate_html_for_pdf({'family_name': 'Тест', 'members': members, 'tasks': tasks})
+        elapsed = time.perf_counter() - started
+        results.append({
+            'tasks': size,
+            'ms': round(elapsed * 1000, 1),
+            'us_per_task': round(elapsed / size * 1_000_000, 2),
+            'bytes': len(report)
+        })
+    return results
+
+EXPORT_FORMATS = ('csv', 'pdf', 'archive')
+EXPORT_WORKER_SECRET = os.environ.get('EXPORT_WORKER_SECRET', '')
+EXPORT_WORKER_BATCH = int(os.environ.get('EXPORT_WORKER_BATCH', '5'))
+EXPORT_WORKER_POLL_INTERVAL = float(os.environ.get('EXPORT_WORKER_POLL_INTERVAL', '5'))
+# Задача в статусе running дольше аренды считается брошенной упавшим воркером и забирается заново
+EXPORT_JOB_LEASE_MINUTES = int(os.environ.get('EXPORT_JOB_LEASE_MINUTES', '15'))
+
+def build_export(auth: Dict[str, Any], export_format: str) -> Tuple[bytes, str, str]:
+    stamp = datetime.now().strftime("%Y%m%d")
+    if export_format == 'archive':
+        return generate_full_archive(auth), 'application/zip', f'family_backup_{stamp}.zip'
+    if export_format == 'pdf':
+        html_content = generate_html_for_pdf(get_family_data(auth))
+        return html_content.encode('utf-8'), 'text/html; charset=utf-8', f'family_export_{stamp}.html'
+    return generate_csv_export(auth).encode('utf-8'), 'text/csv; charset=utf-8', f'family_export_{stamp}.csv'
+
+def export_response(content: bytes, content_type: str, filename: str, extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    headers = {
+        'Content-Type': content_type,
+        'Access-Control-Allow-Origin': '*',
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        **(extra_headers or {})
+    }
+    if content_type.startswith('text/'):
+        return {'statusCode': 200, 'headers': headers, 'body': content.decode('utf-8')}
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(content).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+EXPORT_JOB_FIELDS = 'id, format, family_version, status, checksum, size_bytes, error, created_at, finished_at'
+
+def serialize_job(job: Dict[str, Any], cached: bool = False) -> Dict[str, Any]:
+    return {
+        'id': str(job['id']),
+        'format': job['format'],
+        'family_version': job['family_version'],
+        'status': job['status'],
+        'checksum': job['checksum'],
+        'size_bytes': job['size_bytes'],
+        'error': job['error'],
+        'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None,
+        'cached': cached
+    }
+
+def create_export_job(auth: Dict[str, Any], export_format: str) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    for member in data['members']:
-        html += f"""
-            <tr>
-                <td>{member['name']}</td>
-                <td>{member['role']}</td>
-                <td>{member.get('relationship', '-')}</td>
-                <td>{member['points']}</td>
-                <td>{member['level']}</td>
-                <td>{member['workload']}%</td>
-            </tr>
-        """
-    
-    html += """
-        </table>
-        
-        <h2>✅ Задачи</h2>
-        <table>
-            <tr>
-                <th>Название</th>
-                <th>Исполнитель</th>
-                <th>Статус</th>
-                <th>Баллы</th>
-                <th>Приоритет</th>
-            </tr>
-    """
-    
-    for task in data['tasks'][:50]:
-        status = '<span class="completed">✓ Выполнена</span>' if task['completed'] else '<span class="pending">⏳ В работе</span>'
-        html += f"""
-            <tr>
-                <td>{task['title']}</td>
-                <td>{task.get('assignee_name', '-')}</td>
-                <td>{status}</td>
-                <td>{task['points']}</td>
-                <td>{task['priority']}</td>
-            </tr>
-        """
-    
-    total_tasks = len(data['tasks'])
-    completed_tasks = sum(1 for t in data['tasks'] if t['completed'])
-    total_points = sum(m['points'] for m in data['members'])
-    
-    html += f"""
-        </table>
+    try:
+        cur.execute(f"SELECT data_version FROM {SCHEMA}.families WHERE id = %s", (auth['family_id'],))
+        version = cur.fetchone()['data_version']
         
-        <div class="stats">
-            <h2>📊 Статистика</h2>
-            <p><strong>Всего членов семьи:</strong> {len(data['members'])}</p>
-            <p><strong>Всего задач:</strong> {total_tasks}</p>
-            <p><strong>Выполнено задач:</strong> {completed_tasks} ({round(completed_tasks/total_tasks*100 if total_tasks > 0 else 0)}%)</p>
-            <p><strong>Общие баллы семьи:</strong> {total_points}</p>
-        </div>
+        # Данные не менялись — отдаём готовый файл или уже поставленную задачу той же версии
+        cur.execute(
+            f"""
+            SELECT {EXPORT_JOB_FIELDS} FROM {SCHEMA}.export_jobs
+            WHERE family_id = %s AND format = %s AND family_version = %s
+            AND (
+                status IN ('pending', 'done')
+                OR (status = 'running' AND started_at > CURRENT_TIMESTAMP - make_interval(mins => %s))
+            )
+            ORDER BY (status = 'done') DESC, created_at DESC
+            LIMIT 1
+            """,
+            (auth['family_id'], export_format, version, EXPORT_JOB_LEASE_MINUTES)
+        )
+        job = cur.fetchone()
+        if job:
+            conn.commit()
+            return serialize_job(job, cached=job['status'] == 'done')
         
-        <p style="color: #6b7280; font-size: 12px; margin-top: 40px;">
-            Экспортировано из Семейного Органайзера • poehali.dev
-        </p>
-    </body>
-    </html>
-    """
+        cur.execute(
+            f"""
+            INSERT INTO {SCHEMA}.export_jobs (family_id, requested_by, format, family_version)
+            VALUES (%s, %s, %s, %s)
+            RETURNING {EXPORT_JOB_FIELDS}
+            """,
+            (auth['family_id'], auth['user_id'], export_format, version)
+        )
+        job = cur.fetchone()
+        conn.commit()
+        return serialize_job(job)
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def get_export_job(family_id: str, job_id: str, with_artifact: bool = False) -> Optional[Dict[str, Any]]:
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        extra = ', artifact, content_type, filename' if with_artifact else ''
+        cur.execute(
+            f"SELECT {EXPORT_JOB_FIELDS}{extra} FROM {SCHEMA}.export_jobs WHERE id = %s AND family_id = %s",
+            (job_id, family_id)
+        )
+        job = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    return html
+    return dict(job) if job else None
+
+def claim_export_jobs(limit: int) -> List[Dict[str, Any]]:
+    # SKIP LOCKED позволяет запускать несколько воркеров без двойной обработки
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cur.execute(
+            f"""
+            UPDATE {SCHEMA}.export_jobs
+            SET status = 'running', started_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM {SCHEMA}.export_jobs
+                WHERE status = 'pending'
+                OR (status = 'running' AND started_at <= CURRENT_TIMESTAMP - make_interval(mins => %s))
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, family_id, format, started_at
+            """,
+            (EXPORT_JOB_LEASE_MINUTES, limit)
+        )
+        jobs = [dict(job) for job in cur.fetchall()]
+        conn.commit()
+        return jobs
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def finish_export_job(job: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    """Записывает результат, только если воркер всё ещё держит аренду; возвращает, записан ли он."""
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        assignments = ', '.join(f"{field} = %s" for field in fields)
+        cur.execute(
+            f"""
+            UPDATE {SCHEMA}.export_jobs SET {assignments}, finished_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND status = 'running' AND started_at = %s
+            RETURNING family_id, format, family_version
+            """,
+            (*fields.values(), job['id'], job['started_at'])
+        )
+        finished = cur.fetchone()
+        if finished and fields.get('status') == 'done':
+            # Старые файлы той же семьи и формата больше не отдаются: держим только последний готовый
+            cur.execute(
+                f"""
+                DELETE FROM {SCHEMA}.export_jobs
+                WHERE family_id = %s AND format = %s AND id <> %s
+                AND status IN ('done', 'failed') AND family_version <= %s
+                """,
+                (finished[0], finished[1], job['id'], finished[2])
+            )
+        conn.commit()
+        return finished is not None
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+def run_export_job(job: Dict[str, Any]) -> None:
+    auth = {'family_id': str(job['family_id']), 'family_name': None}
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT data_version FROM {SCHEMA}.families WHERE id = %s", (auth['family_id'],))
+            version = cur.fetchone()[0]
+            conn.commit()
+        finally:
+            cur.close()
+            release_db_connection(conn)
+        
+        content, content_type, filename = build_export(auth, job['format'])
+        finish_export_job(job, {
+            'status': 'done',
+            'family_version': version,
+            'artifact': psycopg2.Binary(content),
+            'content_type': content_type,
+            'filename': filename,
+            'checksum': hashlib.sha256(content).hexdigest(),
+            'size_bytes': len(content)
+        })
+    except Exception as e:
+        finish_export_job(job, {'status': 'failed', 'error': str(e)})
+
+def process_export_jobs(limit: int = EXPORT_WORKER_BATCH) -> int:
+    jobs = claim_export_jobs(limit)
+    for job in jobs:
+        run_export_job(job)
+    return len(jobs)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
@@ -225,18 +854,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Worker-Secret',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    json_headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag, X-Checksum-SHA256'
+    }
+    
     try:
+        params = event.get('queryStringParameters') or {}
+        
+        if method == 'POST' and params.get('action') == 'work':
+            all_headers = event.get('headers') or {}
+            worker_secret = all_headers.get('X-Worker-Secret', '') or all_headers.get('x-worker-secret', '')
+            if not EXPORT_WORKER_SECRET or not hmac.compare_digest(worker_secret, EXPORT_WORKER_SECRET):
+                return {
+                    'statusCode': 403,
+                    'headers': json_headers,
+                    'body': json.dumps({'error': 'Доступ запрещён'})
+                }
+            processed = process_export_jobs()
+            return {
+                'statusCode': 200,
+                'headers': json_headers,
+                'body': json.dumps({'processed': processed})
+            }
+        
         token = event.get('headers', {}).get('X-Auth-Token', '')
-        user_id = verify_token(token)
+        auth = get_auth_context(token)
         
-        if not user_id:
+        if not auth:
             return {
                 'statusCode': 401,
                 'headers': {
@@ -246,44 +899,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Требуется авторизация'})
             }
         
-        data = get_family_data(user_id)
-        
-        if 'error' in data:
+        if not auth['family_id']:
             return {
                 'statusCode': 404,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps(data)
+                'body': json.dumps({'error': 'Семья не найдена'})
             }
         
-        params = event.get('queryStringParameters', {})
         export_format = params.get('format', 'csv').lower()
         
-        if export_format == 'pdf':
-            html_content = generate_html_for_pdf(data)
+        if export_format not in EXPORT_FORMATS:
             return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'text/html; charset=utf-8',
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Disposition': f'attachment; filename="family_export_{datetime.now().strftime("%Y%m%d")}.html"'
-                },
-                'body': html_content
+                'statusCode': 400,
+                'headers': json_headers,
+                'body': json.dumps({'error': 'Неизвестный формат экспорта'})
             }
         
-        else:
-            csv_content = generate_csv_export(data)
+        if method == 'POST':
+            job = create_export_job(auth, export_format)
+            return {
+                'statusCode': 200 if job['status'] == 'done' else 202,
+                'headers': json_headers,
+                'body': json.dumps({'job': job})
+            }
+        
+        job_id = params.get('job_id')
+        if job_id:
+            try:
+                job_id = str(uuid.UUID(job_id))
+            except ValueError:
+                job_id = None
+            download = params.get('download') == 'true'
+            job = get_export_job(auth['family_id'], job_id, with_artifact=download) if job_id else None
+            if not job:
+                return {
+                    'statusCode': 404,
+                    'headers': json_headers,
+                    'body': json.dumps({'error': 'Экспорт не найден'})
+                }
+            if download and job['status'] == 'done':
+                return export_response(
+                    bytes(job['artifact']), job['content_type'], job['filename'],
+                    {'ETag': f'"{job["checksum"]}"', 'X-Checksum-SHA256': job['checksum']}
+                )
             return {
                 'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'text/csv; charset=utf-8',
-                    'Access-Control-Allow-Origin': '*',
-                    'Content-Disposition': f'attachment; filename="family_export_{datetime.now().strftime("%Y%m%d")}.csv"'
-                },
-                'body': csv_content
+                'headers': json_headers,
+                'body': json.dumps({'job': serialize_job(job)})
             }
+        
+        return export_response(*build_export(auth, export_format))
     
     except Exception as e:
         return {
@@ -294,3 +962,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             },
             'body': json.dumps({'error': str(e)})
         }
+
+if __name__ == '__main__':
+    import sys
+    
+    # python index.py benchmark — замер рендеринга отчёта, без аргументов — локальный воркер очереди экспортов
+    if sys.argv[1:] == ['benchmark']:
+        for row in benchmark_html_report():
+            print(json.dumps(row))
+        sys.exit(0)
+    
+    while True:
+        if not process_export_jobs():
+            time.sleep(EXPORT_WORKER_POLL_INTERVAL)
@@ -6,196 +6,665 @@ Returns: JSON с данными семьи или ошибкой
 
 import json
 import os
-from typing import Dict, Any, Optional, List
+import base64
+import hashlib
+import hmac
+import struct
+import uuid
+import threading
+import weakref
+import time
+import re
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+from functools import lru_cache
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = 't_p5815085_family_assistant_pro'
 
-def escape_string(value: Any) -> str:
-    if value is None:
-        return 'NULL'
-    if isinstance(value, (int, float)):
-        return str(value)
-    if isinstance(value, bool):
-        return 'TRUE' if value else 'FALSE'
-    if isinstance(value, list):
-        return "'" + json.dumps(value).replace("'", "''") + "'"
-    if isinstance(value, dict):
-        return "'" + json.dumps(value).replace("'", "''") + "'"
-    return "'" + str(value).replace("'", "''") + "'"
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+# Пул соединений живёт между тёплыми вызовами функции
+_pool_lock = threading.Lock()
+_idle_connections: List[Tuple[Any, float]] = []
+
+def _discard_connection(conn) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_connection_alive(conn, idle_for: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
 
 def get_db_connection():
+    now = time.monotonic()
+    with _pool_lock:
+        stale = [c for c, released_at in _idle_connections if now - released_at >= DB_POOL_IDLE_TIMEOUT]
+        _idle_connections[:] = [item for item in _idle_connections if item[0] not in stale]
+    for conn in stale:
+        _discard_connection(conn)
+    
+    while True:
+        with _pool_lock:
+            if not _idle_connections:
+                break
+            conn, released_at = _idle_connections.pop()
+        if _is_connection_alive(conn, now - released_at):
+            return conn
+        _discard_connection(conn)
+    
     conn = psycopg2.connect(DATABASE_URL)
     conn.autocommit = True
     return conn
 
-def verify_token(token: str) -> Optional[Dict[str, Any]]:
-    if not token:
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard_connection(conn)
+        return
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_MAX_SIZE:
+            _idle_connections.append((conn, time.monotonic()))
+            return
+    _discard_connection(conn)
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+
+# Имена подготовленных на каждом соединении запросов; запись пропадает вместе с соединением
+_prepared_on_connection = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name: str, params: Tuple = ()) -> None:
+    """Выполняет запрос из PREPARED_STATEMENTS по имени; PREPARE делается один раз на соединение."""
+    sql = PREPARED_STATEMENTS[name]
+    if not PREPARED_STATEMENTS_ENABLED:
+        # Для пулеров в режиме транзакций: тот же текст, но обычным параметризованным запросом
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = _prepared_on_connection.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {sql}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+# Горячие запросы модуля: имя -> SQL с позиционными параметрами $1, $2...
+PREPARED_STATEMENTS = {
+    # Сессия, семья, член семьи и его права одним запросом
+    'auth_context': f"""
+        SELECT s.user_id, fm.family_id, fm.id AS member_id, fm.permissions,
+               f.name AS family_name
+        FROM {SCHEMA}.sessions s
+        LEFT JOIN {SCHEMA}.family_members fm
+            ON fm.user_id = s.user_id AND fm.family_id IS NOT NULL
+        LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+        WHERE s.token = $1 AND s.expires_at > CURRENT_TIMESTAMP
+        LIMIT 1
+    """,
+}
+
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', '5'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '1024'))
+
+# Кэш сессий: token -> (истекает, данные); None кэшируется для неизвестных токенов
+_token_cache: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+def _token_cache_get(token: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    now = time.monotonic()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _token_cache[token]
+            _token_cache_stats['misses'] += 1
+            return False, None
+        _token_cache.move_to_end(token)
+        _token_cache_stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+        return True, entry[1]
+
+def _token_cache_put(token: str, value: Optional[Dict[str, Any]]) -> None:
+    ttl = TOKEN_CACHE_TTL if value is not None else TOKEN_CACHE_NEGATIVE_TTL
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + ttl, value)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
+def invalidate_token_cache(token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    with _token_cache_lock:
+        if token is not None:
+            _token_cache.pop(token, None)
+        if user_id is not None:
+            stale = [key for key, (_, value) in _token_cache.items() if value and value.get('user_id') == user_id]
+            for key in stale:
+                del _token_cache[key]
+
+def get_token_cache_stats() -> Dict[str, int]:
+    with _token_cache_lock:
+        return dict(_token_cache_stats, size=len(_token_cache))
+
+# Построитель параметризованных запросов: текст SQL зависит только от таблицы и набора колонок,
+# поэтому запросы одной формы дают одинаковый текст и переиспользуют план
+@lru_cache(maxsize=256)
+def sql_insert(table: str, columns: Tuple[str, ...], returning: str = '') -> str:
+    sql = f"INSERT INTO {SCHEMA}.{table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    return f"{sql} RETURNING {returning}" if returning else sql
+
+@lru_cache(maxsize=256)
+def sql_update(table: str, columns: Tuple[str, ...], where: Tuple[str, ...], returning: str = '', touch: bool = False) -> str:
+    assignments = [f"{column} = %s" for column in columns]
+    if touch:
+        assignments.append("updated_at = CURRENT_TIMESTAMP")
+    sql = f"UPDATE {SCHEMA}.{table} SET {', '.join(assignments)} WHERE {' AND '.join(f'{column} = %s' for column in where)}"
+    return f"{sql} RETURNING {returning}" if returning else sql
+
+def sql_params(*values: Any) -> Tuple[Any, ...]:
+    # Словари и списки уходят в jsonb
+    return tuple(Json(value) if isinstance(value, (dict, list)) else value for value in values)
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', '60'))
+# Запас на транзакции, которые закоммитили отзыв позже, чем поставили revoked_at
+REVOCATION_SYNC_OVERLAP = float(os.environ.get('REVOCATION_SYNC_OVERLAP', '300'))
+SIGNED_TOKEN_PREFIX = 's1.'
+# user_id, family_id, member_id, выдан (мс), истекает (с), nonce
+_SIGNED_PAYLOAD = struct.Struct('>16s16s16sQI8s')
+
+_revocation_lock = threading.Lock()
+_revocation_state = {'revoked_since': 0.0, 'synced_at': 0.0}
+_revoked_nonces: Dict[str, float] = {}
+_revoked_users: Dict[str, float] = {}
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def decode_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload_b64, signature_b64 = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    
+    expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature) or len(payload) != _SIGNED_PAYLOAD.size:
         return None
     
+    user_id, family_id, member_id, issued_at, expires_at, nonce = _SIGNED_PAYLOAD.unpack(payload)
+    if expires_at <= time.time():
+        return None
+    
+    return {
+        'user_id': str(uuid.UUID(bytes=user_id)),
+        'family_id': str(uuid.UUID(bytes=family_id)) if any(family_id) else None,
+        'member_id': str(uuid.UUID(bytes=member_id)) if any(member_id) else None,
+        'issued_at': issued_at / 1000,
+        'expires_at': expires_at,
+        'nonce': nonce.hex()
+    }
+
+def _refresh_revocations() -> None:
+    now = time.time()
+    with _revocation_lock:
+        if now - _revocation_state['synced_at'] < REVOCATION_REFRESH_INTERVAL:
+            return
+        _revocation_state['synced_at'] = now
+        since = _revocation_state['revoked_since']
+    
+    # id из последовательности выдаётся до коммита, поэтому новые отзывы ищутся по времени
+    # с перекрытием: запись, закоммиченная позже чужой, всё равно попадёт в следующую выборку
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
-    
     try:
-        query = f"""
-            SELECT s.user_id, fm.family_id, fm.id as member_id
-            FROM {SCHEMA}.sessions s
-            JOIN {SCHEMA}.family_members fm ON fm.user_id = s.user_id
-            WHERE s.token = {escape_string(token)} 
-            AND s.expires_at > CURRENT_TIMESTAMP
-            LIMIT 1
-        """
-        cur.execute(query)
-        result = cur.fetchone()
-        
-        if result:
-            return {
-                'user_id': result['user_id'],
-                'family_id': result['family_id'],
-                'member_id': result['member_id']
-            }
-        return None
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp()) AS synced_at")
+        synced_at = float(cur.fetchone()['synced_at'])
+        cur.execute(
+            f"""
+            SELECT user_id, token_nonce,
+                   EXTRACT(EPOCH FROM revoked_at) AS revoked_at,
+                   EXTRACT(EPOCH FROM expires_at) AS expires_at
+            FROM {SCHEMA}.revoked_tokens
+            WHERE revoked_at > to_timestamp(%s) - make_interval(secs => %s)
+            AND expires_at > CURRENT_TIMESTAMP
+            """,
+            (since, REVOCATION_SYNC_OVERLAP)
+        )
+        rows = cur.fetchall()
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+    
+    # Повторно прочитанные записи безвредны: nonce — ключ словаря, для пользователя берётся максимум
+    with _revocation_lock:
+        for row in rows:
+            if row['token_nonce']:
+                _revoked_nonces[row['token_nonce']] = float(row['expires_at'])
+            else:
+                user_id = str(row['user_id'])
+                _revoked_users[user_id] = max(_revoked_users.get(user_id, 0.0), float(row['revoked_at']))
+        _revocation_state['revoked_since'] = max(_revocation_state['revoked_since'], synced_at)
+        for nonce in [n for n, expires_at in _revoked_nonces.items() if expires_at <= now]:
+            del _revoked_nonces[nonce]
+
+def is_signed_token_revoked(claims: Dict[str, Any]) -> bool:
+    _refresh_revocations()
+    with _revocation_lock:
+        if claims['nonce'] in _revoked_nonces:
+            return True
+        return claims['issued_at'] < _revoked_users.get(claims['user_id'], 0.0)
 
-def get_family_data(family_id: int) -> Dict[str, Any]:
+def get_auth_context(token: str) -> Optional[Dict[str, Any]]:
+    if not token:
+        return None
+    
+    # Подписанный токен проверяется без обращения к sessions
+    claims = decode_signed_token(token)
+    if claims and claims['family_id'] and not is_signed_token_revoked(claims):
+        return {
+            'user_id': claims['user_id'],
+            'family_id': claims['family_id'],
+            'member_id': claims['member_id'],
+            'family_name': None,
+            'permissions': None
+        }
+    
+    found, cached = _token_cache_get(token)
+    if found:
+        return cached
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        data = {}
-        
-        # Члены семьи
-        cur.execute(f"""
+        execute_prepared(cur, 'auth_context', (token,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    auth = None
+    if row:
+        auth = {
+            'user_id': str(row['user_id']),
+            'family_id': str(row['family_id']) if row['family_id'] else None,
+            'member_id': str(row['member_id']) if row['member_id'] else None,
+            'family_name': row['family_name'],
+            'permissions': row['permissions'] or {}
+        }
+    
+    _token_cache_put(token, auth)
+    return auth
+
+FAMILY_DATA_WORKERS = int(os.environ.get('FAMILY_DATA_WORKERS', '4'))
+
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+# Курсор не уходит дальше now() - SYNC_CURSOR_LAG: строка из долгой транзакции может закоммититься
+# с меткой раньше уже отданной, поэтому последние секунды перечитываются при следующей синхронизации
+SYNC_CURSOR_LAG = float(os.environ.get('SYNC_CURSOR_LAG', '60'))
+FAMILY_DATA_SQL_JSON = os.environ.get('FAMILY_DATA_SQL_JSON', 'false').lower() == 'true'
+
+# Секции синхронизации: запрос, порядок полной выгрузки и колонка-курсор для инкрементальной.
+# Таблицы из V0006 хранят family_id и ссылки на членов семьи как INTEGER, а семьи и члены — UUID,
+# поэтому они сравниваются через ::text, как в sync_tombstones: несовпадение типов даёт пустую секцию, а не ошибку
+FAMILY_SECTIONS = {
+    # Члены семьи
+    'members': {
+        'query': f"""
             SELECT id, name, role, avatar, avatar_type, photo_url, 
                    points, level, workload, age, achievements, 
-                   food_preferences, responsibilities, mood_status
+                   food_preferences, responsibilities, mood_status, updated_at
             FROM {SCHEMA}.family_members 
-            WHERE family_id = {family_id}
-        """)
-        data['members'] = [dict(row) for row in cur.fetchall()]
-        
-        # Задачи
-        cur.execute(f"""
+            WHERE family_id = %(family_id)s
+        """,
+        'order': '',
+        'cursor': 'updated_at'
+    },
+    # Задачи
+    'tasks': {
+        'query': f"""
             SELECT id, title, assignee, completed, category, points, 
                    deadline, reminder_time, shopping_list, is_recurring,
-                   recurring_pattern, next_occurrence
+                   recurring_pattern, next_occurrence, updated_at
             FROM {SCHEMA}.tasks 
-            WHERE family_id = {family_id}
-            ORDER BY created_at DESC
-        """)
-        data['tasks'] = [dict(row) for row in cur.fetchall()]
-        
-        # Профили детей
-        cur.execute(f"""
+            WHERE family_id = %(family_id)s
+        """,
+        'order': 'ORDER BY created_at DESC',
+        'cursor': 'updated_at'
+    },
+    # Профили детей
+    'children_profiles': {
+        'query': f"""
             SELECT cp.*, fm.name as child_name, fm.avatar, fm.age
             FROM {SCHEMA}.children_profiles cp
-            JOIN {SCHEMA}.family_members fm ON cp.child_member_id = fm.id
-            WHERE cp.family_id = {family_id}
-        """)
-        data['children_profiles'] = [dict(row) for row in cur.fetchall()]
-        
-        # Результаты тестов
-        cur.execute(f"""
+            JOIN {SCHEMA}.family_members fm ON cp.child_member_id::text = fm.id::text
+            WHERE cp.family_id::text = %(family_id)s::text
+        """,
+        'order': '',
+        'cursor': 'cp.updated_at'
+    },
+    # Результаты тестов
+    'test_results': {
+        'query': f"""
             SELECT tr.*, fm.name as child_name
             FROM {SCHEMA}.test_results tr
-            JOIN {SCHEMA}.family_members fm ON tr.child_member_id = fm.id
-            WHERE fm.family_id = {family_id}
-            ORDER BY tr.date DESC
-        """)
-        data['test_results'] = [dict(row) for row in cur.fetchall()]
-        
-        # Календарные события
-        cur.execute(f"""
+            JOIN {SCHEMA}.family_members fm ON tr.child_member_id::text = fm.id::text
+            WHERE fm.family_id = %(family_id)s
+        """,
+        'order': 'ORDER BY tr.date DESC',
+        'cursor': 'tr.created_at'
+    },
+    # Календарные события
+    'calendar_events': {
+        'query': f"""
             SELECT * FROM {SCHEMA}.calendar_events 
-            WHERE family_id = {family_id}
-            ORDER BY date DESC
-            LIMIT 100
-        """)
-        data['calendar_events'] = [dict(row) for row in cur.fetchall()]
-        
-        # Семейные ценности
-        cur.execute(f"""
+            WHERE family_id::text = %(family_id)s::text
+        """,
+        'order': 'ORDER BY date DESC LIMIT 100',
+        'cursor': 'updated_at'
+    },
+    # Семейные ценности
+    'family_values': {
+        'query': f"""
             SELECT * FROM {SCHEMA}.family_values 
-            WHERE family_id = {family_id}
-        """)
-        data['family_values'] = [dict(row) for row in cur.fetchall()]
-        
-        # Традиции
-        cur.execute(f"""
+            WHERE family_id::text = %(family_id)s::text
+        """,
+        'order': '',
+        'cursor': 'updated_at'
+    },
+    # Традиции
+    'traditions': {
+        'query': f"""
             SELECT * FROM {SCHEMA}.traditions 
-            WHERE family_id = {family_id}
-        """)
-        data['traditions'] = [dict(row) for row in cur.fetchall()]
-        
-        # Блог
-        cur.execute(f"""
+            WHERE family_id::text = %(family_id)s::text
+        """,
+        'order': '',
+        'cursor': 'updated_at'
+    },
+    # Блог
+    'blog_posts': {
+        'query': f"""
             SELECT bp.*, fm.name as author_name
             FROM {SCHEMA}.blog_posts bp
-            LEFT JOIN {SCHEMA}.family_members fm ON bp.author_id = fm.id
-            WHERE bp.family_id = {family_id}
-            ORDER BY bp.created_at DESC
-            LIMIT 50
-        """)
-        data['blog_posts'] = [dict(row) for row in cur.fetchall()]
-        
-        # Альбом
-        cur.execute(f"""
+            LEFT JOIN {SCHEMA}.family_members fm ON bp.author_id::text = fm.id::text
+            WHERE bp.family_id::text = %(family_id)s::text
+        """,
+        'order': 'ORDER BY bp.created_at DESC LIMIT 50',
+        'cursor': 'bp.updated_at'
+    },
+    # Альбом
+    'family_album': {
+        'query': f"""
             SELECT fa.*, fm.name as uploaded_by_name
             FROM {SCHEMA}.family_album fa
-            LEFT JOIN {SCHEMA}.family_members fm ON fa.uploaded_by = fm.id
-            WHERE fa.family_id = {family_id}
-            ORDER BY fa.created_at DESC
-            LIMIT 100
-        """)
-        data['family_album'] = [dict(row) for row in cur.fetchall()]
-        
-        # Генеалогическое древо
-        cur.execute(f"""
+            LEFT JOIN {SCHEMA}.family_members fm ON fa.uploaded_by::text = fm.id::text
+            WHERE fa.family_id::text = %(family_id)s::text
+        """,
+        'order': 'ORDER BY fa.created_at DESC LIMIT 100',
+        'cursor': 'fa.updated_at'
+    },
+    # Генеалогическое древо
+    'family_tree': {
+        'query': f"""
             SELECT * FROM {SCHEMA}.family_tree 
-            WHERE family_id = {family_id}
-        """)
-        data['family_tree'] = [dict(row) for row in cur.fetchall()]
-        
-        # Чат (последние 100 сообщений)
-        cur.execute(f"""
+            WHERE family_id::text = %(family_id)s::text
+        """,
+        'order': '',
+        'cursor': 'updated_at'
+    },
+    # Чат (последние 100 сообщений)
+    'chat_messages': {
+        'query': f"""
             SELECT cm.*, fm.name as sender_name, fm.avatar as sender_avatar
             FROM {SCHEMA}.chat_messages cm
-            LEFT JOIN {SCHEMA}.family_members fm ON cm.sender_id = fm.id
-            WHERE cm.family_id = {family_id}
-            ORDER BY cm.created_at DESC
-            LIMIT 100
-        """)
-        data['chat_messages'] = [dict(row) for row in cur.fetchall()]
+            LEFT JOIN {SCHEMA}.family_members fm ON cm.sender_id::text = fm.id::text
+            WHERE cm.family_id::text = %(family_id)s::text
+        """,
+        'order': 'ORDER BY cm.created_at DESC LIMIT 100',
+        'cursor': 'cm.updated_at'
+    },
+}
+
+# Пул потоков переживает тёплые вызовы, как и пул соединений
+_section_executor = ThreadPoolExecutor(max_workers=FAMILY_DATA_WORKERS)
+
+def parse_sync_cursor(value: str) -> Tuple[str, str]:
+    # Курсор — "метка|id": строки одной транзакции делят метку, id разводит их на границе страницы.
+    # Старый курсор без id означает начало метки
+    stamp, _, row_id = value.partition('|')
+    datetime.fromisoformat(stamp)
+    return stamp, row_id
+
+def load_section(name: str, family_id: Any, since: Optional[str] = None, as_json: bool = False) -> Dict[str, Any]:
+    section = FAMILY_SECTIONS[name]
+    cursor_column = section['cursor']
+    cursor_key = cursor_column.split('.')[-1]
+    id_column = cursor_column.rpartition('.')[0] + '.id' if '.' in cursor_column else 'id'
+    since_stamp, since_id = parse_sync_cursor(since) if since is not None else (None, '')
+    params = {
+        'family_id': family_id, 'since': since_stamp, 'since_id': since_id,
+        'limit': SYNC_PAGE_SIZE, 'section': name
+    }
+    
+    if since is None:
+        rows_query = section['query'] + section['order']
+    else:
+        # Только изменённые строки, по возрастанию ключа (метка, id), страницами
+        rows_query = section['query'] + f"""
+            AND ({cursor_column}, {id_column}::text) > (%(since)s::timestamp, %(since_id)s)
+            ORDER BY {cursor_column} ASC, {id_column}::text ASC
+            LIMIT %(limit)s
+        """
+    
+    started = time.perf_counter()
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cur.execute("SELECT clock_timestamp()::timestamp - make_interval(secs => %s) AS horizon", (SYNC_CURSOR_LAG,))
+        horizon = cur.fetchone()['horizon']
+        
+        if as_json:
+            # JSON-массив секции собирает Postgres, в Python приходит готовая строка
+            cur.execute(
+                f"""
+                SELECT COALESCE(json_agg(s), '[]')::text AS rows_json,
+                       COUNT(*) AS row_count, MAX(s.{cursor_key}) AS last_stamp,
+                       (array_agg(s.id::text ORDER BY s.{cursor_key} DESC, s.id::text DESC))[1] AS last_id
+                FROM ({rows_query}) s
+                """,
+                params
+            )
+            aggregate = cur.fetchone()
+            rows = aggregate['rows_json']
+            row_count = aggregate['row_count']
+            last_key = (aggregate['last_stamp'], aggregate['last_id']) if aggregate['last_stamp'] else None
+        else:
+            cur.execute(rows_query, params)
+            rows = [dict(row) for row in cur.fetchall()]
+            row_count = len(rows)
+            keys = [(row[cursor_key], str(row['id'])) for row in rows if row.get(cursor_key)]
+            last_key = max(keys) if keys else None
         
-        return data
+        has_more = since is not None and row_count >= SYNC_PAGE_SIZE
+        deleted = []
+        if since is not None:
+            # Пока строки не догружены, удаления отдаются только до последней отданной метки,
+            # иначе курсор перепрыгнул бы через ещё не отправленные строки
+            cur.execute(
+                f"""
+                SELECT row_id, deleted_at FROM {SCHEMA}.sync_tombstones
+                WHERE family_id = %(family_id)s::text AND section = %(section)s
+                AND deleted_at > %(since)s::timestamp
+                AND (%(until)s::timestamp IS NULL OR deleted_at <= %(until)s::timestamp)
+                ORDER BY deleted_at ASC
+                """,
+                dict(params, until=last_key[0] if has_more and last_key else None)
+            )
+            deleted = cur.fetchall()
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+    
+    if not has_more and deleted:
+        tombstone_key = (max(item['deleted_at'] for item in deleted), '')
+        last_key = max(last_key, tombstone_key) if last_key else tombstone_key
+    if not has_more and last_key and last_key[0] > horizon:
+        last_key = (horizon, '')
+    cursor = f'{last_key[0].isoformat()}|{last_key[1]}' if last_key else since
+    
+    return {
+        'rows': rows,
+        'deleted': [item['row_id'] for item in deleted],
+        'cursor': cursor,
+        'has_more': has_more,
+        'duration': (time.perf_counter() - started) * 1000
+    }
+
+def get_family_data(
+    family_id: Any,
+    sections: Optional[List[str]] = None,
+    since: Optional[Dict[str, str]] = None,
+    as_json: bool = False
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """При as_json секции в result['data'] — готовые JSON-строки из Postgres, см. encode_family_data."""
+    since = since or {}
+    futures = {
+        name: _section_executor.submit(load_section, name, family_id, since.get(name), as_json)
+        for name in (sections or FAMILY_SECTIONS)
+    }
+    
+    result = {'data': {}, 'deleted': {}, 'cursors': {}, 'has_more': {}}
+    timings = {}
+    for name, future in futures.items():
+        section = future.result()
+        result['data'][name] = section['rows']
+        result['cursors'][name] = section['cursor']
+        if name in since:
+            result['deleted'][name] = section['deleted']
+            result['has_more'][name] = section['has_more']
+        timings[name] = section['duration']
+    
+    return result, timings
+
+def encode_family_data(result: Dict[str, Any]) -> str:
+    # Склеиваем готовые фрагменты секций без разбора в Python-объекты
+    data = ','.join(f'{dumps_json(name)}:{fragment}' for name, fragment in result['data'].items())
+    meta = dumps_json({'success': True, **{key: value for key, value in result.items() if key != 'data'}})
+    return f'{meta[:-1]},"data":{{{data}}}}}'
+
+def parse_sync_params(params: Dict[str, str]) -> Tuple[Optional[List[str]], Dict[str, str]]:
+    sections = None
+    if params.get('sections'):
+        sections = [name.strip() for name in params['sections'].split(',') if name.strip()]
+        unknown = [name for name in sections if name not in FAMILY_SECTIONS]
+        if unknown:
+            raise ValueError(f"Неизвестные секции: {', '.join(unknown)}")
+    
+    since = {}
+    for name in (sections or FAMILY_SECTIONS):
+        value = params.get(f'since_{name}')
+        if value:
+            parse_sync_cursor(value)
+            since[name] = value
+    
+    return sections, since
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    return ', '.join(f'{name};dur={duration:.1f}' for name, duration in timings.items())
+
+# Запись и рост data_version — одна команда: ETag не может отстать от данных
+BUMP_FAMILY_VERSION_CTE = f"""
+    bumped AS (
+        UPDATE {SCHEMA}.families SET data_version = data_version + 1 WHERE id = %s
+    )
+"""
+
+def get_family_version(family_id: str) -> int:
+    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(f"SELECT data_version FROM {SCHEMA}.families WHERE id = %s", (family_id,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    return row[0] if row else 0
+
+def make_etag(version: int, params: Dict[str, Any]) -> str:
+    # Версия семьи плюс отпечаток параметров запроса: разные выборки — разные ETag
+    variant = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+    return f'W/"{version}-{variant}"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    all_headers = event.get('headers') or {}
+    value = all_headers.get('If-None-Match', '') or all_headers.get('if-none-match', '')
+    if value.strip() == '*':
+        return True
+    candidates = [item.strip().removeprefix('W/') for item in value.split(',')]
+    return etag.removeprefix('W/') in candidates
 
 def save_test_result(family_id: int, child_member_id: int, test_data: Dict[str, Any]) -> Dict[str, Any]:
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        query = f"""
-            INSERT INTO {SCHEMA}.test_results 
-            (child_member_id, test_type, scores, total_score, max_score, time_spent, answers)
-            VALUES (
-                {escape_string(child_member_id)},
-                {escape_string(test_data.get('testType'))},
-                {escape_string(test_data.get('scores'))},
-                {escape_string(test_data.get('totalScore'))},
-                {escape_string(test_data.get('maxScore'))},
-                {escape_string(test_data.get('timeSpent'))},
-                {escape_string(test_data.get('answers'))}
-            )
-            RETURNING id
-        """
-        cur.execute(query)
+        insert_sql = sql_insert('test_results', (
+            'child_member_id', 'test_type', 'scores', 'total_score', 'max_score', 'time_spent', 'answers'
+        ), 'id')
+        cur.execute(
+            f"WITH inserted AS ({insert_sql}), {BUMP_FAMILY_VERSION_CTE} SELECT id FROM inserted",
+            sql_params(
+                child_member_id,
+                test_data.get('testType'),
+                test_data.get('scores'),
+                test_data.get('totalScore'),
+                test_data.get('maxScore'),
+                test_data.get('timeSpent'),
+                test_data.get('answers')
+            ) + (family_id,)
+        )
         result = cur.fetchone()
         
         return {'success': True, 'id': result['id']}
@@ -203,7 +672,58 @@ def save_test_result(family_id: int, child_member_id: int, test_data: Dict[str,
         return {'success': False, 'error': str(e)}
     finally:
         cur.close()
-        conn.close()
+        release_db_connection(conn)
+
+# Сериализация ответов: orjson, если установлен, иначе json с заранее подготовленными обработчиками типов
+JSON_COMPRESS_MIN_SIZE = int(os.environ.get('JSON_COMPRESS_MIN_SIZE', '8192'))
+
+def _encode_bytes(value: Any) -> str:
+    return base64.b64encode(bytes(value)).decode('ascii')
+
+# Форматы совпадают с прежним default=str, чтобы клиенты не заметили разницы
+_JSON_TYPE_HANDLERS = {
+    datetime: str,
+    date: str,
+    uuid.UUID: str,
+    Decimal: str,
+    memoryview: _encode_bytes,
+    bytes: _encode_bytes,
+}
+
+def _json_default(value: Any) -> Any:
+    handler = _JSON_TYPE_HANDLERS.get(type(value))
+    return handler(value) if handler else str(value)
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+    return _json_encoder.encode(payload)
+
+def json_response(event: Dict[str, Any], status_code: int, payload: Any, headers: Dict[str, str]) -> Dict[str, Any]:
+    return encoded_response(event, status_code, dumps_json(payload), headers)
+
+def encoded_response(event: Dict[str, Any], status_code: int, body: str, headers: Dict[str, str]) -> Dict[str, Any]:
+    # Большие тела сжимаются br или gzip, если клиент их принимает
+    if len(body) < JSON_COMPRESS_MIN_SIZE:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    
+    all_headers = event.get('headers') or {}
+    accepted = (all_headers.get('Accept-Encoding', '') or all_headers.get('accept-encoding', '')).lower()
+    if brotli is not None and 'br' in accepted:
+        encoding, compressed = 'br', brotli.compress(body.encode('utf-8'), quality=5)
+    elif 'gzip' in accepted:
+        encoding, compressed = 'gzip', gzip.compress(body.encode('utf-8'), compresslevel=5)
+    else:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    
+    return {
+        'statusCode': status_code,
+        'headers': {**headers, 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
@@ -214,7 +734,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -223,7 +743,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     headers = {
         'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*'
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag'
     }
     
     try:
@@ -234,29 +755,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 401,
                 'headers': headers,
-                'body': json.dumps({'error': 'Требуется авторизация'}),
+                'body': dumps_json({'error': 'Требуется авторизация'}),
                 'isBase64Encoded': False
             }
         
-        user_data = verify_token(token)
-        if not user_data:
+        user_data = get_auth_context(token)
+        if not user_data or not user_data['family_id']:
             return {
                 'statusCode': 401,
                 'headers': headers,
-                'body': json.dumps({'error': 'Недействительный токен'}),
+                'body': dumps_json({'error': 'Недействительный токен'}),
                 'isBase64Encoded': False
             }
         
         family_id = user_data['family_id']
         
         if method == 'GET':
-            data = get_family_data(family_id)
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({'success': True, 'data': data}),
-                'isBase64Encoded': False
-            }
+            params = event.get('queryStringParameters') or {}
+            try:
+                sections, since = parse_sync_params(params)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': dumps_json({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
+            
+            etag = make_etag(get_family_version(family_id), params)
+            if etag_matches(event, etag):
+                return {
+                    'statusCode': 304,
+                    'headers': {**headers, 'ETag': etag},
+                    'body': '',
+                    'isBase64Encoded': False
+                }
+            
+            as_json = FAMILY_DATA_SQL_JSON or params.get('encoding') == 'sql'
+            result, timings = get_family_data(family_id, sections, since, as_json)
+            body = encode_family_data(result) if as_json else dumps_json({'success': True, **result})
+            return encoded_response(event, 200, body, {
+                **headers,
+                'ETag': etag,
+                'Server-Timing': format_server_timing(timings),
+                'Timing-Allow-Origin': '*'
+            })
         
         elif method == 'POST':
             raw_body = event.get('body') or '{}'
@@ -272,7 +815,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     return {
                         'statusCode': 400,
                         'headers': headers,
-                        'body': json.dumps({'error': 'Не указаны данные теста'}),
+                        'body': dumps_json({'error': 'Не указаны данные теста'}),
                         'isBase64Encoded': False
                     }
                 
@@ -282,28 +825,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     return {
                         'statusCode': 200,
                         'headers': headers,
-                        'body': json.dumps(result),
+                        'body': dumps_json(result),
                         'isBase64Encoded': False
                     }
                 else:
                     return {
                         'statusCode': 500,
                         'headers': headers,
-                        'body': json.dumps(result),
+                        'body': dumps_json(result),
                         'isBase64Encoded': False
                     }
             
             return {
                 'statusCode': 400,
                 'headers': headers,
-                'body': json.dumps({'error': 'Неизвестное действие'}),
+                'body': dumps_json({'error': 'Неизвестное действие'}),
                 'isBase64Encoded': False
             }
         
         return {
             'statusCode': 405,
             'headers': headers,
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
+            'body': dumps_json({'error': 'Метод не поддерживается'}),
             'isBase64Encoded': False
         }
     
@@ -6,12 +6,30 @@ Returns: JSON с URL оплаты или статусом подписки
 
 import json
 import os
+import hashlib
+import hmac
+import struct
+import threading
+import weakref
+import time
+import re
 import uuid
 import base64
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+import gzip
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
 import psycopg2
 from psycopg2.extras import RealDictCursor
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 from urllib.request import urlopen, Request
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -25,42 +43,283 @@ PLANS = {
     'premium': {'name': 'Премиум', 'price': 2499, 'months': 12}
 }
 
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+# Пул соединений живёт между тёплыми вызовами функции
+_pool_lock = threading.Lock()
+_idle_connections: List[Tuple[Any, float]] = []
+
+def _discard_connection(conn) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_connection_alive(conn, idle_for: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
+    now = time.monotonic()
+    with _pool_lock:
+        stale = [c for c, released_at in _idle_connections if now - released_at >= DB_POOL_IDLE_TIMEOUT]
+        _idle_connections[:] = [item for item in _idle_connections if item[0] not in stale]
+    for conn in stale:
+        _discard_connection(conn)
+    
+    while True:
+        with _pool_lock:
+            if not _idle_connections:
+                break
+            conn, released_at = _idle_connections.pop()
+        if _is_connection_alive(conn, now - released_at):
+            return conn
+        _discard_connection(conn)
+    
     return psycopg2.connect(DATABASE_URL)
 
-def verify_token(token: str) -> Optional[str]:
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard_connection(conn)
+        return
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_MAX_SIZE:
+            _idle_connections.append((conn, time.monotonic()))
+            return
+    _discard_connection(conn)
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+
+# Имена подготовленных на каждом соединении запросов; запись пропадает вместе с соединением
+_prepared_on_connection = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name: str, params: Tuple = ()) -> None:
+    """Выполняет запрос из PREPARED_STATEMENTS по имени; PREPARE делается один раз на соединение."""
+    sql = PREPARED_STATEMENTS[name]
+    if not PREPARED_STATEMENTS_ENABLED:
+        # Для пулеров в режиме транзакций: тот же текст, но обычным параметризованным запросом
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = _prepared_on_connection.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {sql}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+# Горячие запросы модуля: имя -> SQL с позиционными параметрами $1, $2...
+PREPARED_STATEMENTS = {
+    # Сессия, семья, член семьи и его права одним запросом
+    'auth_context': f"""
+        SELECT s.user_id, fm.family_id, fm.id AS member_id, fm.permissions,
+               f.name AS family_name
+        FROM {SCHEMA}.sessions s
+        LEFT JOIN {SCHEMA}.family_members fm
+            ON fm.user_id = s.user_id AND fm.family_id IS NOT NULL
+        LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+        WHERE s.token = $1 AND s.expires_at > CURRENT_TIMESTAMP
+        LIMIT 1
+    """,
+}
+
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', '5'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '1024'))
+
+# Кэш сессий: token -> (истекает, данные); None кэшируется для неизвестных токенов
+_token_cache: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+def _token_cache_get(token: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    now = time.monotonic()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _token_cache[token]
+            _token_cache_stats['misses'] += 1
+            return False, None
+        _token_cache.move_to_end(token)
+        _token_cache_stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+        return True, entry[1]
+
+def _token_cache_put(token: str, value: Optional[Dict[str, Any]]) -> None:
+    ttl = TOKEN_CACHE_TTL if value is not None else TOKEN_CACHE_NEGATIVE_TTL
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + ttl, value)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
+def invalidate_token_cache(token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    with _token_cache_lock:
+        if token is not None:
+            _token_cache.pop(token, None)
+        if user_id is not None:
+            stale = [key for key, (_, value) in _token_cache.items() if value and value.get('user_id') == user_id]
+            for key in stale:
+                del _token_cache[key]
+
+def get_token_cache_stats() -> Dict[str, int]:
+    with _token_cache_lock:
+        return dict(_token_cache_stats, size=len(_token_cache))
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', '60'))
+# Запас на транзакции, которые закоммитили отзыв позже, чем поставили revoked_at
+REVOCATION_SYNC_OVERLAP = float(os.environ.get('REVOCATION_SYNC_OVERLAP', '300'))
+SIGNED_TOKEN_PREFIX = 's1.'
+# user_id, family_id, member_id, выдан (мс), истекает (с), nonce
+_SIGNED_PAYLOAD = struct.Struct('>16s16s16sQI8s')
+
+_revocation_lock = threading.Lock()
+_revocation_state = {'revoked_since': 0.0, 'synced_at': 0.0}
+_revoked_nonces: Dict[str, float] = {}
+_revoked_users: Dict[str, float] = {}
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def decode_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload_b64, signature_b64 = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    
+    expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature) or len(payload) != _SIGNED_PAYLOAD.size:
+        return None
+    
+    user_id, family_id, member_id, issued_at, expires_at, nonce = _SIGNED_PAYLOAD.unpack(payload)
+    if expires_at <= time.time():
+        return None
+    
+    return {
+        'user_id': str(uuid.UUID(bytes=user_id)),
+        'family_id': str(uuid.UUID(bytes=family_id)) if any(family_id) else None,
+        'member_id': str(uuid.UUID(bytes=member_id)) if any(member_id) else None,
+        'issued_at': issued_at / 1000,
+        'expires_at': expires_at,
+        'nonce': nonce.hex()
+    }
+
+def _refresh_revocations() -> None:
+    now = time.time()
+    with _revocation_lock:
+        if now - _revocation_state['synced_at'] < REVOCATION_REFRESH_INTERVAL:
+            return
+        _revocation_state['synced_at'] = now
+        since = _revocation_state['revoked_since']
+    
+    # id из последовательности выдаётся до коммита, поэтому новые отзывы ищутся по времени
+    # с перекрытием: запись, закоммиченная позже чужой, всё равно попадёт в следующую выборку
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp()) AS synced_at")
+        synced_at = float(cur.fetchone()['synced_at'])
+        cur.execute(
+            f"""
+            SELECT user_id, token_nonce,
+                   EXTRACT(EPOCH FROM revoked_at) AS revoked_at,
+                   EXTRACT(EPOCH FROM expires_at) AS expires_at
+            FROM {SCHEMA}.revoked_tokens
+            WHERE revoked_at > to_timestamp(%s) - make_interval(secs => %s)
+            AND expires_at > CURRENT_TIMESTAMP
+            """,
+            (since, REVOCATION_SYNC_OVERLAP)
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    cur.execute(
-        f"""
-        SELECT user_id FROM {SCHEMA}.sessions 
-        WHERE token = %s AND expires_at > CURRENT_TIMESTAMP
-        """,
-        (token,)
-    )
-    session = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    return str(session['user_id']) if session else None
+    # Повторно прочитанные записи безвредны: nonce — ключ словаря, для пользователя берётся максимум
+    with _revocation_lock:
+        for row in rows:
+            if row['token_nonce']:
+                _revoked_nonces[row['token_nonce']] = float(row['expires_at'])
+            else:
+                user_id = str(row['user_id'])
+                _revoked_users[user_id] = max(_revoked_users.get(user_id, 0.0), float(row['revoked_at']))
+        _revocation_state['revoked_since'] = max(_revocation_state['revoked_since'], synced_at)
+        for nonce in [n for n, expires_at in _revoked_nonces.items() if expires_at <= now]:
+            del _revoked_nonces[nonce]
+
+def is_signed_token_revoked(claims: Dict[str, Any]) -> bool:
+    _refresh_revocations()
+    with _revocation_lock:
+        if claims['nonce'] in _revoked_nonces:
+            return True
+        return claims['issued_at'] < _revoked_users.get(claims['user_id'], 0.0)
 
-def get_user_family_id(user_id: str) -> Optional[str]:
+def get_auth_context(token: str) -> Optional[Dict[str, Any]]:
+    if not token:
+        return None
+    
+    # Подписанный токен проверяется без обращения к sessions
+    claims = decode_signed_token(token)
+    if claims and claims['family_id'] and not is_signed_token_revoked(claims):
+        return {
+            'user_id': claims['user_id'],
+            'family_id': claims['family_id'],
+            'member_id': claims['member_id'],
+            'family_name': None,
+            'permissions': None
+        }
+    
+    found, cached = _token_cache_get(token)
+    if found:
+        return cached
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(
-        f"""
-        SELECT family_id FROM {SCHEMA}.family_members 
-        WHERE user_id = %s LIMIT 1
-        """,
-        (user_id,)
-    )
-    member = cur.fetchone()
-    cur.close()
-    conn.close()
+    try:
+        execute_prepared(cur, 'auth_context', (token,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    auth = None
+    if row:
+        auth = {
+            'user_id': str(row['user_id']),
+            'family_id': str(row['family_id']) if row['family_id'] else None,
+            'member_id': str(row['member_id']) if row['member_id'] else None,
+            'family_name': row['family_name'],
+            'permissions': row['permissions'] or {}
+        }
     
-    return str(member['family_id']) if member else None
+    _token_cache_put(token, auth)
+    return auth
 
 def create_yookassa_payment(amount: float, description: str, return_url: str) -> Dict[str, Any]:
     idempotence_key = str(uuid.uuid4())
@@ -155,7 +414,7 @@ def create_subscription(family_id: str, user_id: str, plan_type: str, return_url
         
         conn.commit()
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         
         return {
             'success': True,
@@ -167,26 +426,27 @@ def create_subscription(family_id: str, user_id: str, plan_type: str, return_url
     except Exception as e:
         conn.rollback()
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         return {'error': str(e)}
 
 def get_subscription_status(family_id: str) -> Dict[str, Any]:
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(
-        f"""
-        SELECT id, plan_type, status, amount, start_date, end_date, auto_renew
-        FROM {SCHEMA}.subscriptions
-        WHERE family_id = %s AND status = 'active'
-        ORDER BY end_date DESC LIMIT 1
-        """,
-        (family_id,)
-    )
-    subscription = cur.fetchone()
-    
-    cur.close()
-    conn.close()
+    try:
+        cur.execute(
+            f"""
+            SELECT id, plan_type, status, amount, start_date, end_date, auto_renew
+            FROM {SCHEMA}.subscriptions
+            WHERE family_id = %s AND status = 'active'
+            ORDER BY end_date DESC LIMIT 1
+            """,
+            (family_id,)
+        )
+        subscription = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
     if not subscription:
         return {
@@ -202,6 +462,57 @@ def get_subscription_status(family_id: str) -> Dict[str, Any]:
         'auto_renew': subscription['auto_renew']
     }
 
+# Сериализация ответов: orjson, если установлен, иначе json с заранее подготовленными обработчиками типов
+JSON_COMPRESS_MIN_SIZE = int(os.environ.get('JSON_COMPRESS_MIN_SIZE', '8192'))
+
+def _encode_bytes(value: Any) -> str:
+    return base64.b64encode(bytes(value)).decode('ascii')
+
+# Форматы совпадают с прежним default=str, чтобы клиенты не заметили разницы
+_JSON_TYPE_HANDLERS = {
+    datetime: str,
+    date: str,
+    uuid.UUID: str,
+    Decimal: str,
+    memoryview: _encode_bytes,
+    bytes: _encode_bytes,
+}
+
+def _json_default(value: Any) -> Any:
+    handler = _JSON_TYPE_HANDLERS.get(type(value))
+    return handler(value) if handler else str(value)
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+    return _json_encoder.encode(payload)
+
+def json_response(event: Dict[str, Any], status_code: int, payload: Any, headers: Dict[str, str]) -> Dict[str, Any]:
+    return encoded_response(event, status_code, dumps_json(payload), headers)
+
+def encoded_response(event: Dict[str, Any], status_code: int, body: str, headers: Dict[str, str]) -> Dict[str, Any]:
+    # Большие тела сжимаются br или gzip, если клиент их принимает
+    if len(body) < JSON_COMPRESS_MIN_SIZE:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    
+    all_headers = event.get('headers') or {}
+    accepted = (all_headers.get('Accept-Encoding', '') or all_headers.get('accept-encoding', '')).lower()
+    if brotli is not None and 'br' in accepted:
+        encoding, compressed = 'br', brotli.compress(body.encode('utf-8'), quality=5)
+    elif 'gzip' in accepted:
+        encoding, compressed = 'gzip', gzip.compress(body.encode('utf-8'), compresslevel=5)
+    else:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    
+    return {
+        'statusCode': status_code,
+        'headers': {**headers, 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -224,21 +535,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         token = event.get('headers', {}).get('X-Auth-Token', '')
-        user_id = verify_token(token)
+        auth = get_auth_context(token)
         
-        if not user_id:
+        if not auth:
             return {
                 'statusCode': 401,
                 'headers': headers,
-                'body': json.dumps({'error': 'Требуется авторизация'})
+                'body': dumps_json({'error': 'Требуется авторизация'})
             }
         
-        family_id = get_user_family_id(user_id)
+        family_id = auth['family_id']
         if not family_id:
             return {
                 'statusCode': 403,
                 'headers': headers,
-                'body': json.dumps({'error': 'Пользователь не состоит в семье'})
+                'body': dumps_json({'error': 'Пользователь не состоит в семье'})
             }
         
         if method == 'GET':
@@ -246,7 +557,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps(result, default=str)
+                'body': dumps_json(result)
             }
         
         elif method == 'POST':
@@ -257,30 +568,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 plan_type = body.get('plan_type', 'basic')
                 return_url = body.get('return_url', 'https://example.com')
                 
-                result = create_subscription(family_id, user_id, plan_type, return_url)
+                result = create_subscription(family_id, auth['user_id'], plan_type, return_url)
                 
                 if 'error' in result:
                     return {
                         'statusCode': 400,
                         'headers': headers,
-                        'body': json.dumps(result)
+                        'body': dumps_json(result)
                     }
                 
                 return {
                     'statusCode': 201,
                     'headers': headers,
-                    'body': json.dumps(result)
+                    'body': dumps_json(result)
                 }
         
         return {
             'statusCode': 405,
             'headers': headers,
-            'body': json.dumps({'error': 'Метод не поддерживается'})
+            'body': dumps_json({'error': 'Метод не поддерживается'})
         }
     
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': headers,
-            'body': json.dumps({'error': str(e)})
+            'body': dumps_json({'error': str(e)})
         }
@@ -6,161 +6,738 @@ Returns: JSON со списком задач или результатом оп
 
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+import base64
+import hashlib
+import hmac
+import struct
+import uuid
+import threading
+import weakref
+import time
+import calendar
+import re
+import gzip
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+from collections import OrderedDict
+from functools import lru_cache
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values, Json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = 't_p5815085_family_assistant_pro'
 
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+# Пул соединений живёт между тёплыми вызовами функции
+_pool_lock = threading.Lock()
+_idle_connections: List[Tuple[Any, float]] = []
+
+def _discard_connection(conn) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_connection_alive(conn, idle_for: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
+    now = time.monotonic()
+    with _pool_lock:
+        stale = [c for c, released_at in _idle_connections if now - released_at >= DB_POOL_IDLE_TIMEOUT]
+        _idle_connections[:] = [item for item in _idle_connections if item[0] not in stale]
+    for conn in stale:
+        _discard_connection(conn)
+    
+    while True:
+        with _pool_lock:
+            if not _idle_connections:
+                break
+            conn, released_at = _idle_connections.pop()
+        if _is_connection_alive(conn, now - released_at):
+            return conn
+        _discard_connection(conn)
+    
     return psycopg2.connect(DATABASE_URL)
 
-def verify_token(token: str) -> Optional[str]:
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard_connection(conn)
+        return
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_MAX_SIZE:
+            _idle_connections.append((conn, time.monotonic()))
+            return
+    _discard_connection(conn)
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+
+# Имена подготовленных на каждом соединении запросов; запись пропадает вместе с соединением
+_prepared_on_connection = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name: str, params: Tuple = ()) -> None:
+    """Выполняет запрос из PREPARED_STATEMENTS по имени; PREPARE делается один раз на соединение."""
+    sql = PREPARED_STATEMENTS[name]
+    if not PREPARED_STATEMENTS_ENABLED:
+        # Для пулеров в режиме транзакций: тот же текст, но обычным параметризованным запросом
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = _prepared_on_connection.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {sql}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+# Горячие запросы модуля: имя -> SQL с позиционными параметрами $1, $2...
+PREPARED_STATEMENTS = {
+    # Сессия, семья, член семьи и его права одним запросом
+    'auth_context': f"""
+        SELECT s.user_id, fm.family_id, fm.id AS member_id, fm.permissions,
+               f.name AS family_name
+        FROM {SCHEMA}.sessions s
+        LEFT JOIN {SCHEMA}.family_members fm
+            ON fm.user_id = s.user_id AND fm.family_id IS NOT NULL
+        LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+        WHERE s.token = $1 AND s.expires_at > CURRENT_TIMESTAMP
+        LIMIT 1
+    """,
+    # Страница списка задач со всеми полями; пустые фильтры передаются как NULL
+    'tasks_page': f"""
+        SELECT t.id, t.family_id, t.title, t.description, t.assignee_id, t.completed,
+               t.points, t.priority, t.category, t.deadline, t.reminder_time, t.shopping_list,
+               t.is_recurring, t.recurring_frequency, t.recurring_interval, t.recurring_days_of_week,
+               t.recurring_end_date, t.recurring_pattern, t.next_occurrence, t.cooking_day,
+               t.created_at, t.updated_at, fm.name AS assignee_name
+        FROM {SCHEMA}.tasks t
+        LEFT JOIN {SCHEMA}.family_members fm ON t.assignee_id = fm.id
+        WHERE t.family_id = $1
+        AND ($2::boolean IS NULL OR t.completed = $2)
+        AND ($3::timestamp IS NULL OR (t.created_at, t.id) < ($3::timestamp, $4::uuid))
+        ORDER BY t.created_at DESC, t.id DESC
+        LIMIT $5
+    """,
+}
+
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', '5'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '1024'))
+
+# Кэш сессий: token -> (истекает, данные); None кэшируется для неизвестных токенов
+_token_cache: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+def _token_cache_get(token: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    now = time.monotonic()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _token_cache[token]
+            _token_cache_stats['misses'] += 1
+            return False, None
+        _token_cache.move_to_end(token)
+        _token_cache_stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+        return True, entry[1]
+
+def _token_cache_put(token: str, value: Optional[Dict[str, Any]]) -> None:
+    ttl = TOKEN_CACHE_TTL if value is not None else TOKEN_CACHE_NEGATIVE_TTL
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + ttl, value)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
+def invalidate_token_cache(token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    with _token_cache_lock:
+        if token is not None:
+            _token_cache.pop(token, None)
+        if user_id is not None:
+            stale = [key for key, (_, value) in _token_cache.items() if value and value.get('user_id') == user_id]
+            for key in stale:
+                del _token_cache[key]
+
+def get_token_cache_stats() -> Dict[str, int]:
+    with _token_cache_lock:
+        return dict(_token_cache_stats, size=len(_token_cache))
+
+# Построитель параметризованных запросов: текст SQL зависит только от таблицы и набора колонок,
+# поэтому запросы одной формы дают одинаковый текст и переиспользуют план
+@lru_cache(maxsize=256)
+def sql_insert(table: str, columns: Tuple[str, ...], returning: str = '') -> str:
+    sql = f"INSERT INTO {SCHEMA}.{table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    return f"{sql} RETURNING {returning}" if returning else sql
+
+@lru_cache(maxsize=256)
+def sql_update(table: str, columns: Tuple[str, ...], where: Tuple[str, ...], returning: str = '', touch: bool = False) -> str:
+    assignments = [f"{column} = %s" for column in columns]
+    if touch:
+        assignments.append("updated_at = CURRENT_TIMESTAMP")
+    sql = f"UPDATE {SCHEMA}.{table} SET {', '.join(assignments)} WHERE {' AND '.join(f'{column} = %s' for column in where)}"
+    return f"{sql} RETURNING {returning}" if returning else sql
+
+def sql_params(*values: Any) -> Tuple[Any, ...]:
+    # Словари и списки уходят в jsonb
+    return tuple(Json(value) if isinstance(value, (dict, list)) else value for value in values)
+
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', '60'))
+# Запас на транзакции, которые закоммитили отзыв позже, чем поставили revoked_at
+REVOCATION_SYNC_OVERLAP = float(os.environ.get('REVOCATION_SYNC_OVERLAP', '300'))
+SIGNED_TOKEN_PREFIX = 's1.'
+# user_id, family_id, member_id, выдан (мс), истекает (с), nonce
+_SIGNED_PAYLOAD = struct.Struct('>16s16s16sQI8s')
+
+_revocation_lock = threading.Lock()
+_revocation_state = {'revoked_since': 0.0, 'synced_at': 0.0}
+_revoked_nonces: Dict[str, float] = {}
+_revoked_users: Dict[str, float] = {}
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def decode_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload_b64, signature_b64 = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    
+    expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature) or len(payload) != _SIGNED_PAYLOAD.size:
+        return None
+    
+    user_id, family_id, member_id, issued_at, expires_at, nonce = _SIGNED_PAYLOAD.unpack(payload)
+    if expires_at <= time.time():
+        return None
+    
+    return {
+        'user_id': str(uuid.UUID(bytes=user_id)),
+        'family_id': str(uuid.UUID(bytes=family_id)) if any(family_id) else None,
+        'member_id': str(uuid.UUID(bytes=member_id)) if any(member_id) else None,
+        'issued_at': issued_at / 1000,
+        'expires_at': expires_at,
+        'nonce': nonce.hex()
+    }
+
+def _refresh_revocations() -> None:
+    now = time.time()
+    with _revocation_lock:
+        if now - _revocation_state['synced_at'] < REVOCATION_REFRESH_INTERVAL:
+            return
+        _revocation_state['synced_at'] = now
+        since = _revocation_state['revoked_since']
+    
+    # id из последовательности выдаётся до коммита, поэтому новые отзывы ищутся по времени
+    # с перекрытием: запись, закоммиченная позже чужой, всё равно попадёт в следующую выборку
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp()) AS synced_at")
+        synced_at = float(cur.fetchone()['synced_at'])
+        cur.execute(
+            f"""
+            SELECT user_id, token_nonce,
+                   EXTRACT(EPOCH FROM revoked_at) AS revoked_at,
+                   EXTRACT(EPOCH FROM expires_at) AS expires_at
+            FROM {SCHEMA}.revoked_tokens
+            WHERE revoked_at > to_timestamp(%s) - make_interval(secs => %s)
+            AND expires_at > CURRENT_TIMESTAMP
+            """,
+            (since, REVOCATION_SYNC_OVERLAP)
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    cur.execute(
-        f"""
-        SELECT user_id FROM {SCHEMA}.sessions 
-        WHERE token = %s AND expires_at > CURRENT_TIMESTAMP
-        """,
-        (token,)
-    )
-    session = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    return str(session['user_id']) if session else None
+    # Повторно прочитанные записи безвредны: nonce — ключ словаря, для пользователя берётся максимум
+    with _revocation_lock:
+        for row in rows:
+            if row['token_nonce']:
+                _revoked_nonces[row['token_nonce']] = float(row['expires_at'])
+            else:
+                user_id = str(row['user_id'])
+                _revoked_users[user_id] = max(_revoked_users.get(user_id, 0.0), float(row['revoked_at']))
+        _revocation_state['revoked_since'] = max(_revocation_state['revoked_since'], synced_at)
+        for nonce in [n for n, expires_at in _revoked_nonces.items() if expires_at <= now]:
+            del _revoked_nonces[nonce]
 
-def get_user_family_id(user_id: str) -> Optional[str]:
+def is_signed_token_revoked(claims: Dict[str, Any]) -> bool:
+    _refresh_revocations()
+    with _revocation_lock:
+        if claims['nonce'] in _revoked_nonces:
+            return True
+        return claims['issued_at'] < _revoked_users.get(claims['user_id'], 0.0)
+
+def get_auth_context(token: str) -> Optional[Dict[str, Any]]:
+    if not token:
+        return None
+    
+    # Подписанный токен проверяется без обращения к sessions
+    claims = decode_signed_token(token)
+    if claims and claims['family_id'] and not is_signed_token_revoked(claims):
+        return {
+            'user_id': claims['user_id'],
+            'family_id': claims['family_id'],
+            'member_id': claims['member_id'],
+            'family_name': None,
+            'permissions': None
+        }
+    
+    found, cached = _token_cache_get(token)
+    if found:
+        return cached
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
+    try:
+        execute_prepared(cur, 'auth_context', (token,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    auth = None
+    if row:
+        auth = {
+            'user_id': str(row['user_id']),
+            'family_id': str(row['family_id']) if row['family_id'] else None,
+            'member_id': str(row['member_id']) if row['member_id'] else None,
+            'family_name': row['family_name'],
+            'permissions': row['permissions'] or {}
+        }
+    
+    _token_cache_put(token, auth)
+    return auth
+
+def bump_family_version(cur, family_id: Any) -> None:
     cur.execute(
-        f"""
-        SELECT family_id FROM {SCHEMA}.family_members 
-        WHERE user_id = %s LIMIT 1
-        """,
-        (user_id,)
+        f"UPDATE {SCHEMA}.families SET data_version = data_version + 1 WHERE id = %s",
+        (family_id,)
     )
-    member = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    return str(member['family_id']) if member else None
 
-def get_tasks(family_id: str, completed: Optional[bool] = None) -> List[Dict[str, Any]]:
+def get_family_version(family_id: str) -> int:
     conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(f"SELECT data_version FROM {SCHEMA}.families WHERE id = %s", (family_id,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    return row[0] if row else 0
+
+def make_etag(version: int, params: Dict[str, Any]) -> str:
+    # Версия семьи плюс отпечаток параметров запроса: разные выборки — разные ETag
+    variant = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+    return f'W/"{version}-{variant}"'
+
+def etag_matches(event: Dict[str, Any], etag: str) -> bool:
+    all_headers = event.get('headers') or {}
+    value = all_headers.get('If-None-Match', '') or all_headers.get('if-none-match', '')
+    if value.strip() == '*':
+        return True
+    candidates = [item.strip().removeprefix('W/') for item in value.split(',')]
+    return etag.removeprefix('W/') in candidates
+
+TASKS_PAGE_SIZE = int(os.environ.get('TASKS_PAGE_SIZE', '100'))
+TASKS_PAGE_MAX = int(os.environ.get('TASKS_PAGE_MAX', '500'))
+
+# Колонки, которые клиент может запросить через fields=
+TASK_FIELDS = (
+    'id', 'family_id', 'title', 'description', 'assignee_id', 'assignee_name', 'completed',
+    'points', 'priority', 'category', 'deadline', 'reminder_time', 'shopping_list',
+    'is_recurring', 'recurring_frequency', 'recurring_interval', 'recurring_days_of_week',
+    'recurring_end_date', 'recurring_pattern', 'next_occurrence', 'cooking_day',
+    'created_at', 'updated_at'
+)
+
+def encode_task_cursor(task: Dict[str, Any]) -> str:
+    raw = f"{task['created_at'].isoformat()}|{task['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode('ascii').rstrip('=')
+
+def decode_task_cursor(cursor: str) -> Tuple[str, str]:
+    raw = _b64decode(cursor).decode()
+    created_at, task_id = raw.split('|')
+    datetime.fromisoformat(created_at)
+    return created_at, str(uuid.UUID(task_id))
+
+def parse_task_fields(value: Optional[str]) -> Optional[List[str]]:
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in TASK_FIELDS]
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(unknown)}")
+    # id и created_at нужны для курсора
+    return list(dict.fromkeys(['id', 'created_at'] + fields))
+
+def get_tasks(
+    family_id: str,
+    completed: Optional[bool] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    if not fields:
+        # Основной путь приложения — подготовленный запрос со всеми полями
+        created_at, task_id = decode_task_cursor(cursor) if cursor else (None, None)
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        try:
+            # LIMIT NULL в Postgres означает все строки
+            execute_prepared(cur, 'tasks_page', (family_id, completed, created_at, task_id, limit + 1 if limit else None))
+            tasks = [dict(task) for task in cur.fetchall()]
+        finally:
+            cur.close()
+            release_db_connection(conn)
+        return paginate_tasks(tasks, limit)
     
+    columns = ', '.join('fm.name AS assignee_name' if f == 'assignee_name' else f't.{f}' for f in fields)
     query = f"""
-        SELECT t.*, fm.name as assignee_name
+        SELECT {columns}
         FROM {SCHEMA}.tasks t
         LEFT JOIN {SCHEMA}.family_members fm ON t.assignee_id = fm.id
         WHERE t.family_id = %s
     """
-    params = [family_id]
+    params: List[Any] = [family_id]
     
     if completed is not None:
         query += " AND t.completed = %s"
         params.append(completed)
     
-    query += " ORDER BY t.created_at DESC"
+    if cursor:
+        query += " AND (t.created_at, t.id) < (%s::timestamp, %s::uuid)"
+        params.extend(decode_task_cursor(cursor))
+    
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    query += " ORDER BY t.created_at DESC, t.id DESC LIMIT %s"
+    params.append(limit + 1 if limit else None)
+    
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        cur.execute(query, tuple(params))
+        tasks = [dict(task) for task in cur.fetchall()]
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    cur.execute(query, tuple(params))
-    tasks = cur.fetchall()
-    cur.close()
-    conn.close()
+    return paginate_tasks(tasks, limit)
+
+def paginate_tasks(tasks: List[Dict[str, Any]], limit: Optional[int]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    next_cursor = None
+    if limit and len(tasks) > limit:
+        tasks = tasks[:limit]
+        next_cursor = encode_task_cursor(tasks[-1])
     
-    return [dict(task) for task in tasks]
+    return tasks, next_cursor
 
-def create_task(family_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+RECURRENCE_WINDOW_MAX_DAYS = int(os.environ.get('RECURRENCE_WINDOW_MAX_DAYS', '366'))
+TASKS_CRON_SECRET = os.environ.get('TASKS_CRON_SECRET', '')
+
+RECURRENCE_FIELDS = (
+    'recurring_frequency', 'recurring_interval', 'recurring_days_of_week',
+    'recurring_end_date', 'next_occurrence', 'recurrence_anchor', 'created_at'
+)
+
+def _as_date(value: Any) -> Optional[date]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+def parse_days_of_week(value: Any) -> List[int]:
+    # Дни недели в формате клиента (JS): 0 — воскресенье, 6 — суббота
+    if not value:
+        return []
+    days = value if isinstance(value, list) else re.findall(r'\d+', str(value))
+    return sorted({int(day) for day in days if 0 <= int(day) <= 6})
+
+def _add_months(anchor: date, months: int) -> date:
+    year, month = divmod(anchor.year * 12 + anchor.month - 1 + months, 12)
+    last_day = calendar.monthrange(year, month + 1)[1]
+    return date(year, month + 1, min(anchor.day, last_day))
+
+def _occurrence_candidates(task: Dict[str, Any], anchor: date, start: date) -> Iterator[date]:
+    frequency = task.get('recurring_frequency')
+    interval = max(int(task.get('recurring_interval') or 1), 1)
+    
+    if frequency == 'daily':
+        step = 0 if start <= anchor else -(-(start - anchor).days // interval)
+        while True:
+            yield anchor + timedelta(days=step * interval)
+            step += 1
+    
+    elif frequency == 'weekly':
+        week_start = anchor - timedelta(days=anchor.weekday())
+        days = parse_days_of_week(task.get('recurring_days_of_week'))
+        offsets = sorted((day - 1) % 7 for day in days) if days else [anchor.weekday()]
+        step = 0 if start <= week_start else (start - week_start).days // 7 // interval
+        while True:
+            base = week_start + timedelta(weeks=step * interval)
+            for offset in offsets:
+                yield base + timedelta(days=offset)
+            step += 1
+    
+    elif frequency in ('monthly', 'yearly'):
+        months = interval * (12 if frequency == 'yearly' else 1)
+        elapsed = (start.year - anchor.year) * 12 + start.month - anchor.month
+        step = max(elapsed // months, 0)
+        while True:
+            yield _add_months(anchor, step * months)
+            step += 1
+
+def iter_occurrences(task: Dict[str, Any], start: date) -> Iterator[date]:
+    """Лениво перечисляет даты повторений задачи, начиная со start включительно."""
+    # Ряд строится от неизменной опорной даты: next_occurrence только отсекает прошедшие повторения,
+    # иначе 31 января после февраля навсегда превращалось бы в 28-е
+    due = _as_date(task.get('next_occurrence'))
+    anchor = _as_date(task.get('recurrence_anchor')) or due or _as_date(task.get('created_at')) or start
+    floor = max(anchor, due) if due else anchor
+    end_date = _as_date(task.get('recurring_end_date'))
+    
+    for day in _occurrence_candidates(task, anchor, max(start, floor)):
+        if end_date and day > end_date:
+            return
+        if day >= start and day >= floor:
+            yield day
+
+def next_occurrence_after(task: Dict[str, Any], after: date) -> Optional[date]:
+    return next(iter_occurrences(task, after + timedelta(days=1)), None)
+
+def expand_occurrences(tasks: List[Dict[str, Any]], start: date, end: date) -> List[Dict[str, Any]]:
+    occurrences = []
+    for task in tasks:
+        for day in iter_occurrences(task, start):
+            if day > end:
+                break
+            occurrences.append({
+                'task_id': task['id'],
+                'title': task['title'],
+                'assignee_id': task['assignee_id'],
+                'date': day.isoformat()
+            })
+    occurrences.sort(key=lambda item: item['date'])
+    return occurrences
+
+def get_task_occurrences(family_id: str, start: date, end: date) -> List[Dict[str, Any]]:
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(
-        f"""
-        INSERT INTO {SCHEMA}.tasks (
-            family_id, title, description, assignee_id, completed, 
-            points, priority, category, deadline, reminder_time, is_recurring,
-            recurring_frequency, recurring_interval, recurring_days_of_week,
-            recurring_end_date, next_occurrence, cooking_day
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING *
-        """,
-        (
-            family_id,
-            data.get('title'),
-            data.get('description'),
-            data.get('assignee_id'),
-            data.get('completed', False),
-            data.get('points', 10),
-            data.get('priority', 'medium'),
-            data.get('category'),
-            data.get('deadline'),
-            data.get('reminder_time'),
-            data.get('is_recurring', False),
-            data.get('recurring_frequency'),
-            data.get('recurring_interval'),
-            data.get('recurring_days_of_week'),
-            data.get('recurring_end_date'),
-            data.get('next_occurrence'),
-            data.get('cooking_day')
+    try:
+        cur.execute(
+            f"""
+            SELECT id, title, assignee_id, {', '.join(RECURRENCE_FIELDS)}
+            FROM {SCHEMA}.tasks
+            WHERE family_id = %s AND is_recurring = TRUE
+            AND (recurring_end_date IS NULL OR recurring_end_date >= %s)
+            """,
+            (family_id, start)
         )
-    )
-    task = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+        tasks = [dict(task) for task in cur.fetchall()]
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
-    return dict(task)
+    return expand_occurrences(tasks, start, end)
 
-def update_task(task_id: str, family_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+def materialize_due_tasks() -> Dict[str, Any]:
+    # Один проход по всем семьям: выполненные повторяющиеся задачи, чья дата наступила, снова открываются
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(
-        f"SELECT id FROM {SCHEMA}.tasks WHERE id = %s AND family_id = %s",
-        (task_id, family_id)
-    )
-    if not cur.fetchone():
+    try:
+        cur.execute(
+            f"""
+            WITH reopened AS (
+                UPDATE {SCHEMA}.tasks
+                SET completed = FALSE, updated_at = CURRENT_TIMESTAMP
+                WHERE is_recurring = TRUE AND completed = TRUE
+                AND next_occurrence IS NOT NULL AND next_occurrence <= CURRENT_DATE
+                AND (recurring_end_date IS NULL OR next_occurrence <= recurring_end_date)
+                RETURNING family_id
+            ), bumped AS (
+                UPDATE {SCHEMA}.families SET data_version = data_version + 1
+                WHERE id IN (SELECT family_id FROM reopened)
+            )
+            SELECT COUNT(*) AS tasks, COUNT(DISTINCT family_id) AS families FROM reopened
+            """
+        )
+        result = cur.fetchone()
+        conn.commit()
+        return {'success': True, 'tasks': result['tasks'], 'families': result['families']}
+    except Exception as e:
+        conn.rollback()
+        return {'error': str(e)}
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Задача не найдена'}
+        release_db_connection(conn)
+
+TASK_WRITABLE_FIELDS = [
+    'title', 'description', 'assignee_id', 'completed', 'points',
+    'priority', 'category', 'deadline', 'reminder_time', 'is_recurring',
+    'recurring_frequency', 'recurring_interval', 'recurring_days_of_week',
+    'recurring_end_date', 'next_occurrence', 'recurrence_anchor', 'cooking_day'
+]
+
+TASK_INSERT_SQL = f"""
+    INSERT INTO {SCHEMA}.tasks (
+        family_id, title, description, assignee_id, completed, 
+        points, priority, category, deadline, reminder_time, is_recurring,
+        recurring_frequency, recurring_interval, recurring_days_of_week,
+        recurring_end_date, next_occurrence, recurrence_anchor, cooking_day
+    ) VALUES %s
+    RETURNING *
+"""
+
+def task_insert_values(family_id: str, data: Dict[str, Any]) -> Tuple:
+    if data.get('is_recurring') and not data.get('next_occurrence'):
+        first = next(iter_occurrences(data, date.today()), None)
+        data = {**data, 'next_occurrence': first.isoformat() if first else None}
     
-    fields = []
-    values = []
+    anchor = data.get('recurrence_anchor') or (data.get('next_occurrence') if data.get('is_recurring') else None)
+    return (
+        family_id,
+        data.get('title'),
+        data.get('description'),
+        data.get('assignee_id'),
+        data.get('completed', False),
+        data.get('points', 10),
+        data.get('priority', 'medium'),
+        data.get('category'),
+        data.get('deadline'),
+        data.get('reminder_time'),
+        data.get('is_recurring', False),
+        data.get('recurring_frequency'),
+        data.get('recurring_interval'),
+        data.get('recurring_days_of_week'),
+        data.get('recurring_end_date'),
+        data.get('next_occurrence'),
+        anchor,
+        data.get('cooking_day')
+    )
+
+# Изменение правила повторения или явный перенос даты задают новую опорную дату ряда
+RECURRENCE_RULE_FIELDS = ('recurring_frequency', 'recurring_interval', 'recurring_days_of_week', 'next_occurrence')
+
+def reanchor_recurrence(current: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    # Клиент может прислать задачу целиком: значимы только реально изменившиеся поля
+    changed = [
+        field for field in RECURRENCE_RULE_FIELDS
+        if field in data and str(data[field] or '') != str(current.get(field) or '')
+    ]
+    if 'recurrence_anchor' in data or not changed:
+        return data
+    anchor = data['next_occurrence'] if 'next_occurrence' in data else current.get('next_occurrence')
+    return {**data, 'recurrence_anchor': anchor}
+
+def prepare_task_update(current: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    return advance_on_completion(current, reanchor_recurrence(current, data))
+
+def advance_on_completion(current: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    # Выполнение повторяющейся задачи сдвигает next_occurrence на следующее повторение
+    if data.get('completed') is not True or 'next_occurrence' in data:
+        return data
+    if not data.get('is_recurring', current['is_recurring']):
+        return data
     
-    for field in ['title', 'description', 'assignee_id', 'completed', 'points', 
-                  'priority', 'category', 'deadline', 'reminder_time', 'is_recurring',
-                  'recurring_frequency', 'recurring_interval', 'recurring_days_of_week',
-                  'recurring_end_date', 'next_occurrence', 'cooking_day']:
-        if field in data:
-            fields.append(f"{field} = %s")
-            values.append(data[field])
+    rule = {**current, **{key: data[key] for key in RECURRENCE_FIELDS if key in data}}
+    due = _as_date(rule.get('next_occurrence')) or date.today()
+    following = next_occurrence_after(rule, max(due, date.today()))
+    return {**data, 'next_occurrence': following.isoformat() if following else None}
+
+def create_task(family_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    if not fields:
+    try:
+        task = execute_values(cur, TASK_INSERT_SQL, [task_insert_values(family_id, data)], fetch=True)[0]
+        bump_family_version(cur, family_id)
+        conn.commit()
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Нет данных для обновления'}
+        release_db_connection(conn)
     
-    fields.append("updated_at = CURRENT_TIMESTAMP")
-    values.extend([task_id, family_id])
-    
-    query = f"""
-        UPDATE {SCHEMA}.tasks 
-        SET {', '.join(fields)}
-        WHERE id = %s AND family_id = %s
-        RETURNING *
-    """
+    return dict(task)
+
+def update_task(task_id: str, family_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(query, tuple(values))
-    task = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+    try:
+        cur.execute(
+            f"""
+            SELECT id, is_recurring, {', '.join(RECURRENCE_FIELDS)}
+            FROM {SCHEMA}.tasks WHERE id = %s AND family_id = %s
+            """,
+            (task_id, family_id)
+        )
+        current = cur.fetchone()
+        if not current:
+            return {'error': 'Задача не найдена'}
+        
+        data = prepare_task_update(current, data)
+        
+        fields = tuple(field for field in TASK_WRITABLE_FIELDS if field in data)
+        if not fields:
+            return {'error': 'Нет данных для обновления'}
+        
+        cur.execute(
+            sql_update('tasks', fields, ('id', 'family_id'), '*', touch=True),
+            sql_params(*(data[field] for field in fields), task_id, family_id)
+        )
+        task = cur.fetchone()
+        bump_family_version(cur, family_id)
+        conn.commit()
+    finally:
+        cur.close()
+        release_db_connection(conn)
     
     return dict(task)
 
@@ -168,25 +745,205 @@ def delete_task(task_id: str, family_id: str) -> Dict[str, Any]:
     conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute(
-        f"SELECT id FROM {SCHEMA}.tasks WHERE id = %s AND family_id = %s",
-        (task_id, family_id)
-    )
-    if not cur.fetchone():
+    try:
+        cur.execute(
+            f"SELECT id FROM {SCHEMA}.tasks WHERE id = %s AND family_id = %s",
+            (task_id, family_id)
+        )
+        if not cur.fetchone():
+            return {'error': 'Задача не найдена'}
+        
+        cur.execute(
+            f"""
+            UPDATE {SCHEMA}.tasks
+            SET completed = TRUE, next_occurrence = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND family_id = %s
+            """,
+            (task_id, family_id)
+        )
+        bump_family_version(cur, family_id)
+        conn.commit()
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Задача не найдена'}
-    
-    cur.execute(
-        f"UPDATE {SCHEMA}.tasks SET completed = TRUE, updated_at = CURRENT_TIMESTAMP WHERE id = %s AND family_id = %s",
-        (task_id, family_id)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+        release_db_connection(conn)
     
     return {'success': True}
 
+BATCH_MAX_OPERATIONS = int(os.environ.get('TASKS_BATCH_MAX_OPERATIONS', '200'))
+BATCH_OPERATIONS = ('create', 'update', 'complete', 'delete')
+
+# Одна многострочная UPDATE для всех правок пакета: jsonb_populate_record приводит
+# значения к типам колонок, а CASE оставляет нетронутыми поля, которых нет в правке
+TASK_BATCH_UPDATE_SQL = f"""
+    UPDATE {SCHEMA}.tasks AS t
+    SET {', '.join(
+        f"{field} = CASE WHEN v.doc ? '{field}' THEN r.{field} ELSE t.{field} END"
+        for field in TASK_WRITABLE_FIELDS
+    )}, updated_at = CURRENT_TIMESTAMP
+    FROM (VALUES %s) AS v(id, family_id, doc)
+    CROSS JOIN LATERAL jsonb_populate_record(NULL::{SCHEMA}.tasks, v.doc) AS r
+    WHERE t.id = v.id AND t.family_id = v.family_id
+    RETURNING t.*
+"""
+
+def _batch_error(index: int, error: str) -> Dict[str, Any]:
+    return {'index': index, 'success': False, 'error': error}
+
+def apply_task_batch(family_id: str, operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Применяет пакет операций над задачами в одной транзакции, возвращает результат по каждой."""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(operations)
+    creates: List[Tuple[int, Dict[str, Any]]] = []
+    changes: Dict[str, Tuple[int, str, Dict[str, Any]]] = {}
+    
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPERATIONS:
+            results[index] = _batch_error(index, 'Неизвестная операция')
+            continue
+        
+        op = operation['op']
+        data = operation.get('data') or {}
+        if op == 'create':
+            if not data.get('title'):
+                results[index] = _batch_error(index, 'Требуется название задачи')
+            else:
+                creates.append((index, data))
+            continue
+        
+        try:
+            task_id = str(uuid.UUID(str(operation.get('id'))))
+        except ValueError:
+            results[index] = _batch_error(index, 'Требуется ID задачи')
+            continue
+        if task_id in changes:
+            results[index] = _batch_error(index, 'Задача уже изменяется в этом пакете')
+            continue
+        if op == 'update' and not any(field in data for field in TASK_WRITABLE_FIELDS):
+            results[index] = _batch_error(index, 'Нет данных для обновления')
+            continue
+        
+        changes[task_id] = (index, op, {'completed': True} if op == 'complete' else data)
+    
+    if not creates and not changes:
+        return {'results': results}
+    
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        current = {}
+        if changes:
+            cur.execute(
+                f"""
+                SELECT id, is_recurring, {', '.join(RECURRENCE_FIELDS)}
+                FROM {SCHEMA}.tasks WHERE id = ANY(%s::uuid[]) AND family_id = %s
+                """,
+                (list(changes), family_id)
+            )
+            current = {str(row['id']): row for row in cur.fetchall()}
+        
+        updates = []
+        deletes = []
+        for task_id, (index, op, data) in changes.items():
+            if task_id not in current:
+                results[index] = _batch_error(index, 'Задача не найдена')
+            elif op == 'delete':
+                deletes.append(task_id)
+                results[index] = {'index': index, 'success': True}
+            else:
+                data = prepare_task_update(current[task_id], data)
+                doc = {field: data[field] for field in TASK_WRITABLE_FIELDS if field in data}
+                updates.append((task_id, family_id, json.dumps(doc, default=str)))
+        
+        if creates:
+            rows = execute_values(
+                cur, TASK_INSERT_SQL,
+                [task_insert_values(family_id, data) for _, data in creates],
+                fetch=True
+            )
+            for (index, _), task in zip(creates, rows):
+                results[index] = {'index': index, 'success': True, 'task': dict(task)}
+        
+        if updates:
+            rows = execute_values(
+                cur, TASK_BATCH_UPDATE_SQL, updates,
+                template='(%s::uuid, %s::uuid, %s::jsonb)', fetch=True
+            )
+            for task in rows:
+                index = changes[str(task['id'])][0]
+                results[index] = {'index': index, 'success': True, 'task': dict(task)}
+        
+        if deletes:
+            cur.execute(
+                f"""
+                UPDATE {SCHEMA}.tasks
+                SET completed = TRUE, next_occurrence = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ANY(%s::uuid[]) AND family_id = %s
+                """,
+                (deletes, family_id)
+            )
+        
+        if creates or updates or deletes:
+            bump_family_version(cur, family_id)
+        conn.commit()
+        return {'results': results}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        release_db_connection(conn)
+
+# Сериализация ответов: orjson, если установлен, иначе json с заранее подготовленными обработчиками типов
+JSON_COMPRESS_MIN_SIZE = int(os.environ.get('JSON_COMPRESS_MIN_SIZE', '8192'))
+
+def _encode_bytes(value: Any) -> str:
+    return base64.b64encode(bytes(value)).decode('ascii')
+
+# Форматы совпадают с прежним default=str, чтобы клиенты не заметили разницы
+_JSON_TYPE_HANDLERS = {
+    datetime: str,
+    date: str,
+    uuid.UUID: str,
+    Decimal: str,
+    memoryview: _encode_bytes,
+    bytes: _encode_bytes,
+}
+
+def _json_default(value: Any) -> Any:
+    handler = _JSON_TYPE_HANDLERS.get(type(value))
+    return handler(value) if handler else str(value)
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+def dumps_json(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+    return _json_encoder.encode(payload)
+
+def json_response(event: Dict[str, Any], status_code: int, payload: Any, headers: Dict[str, str]) -> Dict[str, Any]:
+    return encoded_response(event, status_code, dumps_json(payload), headers)
+
+def encoded_response(event: Dict[str, Any], status_code: int, body: str, headers: Dict[str, str]) -> Dict[str, Any]:
+    # Большие тела сжимаются br или gzip, если клиент их принимает
+    if len(body) < JSON_COMPRESS_MIN_SIZE:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    
+    all_headers = event.get('headers') or {}
+    accepted = (all_headers.get('Accept-Encoding', '') or all_headers.get('accept-encoding', '')).lower()
+    if brotli is not None and 'br' in accepted:
+        encoding, compressed = 'br', brotli.compress(body.encode('utf-8'), quality=5)
+    elif 'gzip' in accepted:
+        encoding, compressed = 'gzip', gzip.compress(body.encode('utf-8'), compresslevel=5)
+    else:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    
+    return {
+        'statusCode': status_code,
+        'headers': {**headers, 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'},
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -196,7 +953,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-Cron-Secret, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -204,38 +961,124 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     headers = {
         'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*'
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag'
     }
     
     try:
-        token = event.get('headers', {}).get('X-Auth-Token', '')
-        user_id = verify_token(token)
+        params = event.get('queryStringParameters') or {}
+        
+        if method == 'POST' and params.get('action') == 'materialize':
+            all_headers = event.get('headers') or {}
+            cron_secret = all_headers.get('X-Cron-Secret', '') or all_headers.get('x-cron-secret', '')
+            if not TASKS_CRON_SECRET or not hmac.compare_digest(cron_secret, TASKS_CRON_SECRET):
+                return {
+                    'statusCode': 403,
+                    'headers': headers,
+                    'body': dumps_json({'error': 'Доступ запрещён'})
+                }
+            result = materialize_due_tasks()
+            return {
+                'statusCode': 200 if 'success' in result else 500,
+                'headers': headers,
+                'body': dumps_json(result)
+            }
+        
+        all_headers = event.get('headers') or {}
+        token = all_headers.get('X-Auth-Token', '') or all_headers.get('x-auth-token', '')
+        auth = get_auth_context(token)
         
-        if not user_id:
+        if not auth:
             return {
                 'statusCode': 401,
                 'headers': headers,
-                'body': json.dumps({'error': 'Требуется авторизация'})
+                'body': dumps_json({'error': 'Требуется авторизация'})
             }
         
-        family_id = get_user_family_id(user_id)
+        family_id = auth['family_id']
         if not family_id:
             return {
                 'statusCode': 403,
                 'headers': headers,
-                'body': json.dumps({'error': 'Пользователь не привязан к семье'})
+                'body': dumps_json({'error': 'Пользователь не привязан к семье'})
+            }
+        
+        if method == 'GET' and params.get('view') == 'occurrences':
+            try:
+                start = date.fromisoformat(params.get('from') or date.today().isoformat())
+                end = date.fromisoformat(params.get('to') or (start + timedelta(days=30)).isoformat())
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': dumps_json({'error': 'Некорректный период'})
+                }
+            if end < start or (end - start).days > RECURRENCE_WINDOW_MAX_DAYS:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': dumps_json({'error': f'Период должен быть не длиннее {RECURRENCE_WINDOW_MAX_DAYS} дней'})
+                }
+            
+            occurrences = get_task_occurrences(family_id, start, end)
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': dumps_json({'occurrences': occurrences})
             }
         
         if method == 'GET':
-            params = event.get('queryStringParameters', {})
             completed_param = params.get('completed')
             completed = None if completed_param is None else completed_param.lower() == 'true'
             
-            tasks = get_tasks(family_id, completed)
+            # Страницы только по запросу клиента: без limit и cursor список отдаётся целиком, как раньше
+            paginated = 'limit' in params or 'cursor' in params
+            try:
+                limit = min(max(int(params.get('limit', TASKS_PAGE_SIZE)), 1), TASKS_PAGE_MAX) if paginated else None
+                fields = parse_task_fields(params.get('fields'))
+                cursor = params.get('cursor')
+                if cursor:
+                    decode_task_cursor(cursor)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': dumps_json({'error': f'Некорректные параметры: {str(e)}'})
+                }
+            
+            etag = make_etag(get_family_version(family_id), params)
+            if etag_matches(event, etag):
+                return {
+                    'statusCode': 304,
+                    'headers': {**headers, 'ETag': etag},
+                    'body': ''
+                }
+            
+            tasks, next_cursor = get_tasks(family_id, completed, limit, cursor, fields)
+            payload = {'tasks': tasks, 'next_cursor': next_cursor} if paginated else {'tasks': tasks}
+            return json_response(event, 200, payload, {**headers, 'ETag': etag})
+        
+        elif method == 'POST' and params.get('action') == 'batch':
+            body = json.loads(event.get('body', '{}'))
+            operations = body.get('operations')
+            if not isinstance(operations, list) or not operations:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': dumps_json({'error': 'Требуется список операций'})
+                }
+            if len(operations) > BATCH_MAX_OPERATIONS:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': dumps_json({'error': f'Не больше {BATCH_MAX_OPERATIONS} операций за раз'})
+                }
+            
+            result = apply_task_batch(family_id, operations)
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps({'tasks': tasks}, default=str)
+                'body': dumps_json(result)
             }
         
         elif method == 'POST':
@@ -244,7 +1087,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 201,
                 'headers': headers,
-                'body': json.dumps({'task': task}, default=str)
+                'body': dumps_json({'task': task})
             }
         
         elif method == 'PUT':
@@ -254,7 +1097,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 400,
                     'headers': headers,
-                    'body': json.dumps({'error': 'Требуется ID задачи'})
+                    'body': dumps_json({'error': 'Требуется ID задачи'})
                 }
             
             task = update_task(task_id, family_id, body)
@@ -262,22 +1105,21 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 404,
                     'headers': headers,
-                    'body': json.dumps(task)
+                    'body': dumps_json(task)
                 }
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps({'task': task}, default=str)
+                'body': dumps_json({'task': task})
             }
         
         elif method == 'DELETE':
-            params = event.get('queryStringParameters', {})
             task_id = params.get('id')
             if not task_id:
                 return {
                     'statusCode': 400,
                     'headers': headers,
-                    'body': json.dumps({'error': 'Требуется ID задачи'})
+                    'body': dumps_json({'error': 'Требуется ID задачи'})
                 }
             
             result = delete_task(task_id, family_id)
@@ -285,23 +1127,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 404,
                     'headers': headers,
-                    'body': json.dumps(result)
+                    'body': dumps_json(result)
                 }
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps(result)
+                'body': dumps_json(result)
             }
         
         return {
             'statusCode': 405,
             'headers': headers,
-            'body': json.dumps({'error': 'Метод не поддерживается'})
+            'body': dumps_json({'error': 'Метод не поддерживается'})
         }
     
     except Exception as e:
         return {
             'statusCode': 500,
             'headers': headers,
-            'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+            'body': dumps_json({'error': str(e)})
+        }
+
+if __name__ == '__main__':
+    # Локальный запуск пакетной материализации: python index.py
+    print(json.dumps(materialize_due_tasks()))
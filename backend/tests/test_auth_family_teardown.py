@@ -0,0 +1,153 @@
+"""Прогоняет LEAVE_FAMILY_SQL и purge_family на настоящем Postgres.
+
+Нужна пустая тестовая база в TEST_DATABASE_URL: схема создаётся внутри транзакции и откатывается.
+"""
+import importlib.util
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+from psycopg2.extras import RealDictCursor  # noqa: E402
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason='TEST_DATABASE_URL не задан')
+
+_spec = importlib.util.spec_from_file_location('auth_index', Path(__file__).parent.parent / 'auth' / 'index.py')
+auth = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(auth)
+
+S = auth.SCHEMA
+
+# Минимальная схема: типы ключей как в миграциях, включая INTEGER-таблицы из V0006
+SCHEMA_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS {S};
+CREATE TABLE {S}.users (id UUID PRIMARY KEY);
+CREATE TABLE {S}.families (
+    id UUID PRIMARY KEY, name TEXT,
+    data_version BIGINT NOT NULL DEFAULT 0, deleted_at TIMESTAMP
+);
+CREATE TABLE {S}.family_members (
+    id UUID PRIMARY KEY,
+    family_id UUID REFERENCES {S}.families(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES {S}.users(id)
+);
+CREATE TABLE {S}.family_invites (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    family_id UUID NOT NULL REFERENCES {S}.families(id) ON DELETE CASCADE,
+    created_by UUID REFERENCES {S}.users(id)
+);
+CREATE TABLE {S}.payments (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    family_id UUID NOT NULL REFERENCES {S}.families(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES {S}.users(id)
+);
+CREATE TABLE {S}.export_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    family_id UUID NOT NULL REFERENCES {S}.families(id) ON DELETE CASCADE,
+    requested_by UUID REFERENCES {S}.users(id)
+);
+CREATE TABLE {S}.password_reset_tokens (id SERIAL PRIMARY KEY, user_id UUID NOT NULL REFERENCES {S}.users(id));
+CREATE TABLE {S}.verification_codes (id SERIAL PRIMARY KEY, user_id UUID REFERENCES {S}.users(id));
+CREATE TABLE {S}.tasks (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    family_id UUID REFERENCES {S}.families(id) ON DELETE CASCADE,
+    assignee_id UUID REFERENCES {S}.family_members(id) ON DELETE SET NULL
+);
+CREATE TABLE {S}.test_results (id SERIAL PRIMARY KEY, child_member_id INTEGER NOT NULL);
+CREATE TABLE {S}.children_profiles (id SERIAL PRIMARY KEY, family_id INTEGER NOT NULL, child_member_id INTEGER NOT NULL);
+CREATE TABLE {S}.sync_tombstones (family_id TEXT NOT NULL, section TEXT, row_id TEXT);
+""" + ''.join(
+    f"CREATE TABLE {S}.{table} (id SERIAL PRIMARY KEY, family_id INTEGER NOT NULL);\n"
+    for table in auth.FAMILY_PURGE_TABLES if table not in ('tasks', 'test_results', 'children_profiles')
+)
+
+
+@pytest.fixture
+def cur():
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(SCHEMA_SQL)
+    try:
+        yield cursor
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def make_family(cur, members):
+    family_id = str(uuid.uuid4())
+    cur.execute(f"INSERT INTO {S}.families (id, name) VALUES (%s, 'Тест')", (family_id,))
+    users = []
+    for _ in range(members):
+        user_id, member_id = str(uuid.uuid4()), str(uuid.uuid4())
+        cur.execute(f"INSERT INTO {S}.users (id) VALUES (%s)", (user_id,))
+        cur.execute(
+            f"INSERT INTO {S}.family_members (id, family_id, user_id) VALUES (%s, %s, %s)",
+            (member_id, family_id, user_id)
+        )
+        cur.execute(f"INSERT INTO {S}.tasks (family_id, assignee_id) VALUES (%s, %s)", (family_id, member_id))
+        users.append(user_id)
+    cur.execute(f"INSERT INTO {S}.family_invites (family_id) VALUES (%s)", (family_id,))
+    cur.execute(f"INSERT INTO {S}.test_results (child_member_id) VALUES (1)")
+    cur.execute(f"INSERT INTO {S}.chat_messages (family_id) VALUES (1)")
+    return family_id, users
+
+
+def count(cur, sql, *params):
+    cur.execute(f"SELECT COUNT(*) AS n FROM {sql}", params)
+    return cur.fetchone()['n']
+
+
+def test_member_leaves_shared_family(cur):
+    family_id, (leaving, staying) = make_family(cur, 2)
+    
+    auth.leave_current_family(cur, leaving)
+    
+    cur.execute(f"SELECT data_version, deleted_at FROM {S}.families WHERE id = %s", (family_id,))
+    family = cur.fetchone()
+    assert family['data_version'] == 1
+    assert family['deleted_at'] is None
+    assert count(cur, f"{S}.family_members WHERE family_id = %s", family_id) == 1
+    assert count(cur, f"{S}.tasks WHERE family_id = %s AND assignee_id IS NULL", family_id) == 1
+    assert count(cur, f"{S}.family_invites WHERE family_id = %s", family_id) == 1
+
+
+def test_last_member_tears_down_family(cur):
+    family_id, (user_id,) = make_family(cur, 1)
+    
+    auth.leave_current_family(cur, user_id)
+    
+    assert count(cur, f"{S}.families WHERE id = %s", family_id) == 0
+    assert count(cur, f"{S}.tasks WHERE family_id = %s", family_id) == 0
+    assert count(cur, f"{S}.family_invites WHERE family_id = %s", family_id) == 0
+    # INTEGER-ключи V0006 не совпадают с UUID семьи: строки не трогаются и ошибки нет
+    assert count(cur, f"{S}.test_results") == 1
+    assert count(cur, f"{S}.chat_messages") == 1
+
+
+def test_leave_without_family_is_noop(cur):
+    user_id = str(uuid.uuid4())
+    cur.execute(f"INSERT INTO {S}.users (id) VALUES (%s)", (user_id,))
+    
+    auth.leave_current_family(cur, user_id)
+
+
+def test_account_cleanup_does_not_wait_for_purge(cur, monkeypatch):
+    monkeypatch.setattr(auth, 'FAMILY_PURGE_INLINE_BATCHES', 0)
+    family_id, (user_id,) = make_family(cur, 1)
+    cur.execute(f"INSERT INTO {S}.payments (family_id, user_id) VALUES (%s, %s)", (family_id, user_id))
+    cur.execute(f"INSERT INTO {S}.export_jobs (family_id, requested_by) VALUES (%s, %s)", (family_id, user_id))
+    cur.execute(f"INSERT INTO {S}.password_reset_tokens (user_id) VALUES (%s)", (user_id,))
+    
+    auth.leave_current_family(cur, user_id)
+    for statement in auth.ACCOUNT_CLEANUP_SQL:
+        cur.execute(statement, (user_id,))
+    cur.execute(f"DELETE FROM {S}.users WHERE id = %s", (user_id,))
+    
+    # Семья ещё ждёт фоновой дочистки, а платёж остался в её истории без плательщика
+    assert count(cur, f"{S}.families WHERE id = %s AND deleted_at IS NOT NULL", family_id) == 1
+    assert count(cur, f"{S}.payments WHERE family_id = %s AND user_id IS NULL", family_id) == 1
+    assert count(cur, f"{S}.export_jobs WHERE family_id = %s AND requested_by IS NULL", family_id) == 1
@@ -0,0 +1,221 @@
+"""Пакетный эндпоинт задач: порядок результатов и проверка принадлежности задач семье.
+
+Первые тесты подменяют соединение записывающим курсором, последние прогоняют SQL
+на настоящем Postgres из TEST_DATABASE_URL (схема создаётся в транзакции и откатывается).
+"""
+import importlib.util
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+_spec = importlib.util.spec_from_file_location('tasks_index', Path(__file__).parent.parent / 'tasks' / 'index.py')
+tasks = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(tasks)
+
+S = tasks.SCHEMA
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+FAMILY_ID = str(uuid.uuid4())
+
+
+class RecordingCursor:
+    """Отдаёт заданные строки на выборку текущих задач и запоминает все запросы."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.committed = False
+
+    def cursor(self, cursor_factory=None):
+        return self._cursor
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(current_rows):
+        cursor = RecordingCursor(current_rows)
+        conn = RecordingConnection(cursor)
+        calls = []
+
+        def fake_execute_values(cur, sql, argslist, template=None, fetch=False):
+            calls.append((sql, argslist))
+            if sql == tasks.TASK_INSERT_SQL:
+                return [{'id': str(uuid.uuid4()), 'title': values[1]} for values in argslist]
+            return [{'id': task_id, **json.loads(doc)} for task_id, _, doc in argslist]
+
+        monkeypatch.setattr(tasks, 'get_db_connection', lambda: conn)
+        monkeypatch.setattr(tasks, 'release_db_connection', lambda c: None)
+        monkeypatch.setattr(tasks, 'execute_values', fake_execute_values)
+        return conn, cursor, calls
+    return install
+
+
+def current_row(task_id):
+    return {
+        'id': task_id, 'is_recurring': False, 'recurring_frequency': None, 'recurring_interval': None,
+        'recurring_days_of_week': None, 'recurring_end_date': None, 'next_occurrence': None,
+        'recurrence_anchor': None, 'created_at': None
+    }
+
+
+def test_mixed_batch_results_follow_request_order(fake_db):
+    updated, deleted = str(uuid.uuid4()), str(uuid.uuid4())
+    conn, cursor, calls = fake_db([current_row(updated), current_row(deleted)])
+
+    result = tasks.apply_task_batch(FAMILY_ID, [
+        {'op': 'delete', 'id': deleted},
+        {'op': 'create', 'data': {'title': 'Купить хлеб'}},
+        {'op': 'rename'},
+        {'op': 'update', 'id': updated, 'data': {'title': 'Полить цветы'}},
+        {'op': 'create', 'data': {}},
+    ])['results']
+
+    assert [item['index'] for item in result] == [0, 1, 2, 3, 4]
+    assert [item['success'] for item in result] == [True, True, False, True, False]
+    assert result[1]['task']['title'] == 'Купить хлеб'
+    assert result[3]['task']['title'] == 'Полить цветы'
+
+    # Создание и правка — по одному многострочному запросу, удаление мягкое, версия семьи растёт
+    assert [sql for sql, _ in calls] == [tasks.TASK_INSERT_SQL, tasks.TASK_BATCH_UPDATE_SQL]
+    statements = [sql for sql, _ in cursor.executed]
+    assert any('SET completed = TRUE, next_occurrence = NULL' in sql for sql in statements)
+    assert 'data_version = data_version + 1' in statements[-1]
+    assert conn.committed
+
+
+def test_ids_of_another_family_are_rejected(fake_db):
+    own, foreign = str(uuid.uuid4()), str(uuid.uuid4())
+    # Выборка текущих задач ограничена семьёй, поэтому чужая задача в неё не попадает
+    conn, cursor, calls = fake_db([current_row(own)])
+
+    result = tasks.apply_task_batch(FAMILY_ID, [
+        {'op': 'update', 'id': foreign, 'data': {'title': 'Чужая'}},
+        {'op': 'delete', 'id': foreign},
+        {'op': 'complete', 'id': own},
+    ])['results']
+
+    assert result[0] == {'index': 0, 'success': False, 'error': 'Задача не найдена'}
+    assert result[1] == {'index': 1, 'success': False, 'error': 'Задача уже изменяется в этом пакете'}
+    assert result[2]['success'] is True
+
+    select_sql, select_params = cursor.executed[0]
+    assert 'family_id = %s' in select_sql
+    assert select_params == ([foreign, own], FAMILY_ID)
+    # В UPDATE уходит только своя задача
+    assert [task_id for task_id, _, _ in calls[0][1]] == [own]
+
+
+def test_batch_without_valid_operations_skips_database(monkeypatch):
+    monkeypatch.setattr(tasks, 'get_db_connection', lambda: pytest.fail('соединение не нужно'))
+
+    result = tasks.apply_task_batch(FAMILY_ID, [{'op': 'update', 'id': 'не uuid'}, 'мусор'])['results']
+
+    assert [item['error'] for item in result] == ['Требуется ID задачи', 'Неизвестная операция']
+
+
+SCHEMA_SQL = f"""
+CREATE SCHEMA IF NOT EXISTS {S};
+CREATE TABLE {S}.families (id UUID PRIMARY KEY, data_version BIGINT NOT NULL DEFAULT 0);
+CREATE TABLE {S}.tasks (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    family_id UUID REFERENCES {S}.families(id),
+    title VARCHAR(255), description TEXT, assignee_id UUID,
+    completed BOOLEAN DEFAULT FALSE, points INTEGER DEFAULT 10, priority VARCHAR(20) DEFAULT 'medium',
+    category VARCHAR(50), deadline TIMESTAMP, reminder_time VARCHAR(5), shopping_list JSONB,
+    is_recurring BOOLEAN DEFAULT FALSE, recurring_frequency VARCHAR(20), recurring_interval INTEGER,
+    recurring_days_of_week TEXT, recurring_end_date DATE, recurring_pattern TEXT,
+    next_occurrence DATE, recurrence_anchor DATE, cooking_day VARCHAR(20),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class SharedConnection:
+    """Соединение теста без фиксации: всё откатывается вместе со схемой."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, cursor_factory=None):
+        return self._conn.cursor(cursor_factory=cursor_factory)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def pg(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL не задан')
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    cur.execute(SCHEMA_SQL)
+    monkeypatch.setattr(tasks, 'get_db_connection', lambda: SharedConnection(conn))
+    monkeypatch.setattr(tasks, 'release_db_connection', lambda c: None)
+    try:
+        yield cur
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def make_task(cur, family_id, title):
+    cur.execute(f"INSERT INTO {S}.families (id) VALUES (%s) ON CONFLICT DO NOTHING", (family_id,))
+    cur.execute(f"INSERT INTO {S}.tasks (family_id, title) VALUES (%s, %s) RETURNING id", (family_id, title))
+    return str(cur.fetchone()['id'])
+
+
+def test_batch_on_postgres(pg):
+    mine, theirs = str(uuid.uuid4()), str(uuid.uuid4())
+    kept, removed = make_task(pg, mine, 'Помыть посуду'), make_task(pg, mine, 'Вынести мусор')
+    foreign = make_task(pg, theirs, 'Чужая задача')
+
+    result = tasks.apply_task_batch(mine, [
+        {'op': 'update', 'id': kept, 'data': {'title': 'Помыть посуду вечером', 'points': 30}},
+        {'op': 'update', 'id': foreign, 'data': {'title': 'Взлом'}},
+        {'op': 'create', 'data': {'title': 'Погулять с собакой'}},
+        {'op': 'delete', 'id': removed},
+    ])['results']
+
+    assert [item['success'] for item in result] == [True, False, True, True]
+    assert result[0]['task']['title'] == 'Помыть посуду вечером'
+    assert result[0]['task']['points'] == 30
+    # Поля, которых нет в правке, jsonb_populate_record не затирает
+    assert result[0]['task']['priority'] == 'medium'
+    assert str(result[2]['task']['family_id']) == mine
+
+    pg.execute(f"SELECT title FROM {S}.tasks WHERE id = %s", (foreign,))
+    assert pg.fetchone()['title'] == 'Чужая задача'
+    pg.execute(f"SELECT completed FROM {S}.tasks WHERE id = %s", (removed,))
+    assert pg.fetchone()['completed'] is True
+    pg.execute(f"SELECT id::text, data_version FROM {S}.families ORDER BY data_version")
+    assert {row['id']: row['data_version'] for row in pg.fetchall()} == {theirs: 0, mine: 1}
@@ -0,0 +1,59 @@
+import importlib.util
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+_spec = importlib.util.spec_from_file_location('tasks_index', Path(__file__).parent.parent / 'tasks' / 'index.py')
+tasks = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(tasks)
+
+
+def monthly(anchor, due=None):
+    return {
+        'is_recurring': True,
+        'recurring_frequency': 'monthly',
+        'recurring_interval': 1,
+        'recurrence_anchor': anchor,
+        'next_occurrence': due or anchor,
+    }
+
+
+def take(iterator, count):
+    return [next(iterator) for _ in range(count)]
+
+
+def test_monthly_month_end_keeps_anchor_day():
+    task = monthly(date(2099, 1, 31))
+    assert take(tasks.iter_occurrences(task, date(2099, 1, 1)), 4) == [
+        date(2099, 1, 31), date(2099, 2, 28), date(2099, 3, 31), date(2099, 4, 30)
+    ]
+
+
+def test_completion_after_clamped_month_returns_to_anchor_day():
+    current = monthly(date(2099, 1, 31), due=date(2099, 2, 28))
+    current['is_recurring'] = True
+    data = tasks.prepare_task_update(current, {'completed': True})
+    assert data['next_occurrence'] == '2099-03-31'
+    assert 'recurrence_anchor' not in data
+
+
+def test_yearly_leap_day_anchor():
+    task = {**monthly(date(2096, 2, 29)), 'recurring_frequency': 'yearly'}
+    assert take(tasks.iter_occurrences(task, date(2096, 1, 1)), 2) == [date(2096, 2, 29), date(2097, 2, 28)]
+    assert tasks.next_occurrence_after(task, date(2099, 3, 1)) == date(2100, 2, 28)
+    assert tasks.next_occurrence_after(task, date(2103, 3, 1)) == date(2104, 2, 29)
+
+
+def test_rescheduling_moves_anchor():
+    current = monthly(date(2099, 1, 31))
+    data = tasks.prepare_task_update(current, {'next_occurrence': '2099-02-10'})
+    assert data['recurrence_anchor'] == '2099-02-10'
+
+
+def test_resending_unchanged_rule_keeps_anchor():
+    current = monthly(date(2099, 1, 31), due=date(2099, 2, 28))
+    data = tasks.prepare_task_update(current, {'next_occurrence': '2099-02-28', 'recurring_interval': 1})
+    assert 'recurrence_anchor' not in data
@@ -6,39 +6,538 @@ Returns: JSON с результатом операции
 
 import json
 import os
+import base64
+import hmac
+import struct
+import uuid
+import threading
+import weakref
+import time
+import re
 import hashlib
 import secrets
 import random
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+import sqlite3
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 SCHEMA = 't_p5815085_family_assistant_pro'
 
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300'))
+DB_POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', '30'))
+
+# Пул соединений живёт между тёплыми вызовами функции
+_pool_lock = threading.Lock()
+_idle_connections: List[Tuple[Any, float]] = []
+
+def _discard_connection(conn) -> None:
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def _is_connection_alive(conn, idle_for: float) -> bool:
+    if conn.closed:
+        return False
+    if idle_for < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT 1')
+        cur.close()
+        if not conn.autocommit:
+            conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
 def get_db_connection():
+    now = time.monotonic()
+    with _pool_lock:
+        stale = [c for c, released_at in _idle_connections if now - released_at >= DB_POOL_IDLE_TIMEOUT]
+        _idle_connections[:] = [item for item in _idle_connections if item[0] not in stale]
+    for conn in stale:
+        _discard_connection(conn)
+    
+    while True:
+        with _pool_lock:
+            if not _idle_connections:
+                break
+            conn, released_at = _idle_connections.pop()
+        if _is_connection_alive(conn, now - released_at):
+            return conn
+        _discard_connection(conn)
+    
     return psycopg2.connect(DATABASE_URL)
 
+def release_db_connection(conn) -> None:
+    if conn.closed:
+        return
+    try:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            conn.rollback()
+    except psycopg2.Error:
+        _discard_connection(conn)
+        return
+    with _pool_lock:
+        if len(_idle_connections) < DB_POOL_MAX_SIZE:
+            _idle_connections.append((conn, time.monotonic()))
+            return
+    _discard_connection(conn)
+
+PREPARED_STATEMENTS_ENABLED = os.environ.get('PREPARED_STATEMENTS_ENABLED', 'true').lower() == 'true'
+
+# Имена подготовленных на каждом соединении запросов; запись пропадает вместе с соединением
+_prepared_on_connection = weakref.WeakKeyDictionary()
+
+def execute_prepared(cur, name: str, params: Tuple = ()) -> None:
+    """Выполняет запрос из PREPARED_STATEMENTS по имени; PREPARE делается один раз на соединение."""
+    sql = PREPARED_STATEMENTS[name]
+    if not PREPARED_STATEMENTS_ENABLED:
+        # Для пулеров в режиме транзакций: тот же текст, но обычным параметризованным запросом
+        cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', sql), {f'p{i}': value for i, value in enumerate(params, 1)})
+        return
+    
+    prepared = _prepared_on_connection.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f'PREPARE {name} AS {sql}')
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f'EXECUTE {name}')
+
+# Горячие запросы модуля: имя -> SQL с позиционными параметрами $1, $2...
+PREPARED_STATEMENTS = {
+    # Сессия, семья, член семьи и его права одним запросом
+    'auth_context': f"""
+        SELECT s.user_id, fm.family_id, fm.id AS member_id, fm.permissions,
+               f.name AS family_name
+        FROM {SCHEMA}.sessions s
+        LEFT JOIN {SCHEMA}.family_members fm
+            ON fm.user_id = s.user_id AND fm.family_id IS NOT NULL
+        LEFT JOIN {SCHEMA}.families f ON f.id = fm.family_id
+        WHERE s.token = $1 AND s.expires_at > CURRENT_TIMESTAMP
+        LIMIT 1
+    """,
+}
+
+TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get('TOKEN_CACHE_NEGATIVE_TTL', '5'))
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get('TOKEN_CACHE_MAX_SIZE', '1024'))
+
+# Кэш сессий: token -> (истекает, данные); None кэшируется для неизвестных токенов
+_token_cache: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+
+def _token_cache_get(token: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    now = time.monotonic()
+    with _token_cache_lock:
+        entry = _token_cache.get(token)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del _token_cache[token]
+            _token_cache_stats['misses'] += 1
+            return False, None
+        _token_cache.move_to_end(token)
+        _token_cache_stats['hits' if entry[1] is not None else 'negative_hits'] += 1
+        return True, entry[1]
+
+def _token_cache_put(token: str, value: Optional[Dict[str, Any]]) -> None:
+    ttl = TOKEN_CACHE_TTL if value is not None else TOKEN_CACHE_NEGATIVE_TTL
+    with _token_cache_lock:
+        _token_cache[token] = (time.monotonic() + ttl, value)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+
+def invalidate_token_cache(token: Optional[str] = None, user_id: Optional[str] = None) -> None:
+    with _token_cache_lock:
+        if token is not None:
+            _token_cache.pop(token, None)
+        if user_id is not None:
+            stale = [key for key, (_, value) in _token_cache.items() if value and value.get('user_id') == user_id]
+            for key in stale:
+                del _token_cache[key]
+
+def get_token_cache_stats() -> Dict[str, int]:
+    with _token_cache_lock:
+        return dict(_token_cache_stats, size=len(_token_cache))
+
+# Ограничение частоты: бакеты по телефону, IP и семье, "ёмкость/секунды" через env
+def _parse_rate(value: str) -> Tuple[float, float]:
+    capacity, _, period = value.partition('/')
+    return float(capacity), float(capacity) / float(period or '60')
+
+RATE_LIMITS = {
+    'phone': _parse_rate(os.environ.get('RATE_LIMIT_PHONE', '5/300')),
+    'ip': _parse_rate(os.environ.get('RATE_LIMIT_IP', '30/60')),
+    'family': _parse_rate(os.environ.get('RATE_LIMIT_FAMILY', '20/60')),
+}
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+# Файл SQLite, общий для процессов на одной машине; без него бакеты живут в памяти процесса
+RATE_LIMIT_STORE_PATH = os.environ.get('RATE_LIMIT_STORE_PATH', '')
+
+_rate_buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+_rate_lock = threading.Lock()
+_rate_store = None
+
+def _refill(tokens: float, updated: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+def _settle_buckets(buckets: List[Tuple[str, float, float]], levels: List[float]) -> Tuple[float, List[float]]:
+    # Токены списываются только когда пропускают все бакеты: отклонённый запрос не продлевает блокировку
+    wait = max(((1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, buckets) if tokens < 1), default=0.0)
+    return wait, [tokens if wait else tokens - 1 for tokens in levels]
+
+def _take_tokens_memory(buckets: List[Tuple[str, float, float]], now: float) -> float:
+    with _rate_lock:
+        levels = []
+        for key, capacity, rate in buckets:
+            tokens, updated = _rate_buckets.get(key, (capacity, now))
+            levels.append(_refill(tokens, updated, capacity, rate, now))
+        wait, levels = _settle_buckets(buckets, levels)
+        for (key, _, _), tokens in zip(buckets, levels):
+            _rate_buckets[key] = (tokens, now)
+            _rate_buckets.move_to_end(key)
+        while len(_rate_buckets) > RATE_LIMIT_MAX_KEYS:
+            _rate_buckets.popitem(last=False)
+        return wait
+
+def _get_rate_store():
+    global _rate_store
+    if _rate_store is None:
+        _rate_store = sqlite3.connect(RATE_LIMIT_STORE_PATH, timeout=0.2, isolation_level=None, check_same_thread=False)
+        _rate_store.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+    return _rate_store
+
+def _take_tokens_shared(buckets: List[Tuple[str, float, float]], now: float) -> float:
+    with _rate_lock:
+        store = _get_rate_store()
+        store.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, capacity, rate in buckets:
+                row = store.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                levels.append(_refill(row[0], row[1], capacity, rate, now) if row else capacity)
+            wait, levels = _settle_buckets(buckets, levels)
+            store.executemany(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                [(key, tokens, now) for (key, _, _), tokens in zip(buckets, levels)]
+            )
+            store.execute('COMMIT')
+        except Exception:
+            store.execute('ROLLBACK')
+            raise
+        return wait
+
+def check_rate_limit(keys: List[Tuple[str, Optional[str]]]) -> int:
+    """Списывает по токену из каждого бакета, если пропускают все; возвращает секунды до повтора (0 — можно)."""
+    if not RATE_LIMIT_ENABLED:
+        return 0
+    now = time.time()
+    buckets = [(f'{scope}:{value}', *RATE_LIMITS[scope]) for scope, value in keys if value]
+    if not buckets:
+        return 0
+    wait = None
+    if RATE_LIMIT_STORE_PATH:
+        try:
+            wait = _take_tokens_shared(buckets, now)
+        except sqlite3.Error:
+            pass
+    if wait is None:
+        wait = _take_tokens_memory(buckets, now)
+    return int(wait) + 1 if wait > 0 else 0
+
+def client_ip(event: Dict[str, Any]) -> Optional[str]:
+    # X-Forwarded-For задаёт клиент; доверять можно только адресу, который дописал последний прокси
+    identity = (event.get('requestContext') or {}).get('identity') or {}
+    if identity.get('sourceIp'):
+        return identity['sourceIp']
+    all_headers = event.get('headers') or {}
+    forwarded = all_headers.get('X-Forwarded-For', '') or all_headers.get('x-forwarded-for', '')
+    return forwarded.split(',')[-1].strip() or None
+
+def rate_limit_key(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    value = value.strip().lower()
+    return value if '@' in value else normalize_phone(value)
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Приводит номер к E.164, как normalize_phone_e164 в БД; 8XXXXXXXXXX и 9XXXXXXXXX считаются российскими."""
+    if not phone:
+        return None
+    digits = re.sub(r'\D', '', phone)
+    if not phone.strip().startswith('+'):
+        if len(digits) == 11 and digits[0] == '8':
+            digits = '7' + digits[1:]
+        elif len(digits) == 10 and digits[0] == '9':
+            digits = '7' + digits
+    if not 10 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+# Хранилище короткоживущих кодов: SMS/email-подтверждения, коды и токены сброса пароля.
+# CODE_STORE_BACKEND=memory держит коды в памяти процесса — для тестов и замеров без БД
+CODE_STORE_BACKEND = os.environ.get('CODE_STORE_BACKEND', 'postgres')
+# Каждая N-я запись заодно удаляет порцию истёкших кодов
+CODE_SWEEP_EVERY = int(os.environ.get('CODE_SWEEP_EVERY', '100'))
+CODE_SWEEP_BATCH = int(os.environ.get('CODE_SWEEP_BATCH', '1000'))
+
+# (тип, адресат, код) -> (истекает, user_id)
+_memory_codes: Dict[Tuple[str, str, str], Tuple[float, Optional[str]]] = {}
+_code_store_lock = threading.Lock()
+_code_store_writes = {'count': 0}
+
+def code_store_put(cur, code_type: str, subject: str, code: str, ttl_seconds: int, user_id: Any = None) -> None:
+    # Для токенов-носителей адресат пустой: токен уникален сам по себе
+    subject = subject.lower()
+    if CODE_STORE_BACKEND == 'memory':
+        with _code_store_lock:
+            _memory_codes[(code_type, subject, code)] = (time.time() + ttl_seconds, str(user_id) if user_id else None)
+    else:
+        cur.execute(
+            f"""
+            INSERT INTO {SCHEMA}.auth_codes (code_type, subject, code, user_id, expires_at)
+            VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+            """,
+            (code_type, subject, code, user_id, ttl_seconds)
+        )
+    
+    with _code_store_lock:
+        _code_store_writes['count'] += 1
+        due = _code_store_writes['count'] % CODE_SWEEP_EVERY == 0
+    if due:
+        code_store_sweep(cur)
+
+def code_store_consume(cur, code_type: str, subject: str, code: str) -> Optional[Dict[str, Any]]:
+    """Гасит живой код одной операцией: повторно тот же код не пройдёт."""
+    subject = subject.lower()
+    if CODE_STORE_BACKEND == 'memory':
+        with _code_store_lock:
+            entry = _memory_codes.pop((code_type, subject, code), None)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return {'user_id': entry[1]}
+    
+    cur.execute(
+        f"""
+        DELETE FROM {SCHEMA}.auth_codes
+        WHERE id = (
+            SELECT id FROM {SCHEMA}.auth_codes
+            WHERE subject = %s AND code_type = %s AND code = %s
+            AND expires_at > CURRENT_TIMESTAMP
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING user_id
+        """,
+        (subject, code_type, code)
+    )
+    return cur.fetchone()
+
+def code_store_revoke(cur, code_type: Optional[str] = None, subject: Optional[str] = None, user_id: Any = None) -> None:
+    subject = subject.lower() if subject is not None else None
+    if CODE_STORE_BACKEND == 'memory':
+        with _code_store_lock:
+            for key, (_, owner) in list(_memory_codes.items()):
+                if (code_type is None or key[0] == code_type) and (subject is None or key[1] == subject) \
+                        and (user_id is None or owner == str(user_id)):
+                    del _memory_codes[key]
+        return
+    
+    cur.execute(
+        f"""
+        DELETE FROM {SCHEMA}.auth_codes
+        WHERE (%(code_type)s::text IS NULL OR code_type = %(code_type)s)
+        AND (%(subject)s::text IS NULL OR subject = %(subject)s)
+        AND (%(user_id)s::uuid IS NULL OR user_id = %(user_id)s::uuid)
+        """,
+        {'code_type': code_type, 'subject': subject, 'user_id': str(user_id) if user_id else None}
+    )
+
+def code_store_sweep(cur, limit: int = CODE_SWEEP_BATCH) -> int:
+    if CODE_STORE_BACKEND == 'memory':
+        now = time.time()
+        with _code_store_lock:
+            expired = [key for key, (expires, _) in _memory_codes.items() if expires <= now][:limit]
+            for key in expired:
+                del _memory_codes[key]
+        return len(expired)
+    
+    cur.execute(
+        f"""
+        DELETE FROM {SCHEMA}.auth_codes
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.auth_codes
+            WHERE expires_at <= CURRENT_TIMESTAMP
+            LIMIT %s
+        )
+        """,
+        (limit,)
+    )
+    return cur.rowcount
+
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_token(token: str) -> Optional[str]:
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', '60'))
+# Запас на транзакции, которые закоммитили отзыв позже, чем поставили revoked_at
+REVOCATION_SYNC_OVERLAP = float(os.environ.get('REVOCATION_SYNC_OVERLAP', '300'))
+SIGNED_TOKEN_PREFIX = 's1.'
+# user_id, family_id, member_id, выдан (мс), истекает (с), nonce
+_SIGNED_PAYLOAD = struct.Struct('>16s16s16sQI8s')
+
+_revocation_lock = threading.Lock()
+_revocation_state = {'revoked_since': 0.0, 'synced_at': 0.0}
+_revoked_nonces: Dict[str, float] = {}
+_revoked_users: Dict[str, float] = {}
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def decode_signed_token(token: str) -> Optional[Dict[str, Any]]:
+    if not SESSION_SIGNING_KEY or not token.startswith(SIGNED_TOKEN_PREFIX):
+        return None
+    try:
+        payload_b64, signature_b64 = token[len(SIGNED_TOKEN_PREFIX):].split('.')
+        payload = _b64decode(payload_b64)
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        return None
+    
+    expected = hmac.new(SESSION_SIGNING_KEY.encode(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, signature) or len(payload) != _SIGNED_PAYLOAD.size:
+        return None
+    
+    user_id, family_id, member_id, issued_at, expires_at, nonce = _SIGNED_PAYLOAD.unpack(payload)
+    if expires_at <= time.time():
+        return None
+    
+    return {
+        'user_id': str(uuid.UUID(bytes=user_id)),
+        'family_id': str(uuid.UUID(bytes=family_id)) if any(family_id) else None,
+        'member_id': str(uuid.UUID(bytes=member_id)) if any(member_id) else None,
+        'issued_at': issued_at / 1000,
+        'expires_at': expires_at,
+        'nonce': nonce.hex()
+    }
+
+def _refresh_revocations() -> None:
+    now = time.time()
+    with _revocation_lock:
+        if now - _revocation_state['synced_at'] < REVOCATION_REFRESH_INTERVAL:
+            return
+        _revocation_state['synced_at'] = now
+        since = _revocation_state['revoked_since']
+    
+    # id из последовательности выдаётся до коммита, поэтому новые отзывы ищутся по времени
+    # с перекрытием: запись, закоммиченная позже чужой, всё равно попадёт в следующую выборку
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp()) AS synced_at")
+        synced_at = float(cur.fetchone()['synced_at'])
+        cur.execute(
+            f"""
+            SELECT user_id, token_nonce,
+                   EXTRACT(EPOCH FROM revoked_at) AS revoked_at,
+                   EXTRACT(EPOCH FROM expires_at) AS expires_at
+            FROM {SCHEMA}.revoked_tokens
+            WHERE revoked_at > to_timestamp(%s) - make_interval(secs => %s)
+            AND expires_at > CURRENT_TIMESTAMP
+            """,
+            (since, REVOCATION_SYNC_OVERLAP)
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    # Повторно прочитанные записи безвредны: nonce — ключ словаря, для пользователя берётся максимум
+    with _revocation_lock:
+        for row in rows:
+            if row['token_nonce']:
+                _revoked_nonces[row['token_nonce']] = float(row['expires_at'])
+            else:
+                user_id = str(row['user_id'])
+                _revoked_users[user_id] = max(_revoked_users.get(user_id, 0.0), float(row['revoked_at']))
+        _revocation_state['revoked_since'] = max(_revocation_state['revoked_since'], synced_at)
+        for nonce in [n for n, expires_at in _revoked_nonces.items() if expires_at <= now]:
+            del _revoked_nonces[nonce]
+
+def is_signed_token_revoked(claims: Dict[str, Any]) -> bool:
+    _refresh_revocations()
+    with _revocation_lock:
+        if claims['nonce'] in _revoked_nonces:
+            return True
+        return claims['issued_at'] < _revoked_users.get(claims['user_id'], 0.0)
+
+def revoke_signed_tokens(cur, user_id: str) -> None:
+    # Остальные функции подтягивают отзывы периодически, см. REVOCATION_REFRESH_INTERVAL
+    if not SESSION_SIGNING_KEY:
+        return
     
     cur.execute(
         f"""
-        SELECT user_id FROM {SCHEMA}.sessions 
-        WHERE token = %s AND expires_at > CURRENT_TIMESTAMP
+        INSERT INTO {SCHEMA}.revoked_tokens (user_id, expires_at)
+        VALUES (%s, CURRENT_TIMESTAMP + INTERVAL '30 days')
         """,
-        (token,)
+        (user_id,)
     )
-    session = cur.fetchone()
-    cur.close()
-    conn.close()
+    # Этот экземпляр узнаёт об отзыве сразу, не дожидаясь следующей подгрузки
+    with _revocation_lock:
+        _revoked_users[user_id] = max(_revoked_users.get(user_id, 0.0), time.time())
+
+def get_auth_context(token: str) -> Optional[Dict[str, Any]]:
+    if not token:
+        return None
+    
+    # Подписанный токен проверяется без обращения к sessions
+    claims = decode_signed_token(token)
+    if claims and claims['family_id'] and not is_signed_token_revoked(claims):
+        return {
+            'user_id': claims['user_id'],
+            'family_id': claims['family_id'],
+            'member_id': claims['member_id'],
+            'family_name': None,
+            'permissions': None
+        }
+    
+    found, cached = _token_cache_get(token)
+    if found:
+        return cached
+    
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+    try:
+        execute_prepared(cur, 'auth_context', (token,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+        release_db_connection(conn)
+    
+    auth = None
+    if row:
+        auth = {
+            'user_id': str(row['user_id']),
+            'family_id': str(row['family_id']) if row['family_id'] else None,
+            'member_id': str(row['member_id']) if row['member_id'] else None,
+            'family_name': row['family_name'],
+            'permissions': row['permissions'] or {}
+        }
     
-    return str(session['user_id']) if session else None
+    _token_cache_put(token, auth)
+    return auth
 
 def update_member_profile(user_id: str, name: str, role: str, relationship: str, avatar: str) -> Dict[str, Any]:
     conn = get_db_connection()
@@ -47,17 +546,23 @@ def update_member_profile(user_id: str, name: str, role: str, relationship: str,
     try:
         cur.execute(
             f"""
-            UPDATE {SCHEMA}.family_members
-            SET name = %s, role = %s, relationship = %s, avatar = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE user_id = %s
-            RETURNING id, name, role, relationship, avatar
+            WITH updated AS (
+                UPDATE {SCHEMA}.family_members
+                SET name = %s, role = %s, relationship = %s, avatar = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s
+                RETURNING id, name, role, relationship, avatar, family_id
+            ), bumped AS (
+                UPDATE {SCHEMA}.families SET data_version = data_version + 1
+                WHERE id IN (SELECT family_id FROM updated)
+            )
+            SELECT id, name, role, relationship, avatar FROM updated
             """,
             (name, role, relationship, avatar, user_id)
         )
         member = cur.fetchone()
         conn.commit()
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         
         if not member:
             return {'error': 'Профиль не найден'}
@@ -69,33 +574,31 @@ def update_member_profile(user_id: str, name: str, role: str, relationship: str,
     except Exception as e:
         conn.rollback()
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         return {'error': str(e)}
 
+VERIFICATION_CODE_TTL = 10 * 60
+RESET_LINK_TTL = 60 * 60
+
 def send_verification_code(email: Optional[str] = None, phone: Optional[str] = None) -> Dict[str, Any]:
     if not email and not phone:
         return {'error': 'Требуется email или телефон'}
     
+    if not email:
+        phone = normalize_phone(phone)
+        if not phone:
+            return {'error': 'Некорректный номер телефона'}
+    
     code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-    expires_at = datetime.now() + timedelta(minutes=10)
     
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
     try:
-        cur.execute(
-            f"""
-            INSERT INTO {SCHEMA}.verification_codes 
-            (email, phone, code, code_type, expires_at)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id, code
-            """,
-            (email, phone, code, 'email' if email else 'sms', expires_at)
-        )
-        result = cur.fetchone()
+        code_store_put(cur, 'email' if email else 'sms', email or phone, code, VERIFICATION_CODE_TTL)
         conn.commit()
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         
         return {
             'success': True,
@@ -105,53 +608,38 @@ def send_verification_code(email: Optional[str] = None, phone: Optional[str] = N
     except Exception as e:
         conn.rollback()
         cur.close()
-        conn.close()
+        release_db_connection(conn)
         return {'error': str(e)}
 
 def verify_code(email: Optional[str], phone: Optional[str], code: str) -> Dict[str, Any]:
+    code_type = 'email' if email else 'sms'
+    value = email or normalize_phone(phone)
+    if not value:
+        return {'error': 'Неверный или истёкший код'}
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    field = 'email' if email else 'phone'
-    value = email or phone
-    
-    cur.execute(
-        f"""
-        SELECT id, user_id FROM {SCHEMA}.verification_codes
-        WHERE {field} = %s AND code = %s AND expires_at > CURRENT_TIMESTAMP AND used = FALSE
-        ORDER BY created_at DESC LIMIT 1
-        """,
-        (value, code)
-    )
-    verification = cur.fetchone()
-    
-    if not verification:
+    try:
+        verification = code_store_consume(cur, code_type, value, code)
+        
+        if not verification:
+            return {'error': 'Неверный или истёкший код'}
+        
+        if verification['user_id']:
+            cur.execute(
+                f"""
+                UPDATE {SCHEMA}.users
+                SET is_verified = TRUE
+                WHERE id = %s
+                """,
+                (verification['user_id'],)
+            )
+        
+        conn.commit()
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Неверный или истёкший код'}
-    
-    cur.execute(
-        f"""
-        UPDATE {SCHEMA}.verification_codes
-        SET used = TRUE
-        WHERE id = %s
-        """,
-        (verification['id'],)
-    )
-    
-    if verification['user_id']:
-        cur.execute(
-            f"""
-            UPDATE {SCHEMA}.users
-            SET is_verified = TRUE
-            WHERE id = %s
-            """,
-            (verification['user_id'],)
-        )
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+        release_db_connection(conn)
     
     return {
         'success': True,
@@ -162,44 +650,43 @@ def request_password_reset(email: Optional[str], phone: Optional[str]) -> Dict[s
     if not email and not phone:
         return {'error': 'Требуется email или телефон'}
     
+    value = email or normalize_phone(phone)
+    if not value:
+        return {'error': 'Некорректный номер телефона'}
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    field = 'email' if email else 'phone'
-    value = email or phone
-    
-    cur.execute(
-        f"SELECT id FROM {SCHEMA}.users WHERE {field} = %s",
-        (value,)
-    )
-    user = cur.fetchone()
-    
-    if not user:
+    try:
+        if email:
+            cur.execute(f"SELECT id FROM {SCHEMA}.users WHERE email = %s", (email,))
+        else:
+            # Нечёткие дубли, оставшиеся без phone_e164 после V0016, находятся по исходной строке номера
+            cur.execute(
+                f"""
+                SELECT id FROM {SCHEMA}.users
+                WHERE phone_e164 = %s OR (phone_e164 IS NULL AND phone = %s)
+                ORDER BY phone_e164 IS NULL
+                LIMIT 1
+                """,
+                (value, phone)
+            )
+        user = cur.fetchone()
+        
+        if not user:
+            return {'error': 'Пользователь не найден'}
+        
+        token = secrets.token_urlsafe(48)
+        code_store_put(cur, 'reset_token', '', token, RESET_LINK_TTL, user['id'])
+        conn.commit()
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Пользователь не найден'}
-    
-    token = secrets.token_urlsafe(48)
-    expires_at = datetime.now() + timedelta(hours=1)
-    
-    cur.execute(
-        f"""
-        INSERT INTO {SCHEMA}.password_reset_tokens
-        (user_id, token, expires_at)
-        VALUES (%s, %s, %s)
-        RETURNING token
-        """,
-        (user['id'], token, expires_at)
-    )
-    result = cur.fetchone()
-    conn.commit()
-    cur.close()
-    conn.close()
+        release_db_connection(conn)
     
     return {
         'success': True,
         'message': f'Ссылка для восстановления отправлена на {value}',
-        'token_for_demo': result['token']
+        'token_for_demo': token
     }
 
 def reset_password(token: str, new_password: str) -> Dict[str, Any]:
@@ -209,49 +696,40 @@ def reset_password(token: str, new_password: str) -> Dict[str, Any]:
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
-    cur.execute(
-        f"""
-        SELECT user_id FROM {SCHEMA}.password_reset_tokens
-        WHERE token = %s AND expires_at > CURRENT_TIMESTAMP AND used = FALSE
-        """,
-        (token,)
-    )
-    reset = cur.fetchone()
-    
-    if not reset:
+    try:
+        reset = code_store_consume(cur, 'reset_token', '', token)
+        
+        if not reset:
+            return {'error': 'Неверная или истёкшая ссылка'}
+        
+        user_id = str(reset['user_id'])
+        password_hash = hash_password(new_password)
+        
+        cur.execute(
+            f"""
+            UPDATE {SCHEMA}.users
+            SET password_hash = %s
+            WHERE id = %s
+            """,
+            (password_hash, user_id)
+        )
+        
+        # Как в auth: все сессии и подписанные токены пользователя перестают действовать
+        cur.execute(f"UPDATE {SCHEMA}.sessions SET expires_at = CURRENT_TIMESTAMP WHERE user_id = %s", (user_id,))
+        revoke_signed_tokens(cur, user_id)
+        conn.commit()
+        invalidate_token_cache(user_id=user_id)
+    finally:
         cur.close()
-        conn.close()
-        return {'error': 'Неверная или истёкшая ссылка'}
-    
-    password_hash = hash_password(new_password)
-    
-    cur.execute(
-        f"""
-        UPDATE {SCHEMA}.users
-        SET password_hash = %s
-        WHERE id = %s
-        """,
-        (password_hash, reset['user_id'])
-    )
-    
-    cur.execute(
-        f"""
-        UPDATE {SCHEMA}.password_reset_tokens
-        SET used = TRUE
-        WHERE token = %s
-        """,
-        (token,)
-    )
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+        release_db_connection(conn)
     
     return {
         'success': True,
         'message': 'Пароль успешно изменён'
     }
 
+RATE_LIMITED_ACTIONS = {'send_verification', 'verify_code', 'request_reset'}
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -276,11 +754,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         body = json.loads(event.get('body', '{}'))
         action = body.get('action', '')
         
+        # Отсекаем шквал повторов до любого обращения к БД; семья — из подписи токена, без запроса
+        if action in RATE_LIMITED_ACTIONS:
+            claims = decode_signed_token((event.get('headers') or {}).get('X-Auth-Token', ''))
+            retry_after = check_rate_limit([
+                ('ip', client_ip(event)),
+                ('phone', rate_limit_key(body.get('phone') or body.get('email'))),
+                ('family', claims['family_id'] if claims else None)
+            ])
+            if retry_after:
+                return {
+                    'statusCode': 429,
+                    'headers': dict(headers, **{'Retry-After': str(retry_after)}),
+                    'body': json.dumps({'error': 'Слишком много попыток, повторите позже', 'retry_after': retry_after})
+                }
+        
         if action == 'update_profile':
             token = event.get('headers', {}).get('X-Auth-Token', '')
-            user_id = verify_token(token)
+            auth = get_auth_context(token)
             
-            if not user_id:
+            if not auth:
                 return {
                     'statusCode': 401,
                     'headers': headers,
@@ -288,7 +781,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 }
             
             result = update_member_profile(
-                user_id,
+                auth['user_id'],
                 body.get('name', ''),
                 body.get('role', ''),
                 body.get('relationship', ''),
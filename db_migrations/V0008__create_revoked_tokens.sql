@@ -0,0 +1,12 @@
+-- Список отзыва подписанных токенов сессий (logout, сброс пароля, удаление аккаунта)
+CREATE TABLE IF NOT EXISTS t_p5815085_family_assistant_pro.revoked_tokens (
+    id BIGSERIAL PRIMARY KEY,
+    token_nonce VARCHAR(16),
+    user_id UUID,
+    revoked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL,
+    CONSTRAINT check_nonce_or_user CHECK (token_nonce IS NOT NULL OR user_id IS NOT NULL)
+);
+
+-- Индекс для инкрементальной подгрузки и очистки истёкших записей
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires ON t_p5815085_family_assistant_pro.revoked_tokens(expires_at);
@@ -0,0 +1,82 @@
+-- Надгробия удалённых строк для инкрементальной синхронизации family-data
+CREATE TABLE IF NOT EXISTS t_p5815085_family_assistant_pro.sync_tombstones (
+    id BIGSERIAL PRIMARY KEY,
+    family_id TEXT NOT NULL,
+    section VARCHAR(50) NOT NULL,
+    row_id TEXT NOT NULL,
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_sync_tombstones_family_section
+ON t_p5815085_family_assistant_pro.sync_tombstones(family_id, section, deleted_at);
+
+-- Строка удалена или ушла из семьи (family_id сменился, например на NULL)
+CREATE OR REPLACE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone() RETURNS trigger AS $$
+BEGIN
+    IF OLD.family_id IS NOT NULL
+       AND (TG_OP = 'DELETE' OR OLD.family_id IS DISTINCT FROM NEW.family_id) THEN
+        INSERT INTO t_p5815085_family_assistant_pro.sync_tombstones (family_id, section, row_id)
+        VALUES (OLD.family_id::text, TG_ARGV[0], OLD.id::text);
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_family_members_sync_tombstone ON t_p5815085_family_assistant_pro.family_members;
+CREATE TRIGGER trg_family_members_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.family_members
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('members');
+
+DROP TRIGGER IF EXISTS trg_tasks_sync_tombstone ON t_p5815085_family_assistant_pro.tasks;
+CREATE TRIGGER trg_tasks_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.tasks
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('tasks');
+
+DROP TRIGGER IF EXISTS trg_children_profiles_sync_tombstone ON t_p5815085_family_assistant_pro.children_profiles;
+CREATE TRIGGER trg_children_profiles_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.children_profiles
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('children_profiles');
+
+DROP TRIGGER IF EXISTS trg_calendar_events_sync_tombstone ON t_p5815085_family_assistant_pro.calendar_events;
+CREATE TRIGGER trg_calendar_events_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.calendar_events
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('calendar_events');
+
+DROP TRIGGER IF EXISTS trg_family_values_sync_tombstone ON t_p5815085_family_assistant_pro.family_values;
+CREATE TRIGGER trg_family_values_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.family_values
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('family_values');
+
+DROP TRIGGER IF EXISTS trg_traditions_sync_tombstone ON t_p5815085_family_assistant_pro.traditions;
+CREATE TRIGGER trg_traditions_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.traditions
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('traditions');
+
+DROP TRIGGER IF EXISTS trg_blog_posts_sync_tombstone ON t_p5815085_family_assistant_pro.blog_posts;
+CREATE TRIGGER trg_blog_posts_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.blog_posts
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('blog_posts');
+
+DROP TRIGGER IF EXISTS trg_family_album_sync_tombstone ON t_p5815085_family_assistant_pro.family_album;
+CREATE TRIGGER trg_family_album_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.family_album
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('family_album');
+
+DROP TRIGGER IF EXISTS trg_family_tree_sync_tombstone ON t_p5815085_family_assistant_pro.family_tree;
+CREATE TRIGGER trg_family_tree_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.family_tree
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('family_tree');
+
+DROP TRIGGER IF EXISTS trg_chat_messages_sync_tombstone ON t_p5815085_family_assistant_pro.chat_messages;
+CREATE TRIGGER trg_chat_messages_sync_tombstone
+AFTER DELETE OR UPDATE OF family_id ON t_p5815085_family_assistant_pro.chat_messages
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone('chat_messages');
+
+-- Индексы по курсорам инкрементальной синхронизации
+CREATE INDEX IF NOT EXISTS idx_tasks_family_updated ON t_p5815085_family_assistant_pro.tasks(family_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_family_members_family_updated ON t_p5815085_family_assistant_pro.family_members(family_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_family_created ON t_p5815085_family_assistant_pro.chat_messages(family_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_family_album_family_created ON t_p5815085_family_assistant_pro.family_album(family_id, created_at);
\ No newline at end of file
@@ -0,0 +1,3 @@
+-- Монотонная версия данных семьи для ETag / If-None-Match
+ALTER TABLE t_p5815085_family_assistant_pro.families
+ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
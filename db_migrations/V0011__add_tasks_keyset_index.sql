@@ -0,0 +1,3 @@
+-- Составной индекс для постраничной выдачи задач по курсору (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_tasks_family_created_id
+ON t_p5815085_family_assistant_pro.tasks(family_id, created_at DESC, id DESC);
@@ -0,0 +1,4 @@
+-- Индекс для пакетной материализации повторяющихся задач по всем семьям
+CREATE INDEX IF NOT EXISTS idx_tasks_due_recurrence
+ON t_p5815085_family_assistant_pro.tasks (next_occurrence)
+WHERE is_recurring = TRUE AND completed = TRUE;
@@ -0,0 +1,27 @@
+-- Очередь фоновых экспортов данных семьи с кешем готовых файлов по версии данных
+CREATE TABLE IF NOT EXISTS t_p5815085_family_assistant_pro.export_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    family_id UUID NOT NULL REFERENCES t_p5815085_family_assistant_pro.families(id),
+    requested_by UUID REFERENCES t_p5815085_family_assistant_pro.users(id),
+    format VARCHAR(20) NOT NULL,
+    family_version BIGINT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    artifact BYTEA,
+    content_type VARCHAR(100),
+    filename VARCHAR(255),
+    checksum VARCHAR(64),
+    size_bytes BIGINT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Поиск готового или уже поставленного экспорта той же версии
+CREATE INDEX IF NOT EXISTS idx_export_jobs_family_version
+ON t_p5815085_family_assistant_pro.export_jobs(family_id, format, family_version);
+
+-- Выборка задач воркером в порядке очереди
+CREATE INDEX IF NOT EXISTS idx_export_jobs_pending
+ON t_p5815085_family_assistant_pro.export_jobs(created_at)
+WHERE status = 'pending';
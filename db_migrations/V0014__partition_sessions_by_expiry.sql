@@ -0,0 +1,58 @@
+-- Сессии секционируются по месяцу истечения: прошедшие месяцы удаляются целиком (DROP), без VACUUM
+DO $$
+DECLARE
+    month_start DATE;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 't_p5815085_family_assistant_pro' AND c.relname = 'sessions' AND c.relkind = 'p'
+    ) THEN
+        RETURN;
+    END IF;
+
+    -- Первичный ключ секционированной таблицы обязан включать ключ секционирования
+    CREATE TABLE t_p5815085_family_assistant_pro.sessions_partitioned (
+        id UUID NOT NULL DEFAULT gen_random_uuid(),
+        user_id UUID NOT NULL REFERENCES t_p5815085_family_assistant_pro.users(id),
+        token VARCHAR(255) NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ip_address VARCHAR(45),
+        user_agent TEXT,
+        PRIMARY KEY (id, expires_at)
+    ) PARTITION BY RANGE (expires_at);
+
+    -- Месячные секции с прошлого месяца на год вперёд; дальше их создаёт очистка сессий в auth
+    month_start := date_trunc('month', CURRENT_DATE - INTERVAL '1 month')::date;
+    WHILE month_start < date_trunc('month', CURRENT_DATE + INTERVAL '13 months')::date LOOP
+        EXECUTE format(
+            'CREATE TABLE t_p5815085_family_assistant_pro.%I PARTITION OF t_p5815085_family_assistant_pro.sessions_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'sessions_p' || to_char(month_start, 'YYYYMM'),
+            month_start,
+            (month_start + INTERVAL '1 month')::date
+        );
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+
+    CREATE TABLE t_p5815085_family_assistant_pro.sessions_default
+    PARTITION OF t_p5815085_family_assistant_pro.sessions_partitioned DEFAULT;
+
+    -- Переносим только живые сессии, истёкшие остаются в старой таблице
+    INSERT INTO t_p5815085_family_assistant_pro.sessions_partitioned
+    SELECT id, user_id, token, expires_at, created_at, ip_address, user_agent
+    FROM t_p5815085_family_assistant_pro.sessions
+    WHERE expires_at > CURRENT_TIMESTAMP;
+
+    ALTER TABLE t_p5815085_family_assistant_pro.sessions RENAME TO sessions_legacy;
+    ALTER TABLE t_p5815085_family_assistant_pro.sessions_partitioned RENAME TO sessions;
+END $$;
+
+-- Уникальность токена глобально не проверить без ключа секционирования, поэтому индексы обычные
+CREATE INDEX IF NOT EXISTS idx_sessions_part_token
+ON t_p5815085_family_assistant_pro.sessions(token);
+
+CREATE INDEX IF NOT EXISTS idx_sessions_part_user_created
+ON t_p5815085_family_assistant_pro.sessions(user_id, created_at DESC);
+
+DROP TABLE IF EXISTS t_p5815085_family_assistant_pro.sessions_legacy;
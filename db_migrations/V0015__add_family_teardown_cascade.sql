@@ -0,0 +1,48 @@
+-- Семья без участников помечается удалённой, её данные дочищаются фоном порциями
+ALTER TABLE t_p5815085_family_assistant_pro.families
+ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_families_deleted_at
+ON t_p5815085_family_assistant_pro.families(deleted_at)
+WHERE deleted_at IS NOT NULL;
+
+-- Внешние ключи пересоздаются с ON DELETE, чтобы удаление семьи или задачи не требовало ручного порядка
+DO $$
+DECLARE
+    fk RECORD;
+    target RECORD;
+BEGIN
+    FOR target IN
+        SELECT * FROM (VALUES
+            ('tasks', 'assignee_id', 'SET NULL'),
+            ('tasks', 'family_id', 'CASCADE'),
+            ('reminders', 'task_id', 'CASCADE'),
+            ('family_members', 'family_id', 'CASCADE'),
+            ('family_invites', 'family_id', 'CASCADE'),
+            ('subscriptions', 'family_id', 'CASCADE'),
+            ('payments', 'family_id', 'CASCADE'),
+            ('payments', 'subscription_id', 'CASCADE'),
+            ('export_jobs', 'family_id', 'CASCADE')
+        ) AS t(table_name, column_name, on_delete)
+    LOOP
+        FOR fk IN
+            SELECT c.conname, c.confrelid::regclass AS ref_table, ra.attname AS ref_column
+            FROM pg_constraint c
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+            JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = c.confkey[1]
+            WHERE c.contype = 'f'
+              AND c.conrelid = format('t_p5815085_family_assistant_pro.%I', target.table_name)::regclass
+              AND a.attname = target.column_name
+              AND array_length(c.conkey, 1) = 1
+        LOOP
+            EXECUTE format(
+                'ALTER TABLE t_p5815085_family_assistant_pro.%I DROP CONSTRAINT %I, ADD CONSTRAINT %I FOREIGN KEY (%I) REFERENCES %s(%I) ON DELETE %s',
+                target.table_name, fk.conname, fk.conname, target.column_name, fk.ref_table, fk.ref_column, target.on_delete
+            );
+        END LOOP;
+    END LOOP;
+END $$;
+
+-- Каскадное удаление напоминаний вместе с задачами ищет их по task_id
+CREATE INDEX IF NOT EXISTS idx_reminders_task_id
+ON t_p5815085_family_assistant_pro.reminders(task_id);
@@ -0,0 +1,85 @@
+-- Канонический номер в E.164: "+7 (900) 123-45-67" и "89001234567" дают один ключ
+ALTER TABLE t_p5815085_family_assistant_pro.users
+ADD COLUMN IF NOT EXISTS phone_e164 VARCHAR(16);
+
+-- Повторяет normalize_phone из backend/auth и backend/user-management
+CREATE OR REPLACE FUNCTION t_p5815085_family_assistant_pro.normalize_phone_e164(raw TEXT)
+RETURNS TEXT AS $$
+DECLARE
+    digits TEXT := regexp_replace(coalesce(raw, ''), '\D', '', 'g');
+BEGIN
+    IF btrim(coalesce(raw, '')) NOT LIKE '+%' THEN
+        IF length(digits) = 11 AND left(digits, 1) = '8' THEN
+            digits := '7' || substr(digits, 2);
+        ELSIF length(digits) = 10 AND left(digits, 1) = '9' THEN
+            digits := '7' || digits;
+        END IF;
+    END IF;
+    IF length(digits) NOT BETWEEN 10 AND 15 THEN
+        RETURN NULL;
+    END IF;
+    RETURN '+' || digits;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Колонка заполняется при любой записи телефона
+CREATE OR REPLACE FUNCTION t_p5815085_family_assistant_pro.users_set_phone_e164()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.phone_e164 := t_p5815085_family_assistant_pro.normalize_phone_e164(NEW.phone);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_phone_e164 ON t_p5815085_family_assistant_pro.users;
+CREATE TRIGGER trg_users_phone_e164
+BEFORE INSERT OR UPDATE OF phone ON t_p5815085_family_assistant_pro.users
+FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.users_set_phone_e164();
+
+-- Уникальный индекс строится до заполнения: NULL не конфликтуют, а проверка занятости идёт по нему
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_phone_e164
+ON t_p5815085_family_assistant_pro.users(phone_e164);
+
+-- Дубли без phone_e164 и аккаунт, за которым закреплён номер: список для ручного слияния.
+-- До слияния вход и сброс пароля находят такие аккаунты по исходной строке phone
+CREATE OR REPLACE VIEW t_p5815085_family_assistant_pro.users_phone_conflicts AS
+SELECT d.id, d.phone, d.created_at, owner.id AS owner_id, owner.phone_e164
+FROM t_p5815085_family_assistant_pro.users d
+JOIN t_p5815085_family_assistant_pro.users owner
+  ON owner.phone_e164 = t_p5815085_family_assistant_pro.normalize_phone_e164(d.phone)
+WHERE d.phone_e164 IS NULL;
+
+-- Заполнение существующих строк порциями. Из нечётких дублей номер получает самый ранний
+-- пользователь, остальные остаются с NULL до ручного слияния; их число выводится предупреждением
+DO $$
+DECLARE
+    updated INTEGER;
+    conflicts INTEGER;
+BEGIN
+    LOOP
+        UPDATE t_p5815085_family_assistant_pro.users u
+        SET phone_e164 = batch.phone_e164
+        FROM (
+            SELECT DISTINCT ON (t_p5815085_family_assistant_pro.normalize_phone_e164(c.phone))
+                   c.id, t_p5815085_family_assistant_pro.normalize_phone_e164(c.phone) AS phone_e164
+            FROM t_p5815085_family_assistant_pro.users c
+            WHERE c.phone_e164 IS NULL
+              AND t_p5815085_family_assistant_pro.normalize_phone_e164(c.phone) IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM t_p5815085_family_assistant_pro.users taken
+                  WHERE taken.phone_e164 = t_p5815085_family_assistant_pro.normalize_phone_e164(c.phone)
+              )
+            ORDER BY t_p5815085_family_assistant_pro.normalize_phone_e164(c.phone), c.created_at, c.id
+            LIMIT 5000
+        ) batch
+        WHERE u.id = batch.id;
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+    END LOOP;
+    
+    SELECT COUNT(*) INTO conflicts
+    FROM t_p5815085_family_assistant_pro.users_phone_conflicts;
+    IF conflicts > 0 THEN
+        RAISE WARNING 'phone_e164: % аккаунтов-дублей оставлены без номера, см. users_phone_conflicts', conflicts;
+    END IF;
+END $$;
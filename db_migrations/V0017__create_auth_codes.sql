@@ -0,0 +1,24 @@
+-- Единое хранилище короткоживущих кодов вместо verification_codes и password_reset_tokens.
+-- Использованный код удаляется сразу, истёкшие — порциями при записи и по расписанию
+CREATE TABLE IF NOT EXISTS t_p5815085_family_assistant_pro.auth_codes (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    code_type VARCHAR(20) NOT NULL,
+    subject VARCHAR(255) NOT NULL DEFAULT '',
+    code VARCHAR(128) NOT NULL,
+    user_id UUID REFERENCES t_p5815085_family_assistant_pro.users(id) ON DELETE CASCADE,
+    expires_at TIMESTAMP NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Проверка кода: адресат (телефон/email, для токенов пусто), тип и сам код
+CREATE INDEX IF NOT EXISTS idx_auth_codes_lookup
+ON t_p5815085_family_assistant_pro.auth_codes(subject, code_type, code);
+
+-- Отзыв кодов пользователя и каскад при удалении аккаунта
+CREATE INDEX IF NOT EXISTS idx_auth_codes_user
+ON t_p5815085_family_assistant_pro.auth_codes(user_id)
+WHERE user_id IS NOT NULL;
+
+-- Очистка истёкших
+CREATE INDEX IF NOT EXISTS idx_auth_codes_expires
+ON t_p5815085_family_assistant_pro.auth_codes(expires_at);
@@ -0,0 +1,9 @@
+-- Опорная дата ряда повторений: next_occurrence сдвигается после каждого выполнения,
+-- а день месяца для ежемесячных и ежегодных задач берётся от неизменной опоры
+ALTER TABLE t_p5815085_family_assistant_pro.tasks
+ADD COLUMN IF NOT EXISTS recurrence_anchor DATE;
+
+-- Для существующих задач опорой становится текущая дата повторения
+UPDATE t_p5815085_family_assistant_pro.tasks
+SET recurrence_anchor = COALESCE(next_occurrence, created_at::date)
+WHERE is_recurring = TRUE AND recurrence_anchor IS NULL;
@@ -0,0 +1,4 @@
+-- Поиск зависших задач экспорта, у которых истекла аренда воркера
+CREATE INDEX IF NOT EXISTS idx_export_jobs_running
+ON t_p5815085_family_assistant_pro.export_jobs(started_at)
+WHERE status = 'running';
@@ -0,0 +1,29 @@
+-- Удаление аккаунта не должно упираться в выгрузки, которые пользователь когда-то запрашивал в живой семье
+ALTER TABLE t_p5815085_family_assistant_pro.export_jobs
+ALTER COLUMN requested_by DROP NOT NULL;
+
+DO $$
+DECLARE
+    fk RECORD;
+BEGIN
+    FOR fk IN
+        SELECT c.conname, c.confrelid::regclass AS ref_table, ra.attname AS ref_column
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = c.confkey[1]
+        WHERE c.contype = 'f'
+          AND c.conrelid = 't_p5815085_family_assistant_pro.export_jobs'::regclass
+          AND a.attname = 'requested_by'
+          AND array_length(c.conkey, 1) = 1
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE t_p5815085_family_assistant_pro.export_jobs DROP CONSTRAINT %I, ADD CONSTRAINT %I FOREIGN KEY (requested_by) REFERENCES %s(%I) ON DELETE SET NULL',
+            fk.conname, fk.conname, fk.ref_table, fk.ref_column
+        );
+    END LOOP;
+END $$;
+
+-- Поиск выгрузок пользователя при удалении аккаунта
+CREATE INDEX IF NOT EXISTS idx_export_jobs_requested_by
+ON t_p5815085_family_assistant_pro.export_jobs(requested_by)
+WHERE requested_by IS NOT NULL;
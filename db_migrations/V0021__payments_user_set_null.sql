@@ -0,0 +1,28 @@
+-- Платежи остаются в истории семьи после удаления аккаунта плательщика
+ALTER TABLE t_p5815085_family_assistant_pro.payments
+ALTER COLUMN user_id DROP NOT NULL;
+
+DO $$
+DECLARE
+    fk RECORD;
+BEGIN
+    FOR fk IN
+        SELECT c.conname, c.confrelid::regclass AS ref_table, ra.attname AS ref_column
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = c.confkey[1]
+        WHERE c.contype = 'f'
+          AND c.conrelid = 't_p5815085_family_assistant_pro.payments'::regclass
+          AND a.attname = 'user_id'
+          AND array_length(c.conkey, 1) = 1
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE t_p5815085_family_assistant_pro.payments DROP CONSTRAINT %I, ADD CONSTRAINT %I FOREIGN KEY (user_id) REFERENCES %s(%I) ON DELETE SET NULL',
+            fk.conname, fk.conname, fk.ref_table, fk.ref_column
+        );
+    END LOOP;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_payments_user
+ON t_p5815085_family_assistant_pro.payments(user_id)
+WHERE user_id IS NOT NULL;
@@ -0,0 +1,3 @@
+-- Инкрементальная подгрузка отзывов идёт по времени отзыва, а не по id последовательности
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at
+ON t_p5815085_family_assistant_pro.revoked_tokens(revoked_at);
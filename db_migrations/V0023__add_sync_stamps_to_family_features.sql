@@ -0,0 +1,44 @@
+-- Таблицы V0006 без updated_at синхронизировались по created_at, и правки строк до клиента не доходили.
+-- Метку ставит триггер по clock_timestamp(): время начала транзакции могло оказаться позади уже выданного курсора
+CREATE OR REPLACE FUNCTION t_p5815085_family_assistant_pro.touch_sync_stamp() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    target TEXT;
+BEGIN
+    FOREACH target IN ARRAY ARRAY['family_values', 'traditions', 'family_album', 'family_tree', 'chat_messages'] LOOP
+        EXECUTE format('ALTER TABLE t_p5815085_family_assistant_pro.%I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP', target);
+        EXECUTE format('UPDATE t_p5815085_family_assistant_pro.%I SET updated_at = created_at WHERE updated_at IS NULL', target);
+    END LOOP;
+    
+    FOREACH target IN ARRAY ARRAY[
+        'children_profiles', 'calendar_events', 'blog_posts',
+        'family_values', 'traditions', 'family_album', 'family_tree', 'chat_messages'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON t_p5815085_family_assistant_pro.%I', 'trg_' || target || '_sync_stamp', target);
+        EXECUTE format(
+            'CREATE TRIGGER %I BEFORE INSERT OR UPDATE ON t_p5815085_family_assistant_pro.%I FOR EACH ROW EXECUTE FUNCTION t_p5815085_family_assistant_pro.touch_sync_stamp()',
+            'trg_' || target || '_sync_stamp', target
+        );
+    END LOOP;
+END $$;
+
+-- Надгробия тоже получают метку момента удаления, а не начала транзакции
+CREATE OR REPLACE FUNCTION t_p5815085_family_assistant_pro.record_sync_tombstone() RETURNS trigger AS $$
+BEGIN
+    IF OLD.family_id IS NOT NULL
+       AND (TG_OP = 'DELETE' OR OLD.family_id IS DISTINCT FROM NEW.family_id) THEN
+        INSERT INTO t_p5815085_family_assistant_pro.sync_tombstones (family_id, section, row_id, deleted_at)
+        VALUES (OLD.family_id::text, TG_ARGV[0], OLD.id::text, clock_timestamp());
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        RETURN OLD;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
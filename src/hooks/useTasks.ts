@@ -23,6 +23,7 @@ interface Task {
 }
 
 const API_URL = 'https://functions.poehali.dev/638290a3-bc43-46ef-9ca1-1e80b72544bf';
+const TASKS_PAGE_LIMIT = 100;
 
 export function useTasks() {
   const [tasks, setTasks] = useState<Task[]>([]);
@@ -38,17 +39,32 @@ export function useTasks() {
     }
     
     try {
-      const url = completed !== undefined ? `${API_URL}?completed=${completed}` : API_URL;
-      const response = await fetch(url, {
-        headers: {
-          'X-Auth-Token': getAuthToken()
-        }
-      });
+      const allTasks: Task[] = [];
+      let cursor: string | null = null;
+      let response: Response;
+      let data: { tasks?: Task[]; next_cursor?: string | null; error?: string };
       
-      const data = await response.json();
+      do {
+        const params = new URLSearchParams();
+        params.set('limit', String(TASKS_PAGE_LIMIT));
+        if (completed !== undefined) params.set('completed', String(completed));
+        if (cursor) params.set('cursor', cursor);
+        const query = params.toString();
+        response = await fetch(query ? `${API_URL}?${query}` : API_URL, {
+          headers: {
+            'X-Auth-Token': getAuthToken()
+          }
+        });
+        
+        data = await response.json();
+        if (!response.ok || !data.tasks) break;
+        
+        allTasks.push(...data.tasks);
+        cursor = data.next_cursor || null;
+      } while (cursor);
       
       if (response.ok && data.tasks) {
-        setTasks(data.tasks);
+        setTasks(allTasks);
       } else {
         if (!silent) {
           setTasks([]);